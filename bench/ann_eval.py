@@ -0,0 +1,95 @@
+# IVF index evaluation against exact search on a synthetic gallery: recall@k and QPS per nprobe
+#
+#   python bench/ann_eval.py --points 200000 --identities 50000 --nprobe 1 4 8 16 32 64
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from ann_index import IVFIndex, normalize  # noqa: E402
+
+
+def synthetic_gallery(points, identities, dim, noise, queries, seed=0):
+    """Face-like gallery: several noisy normalized samples around each identity center"""
+    rng = np.random.default_rng(seed)
+    centers = normalize(rng.standard_normal((identities, dim)).astype(np.float32))
+    owners = rng.integers(0, identities, points)
+    gallery = np.empty((points, dim), dtype=np.float32)
+    for i in range(0, points, 65536):
+        rows = owners[i:i + 65536]
+        gallery[i:i + len(rows)] = normalize(
+            centers[rows] + noise * rng.standard_normal((len(rows), dim)).astype(np.float32) / np.sqrt(dim))
+    # Queries: fresh samples of identities that are in the gallery
+    query_owners = owners[rng.integers(0, points, queries)]
+    query_vectors = normalize(
+        centers[query_owners] + noise * rng.standard_normal((queries, dim)).astype(np.float32) / np.sqrt(dim))
+    return gallery, query_vectors
+
+
+def exact_search(gallery, queries, k):
+    scores = queries @ gallery.T
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='IVF recall/QPS evaluation')
+    parser.add_argument('--points', type=int, default=200000)
+    parser.add_argument('--identities', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--noise', type=float, default=0.8, help='per-sample noise around the identity center')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5, help='results per query (/search default top)')
+    parser.add_argument('--nlist', type=int, default=0, help='inverted lists (default about 4*sqrt(N))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--index-dir', help='save the index here and evaluate the mmap-loaded copy')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    gallery, queries = synthetic_gallery(args.points, args.identities, args.dim, args.noise, args.queries)
+    print(f"gallery {gallery.shape}, {len(queries)} queries, k={args.k}")
+
+    # Exact search, one query at a time as /search runs it
+    start = time.perf_counter()
+    for q in queries[:min(100, len(queries))]:
+        scores = gallery @ q
+        np.argpartition(-scores, args.k - 1)[:args.k]
+    exact_qps = min(100, len(queries)) / (time.perf_counter() - start)
+    truth = np.concatenate([exact_search(gallery, queries[i:i + 64], args.k) for i in range(0, len(queries), 64)])
+    print(f"exact: {exact_qps:.0f} QPS")
+
+    start = time.perf_counter()
+    index = IVFIndex.build(gallery, np.arange(len(gallery)), nlist=args.nlist or None, dtype=args.dtype)
+    build_seconds = time.perf_counter() - start
+    if args.index_dir:
+        index.save(args.index_dir)
+        index = IVFIndex.load(args.index_dir)
+    print(f"build: {build_seconds:.1f}s, {json.dumps(index.stats())}")
+
+    results = {"points": args.points, "dim": args.dim, "k": args.k, "dtype": args.dtype,
+               "nlist": index.nlist, "build_seconds": build_seconds, "exact_qps": exact_qps, "ivf": []}
+    for nprobe in args.nprobe:
+        found = []
+        start = time.perf_counter()
+        for q in queries:
+            found.append(index.search(q, args.k, nprobe=nprobe)[0])
+        qps = len(queries) / (time.perf_counter() - start)
+        recall = float(np.mean([len(np.intersect1d(f, t)) / args.k for f, t in zip(found, truth)]))
+        recall_at_1 = float(np.mean([len(f) > 0 and f[0] == t[0] for f, t in zip(found, truth)]))
+        results["ivf"].append({"nprobe": nprobe, "recall_at_k": recall, "recall_at_1": recall_at_1, "qps": qps})
+        print(f"nprobe {nprobe:4d}: recall@{args.k} {recall:.3f}  recall@1 {recall_at_1:.3f}  "
+              f"{qps:8.0f} QPS  x{qps / exact_qps:.1f} vs exact")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
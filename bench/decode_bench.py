@@ -0,0 +1,126 @@
+# Image decode benchmark: full-resolution decode vs reduced-scale JPEG decode, both followed by the
+# serving path's BGR->RGB conversion and 112x112 resize.
+#
+#   python bench/decode_bench.py --images images --iterations 20
+#
+# Each mode runs in its own process so peak RSS is measured separately.
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import image_decode  # noqa: E402
+
+SYNTHETIC_SIZES = [(1920, 1080), (4000, 3000), (6000, 4000)]
+
+
+def synthetic_jpeg(width, height, seed=0):
+    """Camera-like JPEG: smooth gradients plus noise, so it does not compress to nothing"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    img = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    img = cv2.add(img, rng.integers(0, 24, img.shape, dtype=np.uint8))
+    ok, buf = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buf.tobytes()
+
+
+def load_inputs(image_dir):
+    inputs = []
+    for path in sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png'))):
+        with open(path, 'rb') as f:
+            inputs.append((os.path.basename(path), f.read()))
+    for width, height in SYNTHETIC_SIZES:
+        inputs.append((f"synthetic_{width}x{height}.jpg", synthetic_jpeg(width, height)))
+    return inputs
+
+
+def decode_to_face(raw, reduced):
+    img = image_decode.decode_image(raw, min_size=112, reduced=reduced)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, (112, 112))
+
+
+def reset_peak_rss():
+    """Reset VmHWM (Linux); a spawned child otherwise inherits the parent's peak across exec"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_kib():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_mode(reduced, inputs, iterations, queue):
+    reset_peak_rss()
+    baseline = peak_rss_kib()
+    results = {}
+    for name, raw in inputs:
+        decode_to_face(raw, reduced)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            decode_to_face(raw, reduced)
+        results[name] = {
+            "bytes": len(raw),
+            "size": image_decode.read_jpeg_size(raw),
+            "ms": (time.perf_counter() - start) / iterations * 1000.0,
+        }
+    queue.put({"per_image": results, "peak_rss_increase_kib": peak_rss_kib() - baseline})
+
+
+def run_isolated(reduced, inputs, iterations):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_mode, args=(reduced, inputs, iterations, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image decode benchmark')
+    parser.add_argument('--images', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images'))
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    # Synthetic inputs are encoded here so encoding does not count towards the children's peak RSS
+    inputs = load_inputs(args.images)
+    full = run_isolated(False, inputs, args.iterations)
+    reduced = run_isolated(True, inputs, args.iterations)
+
+    print(f"{'image':<28} {'size':>11} {'full ms':>9} {'reduced ms':>11} {'speedup':>8}")
+    for name, f in full["per_image"].items():
+        r = reduced["per_image"][name]
+        size = "x".join(str(v) for v in f["size"]) if f["size"] else "-"
+        print(f"{name:<28} {size:>11} {f['ms']:>9.2f} {r['ms']:>11.2f} {f['ms'] / r['ms']:>7.1f}x")
+    print(f"peak RSS increase: full {full['peak_rss_increase_kib'] / 1024:.1f} MiB, "
+          f"reduced {reduced['peak_rss_increase_kib'] / 1024:.1f} MiB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"full": full, "reduced": reduced}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+# Stand-in FTP server for benchmarks: passive-mode RETR of in-memory files, optional per-reply latency
+#
+#   python bench/fake_ftp.py --port 2121 --root images --latency-ms 2
+#   curl ftp://127.0.0.1:2121/face1.jpg -o /tmp/face1.jpg
+import argparse
+import os
+import socket
+import socketserver
+import threading
+import time
+
+
+class FakeFTP:
+    """Anonymous or user/password logins, TYPE, NOOP, PASV, RETR and QUIT over files held in memory"""
+
+    def __init__(self, files=None, latency_ms=0.0):
+        self.files = dict(files or {})
+        self.latency = latency_ms / 1000.0
+        self._lock = threading.Lock()
+        self.counters = {"connections": 0, "logins": 0, "retrs": 0, "noops": 0}
+        # Open control connections, so a test can drop them like a server-side idle timeout
+        self.sessions = set()
+
+    @classmethod
+    def from_dir(cls, root, latency_ms=0.0):
+        files = {}
+        for name in sorted(os.listdir(root)):
+            path = os.path.join(root, name)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    files['/' + name] = f.read()
+        return cls(files, latency_ms)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def disconnect_all(self):
+        """Close every open control connection from the server side"""
+        with self._lock:
+            sessions = list(self.sessions)
+        for connection in sessions:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def serve(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread; returns (host, port)"""
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                # One network round trip's worth of delay per reply
+                if fake.latency:
+                    time.sleep(fake.latency)
+                self.wfile.write(line.encode('latin-1') + b'\r\n')
+                self.wfile.flush()
+
+            def handle(self):
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                fake._count("connections")
+                with fake._lock:
+                    fake.sessions.add(self.connection)
+                self.reply('220 fake FTP ready')
+                passive = None
+                try:
+                    while True:
+                        line = self.rfile.readline().decode('latin-1').strip()
+                        if not line:
+                            return
+                        command, _, arg = line.partition(' ')
+                        command = command.upper()
+                        if command == 'USER':
+                            self.reply('331 Password required')
+                        elif command == 'PASS':
+                            fake._count("logins")
+                            self.reply('230 Logged in')
+                        elif command in ('TYPE', 'MODE', 'STRU'):
+                            self.reply('200 OK')
+                        elif command == 'NOOP':
+                            fake._count("noops")
+                            self.reply('200 OK')
+                        elif command == 'PASV':
+                            if passive is not None:
+                                passive.close()
+                            passive = socket.socket()
+                            passive.bind((host, 0))
+                            passive.listen(1)
+                            data_port = passive.getsockname()[1]
+                            h = host.replace('.', ',')
+                            self.reply(f'227 Entering Passive Mode ({h},{data_port // 256},{data_port % 256})')
+                        elif command == 'RETR':
+                            data = fake.files.get(arg)
+                            if passive is None:
+                                self.reply('425 Use PASV first')
+                            elif data is None:
+                                self.reply(f'550 {arg}: No such file')
+                                passive.close()
+                                passive = None
+                            else:
+                                fake._count("retrs")
+                                self.reply(f'150 Opening BINARY mode data connection ({len(data)} bytes)')
+                                conn, _ = passive.accept()
+                                with conn:
+                                    conn.sendall(data)
+                                passive.close()
+                                passive = None
+                                self.reply('226 Transfer complete')
+                        elif command == 'QUIT':
+                            self.reply('221 Goodbye')
+                            return
+                        else:
+                            self.reply(f'502 {command} not implemented')
+                except (ConnectionError, OSError):
+                    return
+                finally:
+                    with fake._lock:
+                        fake.sessions.discard(self.connection)
+                    if passive is not None:
+                        passive.close()
+
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name='fake-ftp', daemon=True).start()
+        return host, self.server.server_address[1]
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FTP stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2121)
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images'))
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every reply')
+    args = parser.parse_args()
+    fake = FakeFTP.from_dir(args.root, args.latency_ms)
+    host, port = fake.serve(args.host, args.port)
+    print(f"Serving {len(fake.files)} files at ftp://{host}:{port}/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
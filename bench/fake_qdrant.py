@@ -0,0 +1,163 @@
+# Stand-in for the Qdrant REST endpoints the service uses, backed by a random in-memory collection
+#
+#   python bench/fake_qdrant.py --port 6333 --points 2502 --latency-ms 2
+#   QDRANT_URL=http://127.0.0.1:6333/collections/f4r/points/search ...
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+class FakeQdrant:
+    """Collection of random normalized vectors with search, batch search, scroll and retrieve"""
+
+    def __init__(self, collection='f4r', points=2502, dim=512, latency_ms=0.0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.collection = collection
+        self.latency = latency_ms / 1000.0
+        vectors = rng.standard_normal((points, dim)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        base = 1757308580702032384
+        self.ids = [base + i for i in range(points)]
+        self.rows = {point_id: row for row, point_id in enumerate(self.ids)}
+        self.payloads = [{"uid": str(i), "space": "log"} for i in self.ids]
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.connections = set()
+        # Injected failures: route name -> (status, error message) responses to give before succeeding
+        self.failures = {}
+        prefix = f'/collections/{collection}'
+        self.routes = {
+            ('GET', prefix): ('collection', self.collection_info),
+            ('POST', prefix + '/points/search'): ('search', self.search),
+            ('POST', prefix + '/points/search/batch'): ('search_batch', self.search_batch),
+            ('POST', prefix + '/points/scroll'): ('scroll', self.scroll),
+            ('POST', prefix + '/points'): ('retrieve', self.retrieve),
+        }
+
+    def _search(self, vector, limit, with_payload):
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        scores = self.vectors @ query
+        best = np.argsort(-scores)[:limit]
+        hits = []
+        for row in best:
+            hit = {"id": self.ids[row], "version": 0, "score": float(str(scores[row]))}
+            if with_payload:
+                hit["payload"] = self.payloads[row]
+            hits.append(hit)
+        return hits
+
+    def collection_info(self, body):
+        return {"status": "green", "points_count": len(self.ids), "config": {
+            "params": {"vectors": {"size": self.vectors.shape[1], "distance": "Cosine"}}}}
+
+    def search(self, body):
+        return self._search(body["vector"], body.get("top", body.get("limit", 10)), body.get("with_payload"))
+
+    def search_batch(self, body):
+        return [self._search(s["vector"], s.get("limit", s.get("top", 10)), s.get("with_payload"))
+                for s in body["searches"]]
+
+    def scroll(self, body):
+        limit = body.get("limit", 10)
+        start = 0 if body.get("offset") is None else self.rows[body["offset"]]
+        rows = range(start, min(start + limit, len(self.ids)))
+        points = [{"id": self.ids[r],
+                   "payload": self.payloads[r] if body.get("with_payload") else None,
+                   "vector": self.vectors[r].tolist() if body.get("with_vector") else None} for r in rows]
+        next_offset = self.ids[start + limit] if start + limit < len(self.ids) else None
+        return {"points": points, "next_page_offset": next_offset}
+
+    def retrieve(self, body):
+        return [{"id": i, "vector": self.vectors[self.rows[i]].tolist()} for i in body["ids"] if i in self.rows]
+
+    def fail(self, name, status, message="Injected failure", times=1):
+        """Answer the next `times` requests to the named route with an error status and body"""
+        with self._lock:
+            self.failures.setdefault(name, []).extend([(status, message)] * times)
+
+    def handle(self, handler, method):
+        route = self.routes.get((method, handler.path.split('?', 1)[0].rstrip('/')))
+        length = int(handler.headers.get('Content-Length') or 0)
+        raw = handler.rfile.read(length) if length else b''
+        if route is None:
+            return 404, {"status": {"error": f"Not found: {handler.path}"}}
+        name, fn = route
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            self.connections.add(handler.client_address)
+            failures = self.failures.get(name)
+            failure = failures.pop(0) if failures else None
+        if failure is not None:
+            status, message = failure
+            return status, {"status": {"error": message}, "time": 0.0}
+        if self.latency:
+            time.sleep(self.latency)
+        start = time.perf_counter()
+        try:
+            result = fn(json.loads(raw) if raw else {})
+        except (KeyError, ValueError, TypeError) as e:
+            return 400, {"status": {"error": str(e)}}
+        return 200, {"result": result, "status": "ok", "time": time.perf_counter() - start}
+
+    def serve(self, host='127.0.0.1', port=0):
+        """Serve in a daemon thread; returns the collection's search URL (QDRANT_URL)"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keep-alive like the real server; no Nagle delay between header and body writes
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _respond(self, method):
+                status, body = fake.handle(self, method)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='fake-qdrant', daemon=True).start()
+        return f"http://{host}:{self.server.server_port}/collections/{self.collection}/points/search"
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Qdrant stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6333)
+    parser.add_argument('--collection', default='f4r')
+    parser.add_argument('--points', type=int, default=2502)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='added to every request')
+    args = parser.parse_args()
+    fake = FakeQdrant(args.collection, args.points, args.dim, args.latency_ms)
+    print(f"Serving {fake.serve(args.host, args.port)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# FTP fetch benchmark against the fake_ftp stand-in: connection per image vs pooled sessions vs bulk retrieval
+#
+#   python bench/ftp_bench.py --threads 4 --images 200 --latency-ms 2
+import argparse
+import ftplib
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_ftp import FakeFTP  # noqa: E402
+from ftp_pool import FTPPool, parse_ftp_url  # noqa: E402
+from qdrant import LatencyHistogram  # noqa: E402
+
+
+def legacy_fetch(ftp_url):
+    """read_image_bytes_from_ftp before the pool: connect, login, RETR, quit per image"""
+    host, port, path = parse_ftp_url(ftp_url)
+    ftp = ftplib.FTP()
+    ftp.connect(host, port)
+    ftp.login()
+    bio = io.BytesIO()
+    ftp.retrbinary(f'RETR {path}', bio.write)
+    ftp.quit()
+    return bio.getvalue()
+
+
+def run(fetch_chunk, urls, threads, chunk):
+    """Each thread fetches its share of urls, chunk URLs per call"""
+    histogram = LatencyHistogram()
+    per_thread = len(urls) // threads
+
+    def worker(offset):
+        mine = urls[offset:offset + per_thread]
+        for start in range(0, len(mine), chunk):
+            t = time.perf_counter()
+            results = fetch_chunk(mine[start:start + chunk])
+            assert all(isinstance(r, bytes) and r for r in results)
+            histogram.observe((time.perf_counter() - t) / len(results))
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    stats = histogram.stats()
+    return {"images_per_s": threads * per_thread / elapsed, "avg_ms_per_image": stats["avg_ms"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FTP fetch benchmark')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent request threads in one worker')
+    parser.add_argument('--images', type=int, default=200, help='images fetched per mode')
+    parser.add_argument('--chunk', type=int, default=32, help='URLs per retrieve_many call in bulk mode')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='fake server delay per FTP reply')
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images'))
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    fake = FakeFTP.from_dir(args.root, args.latency_ms)
+    host, port = fake.serve()
+    names = sorted(fake.files)
+    urls = [f"ftp://{host}:{port}{names[i % len(names)]}" for i in range(args.images)]
+    pool = FTPPool(max_idle=args.threads)
+    modes = [
+        ("legacy", lambda chunk: [legacy_fetch(u) for u in chunk], 1),
+        ("pooled", lambda chunk: [pool.retrieve(u) for u in chunk], 1),
+        ("pooled+bulk", pool.retrieve_many, args.chunk),
+    ]
+    assert legacy_fetch(urls[0]) == pool.retrieve(urls[0])
+
+    results = []
+    for name, fetch_chunk, chunk in modes:
+        before = dict(fake.counters)
+        result = run(fetch_chunk, urls, args.threads, chunk)
+        result["mode"] = name
+        for counter in ("connections", "logins", "retrs"):
+            result[counter] = fake.counters[counter] - before[counter]
+        results.append(result)
+        print(f"{name:12s} {result['images_per_s']:8.0f} images/s  {result['avg_ms_per_image']:6.2f} ms/image  "
+              f"{result['connections']:5d} connections  {result['logins']:5d} logins")
+    print("pool:", json.dumps(pool.stats()))
+    pool.close()
+    fake.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Preprocessing microbenchmark: legacy per-image float64 copies vs preallocated float32 NCHW buffers
+#
+#   python bench/preprocess_bench.py --batch-sizes 1 8 32 --iterations 200
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from encoders import BatchBuffers, fill_batch  # noqa: E402
+
+
+def legacy_preprocess(images, created):
+    """MyEncoder preprocessing before preallocated buffers, up to the float32 array handed to nd.array"""
+    batch = []
+    for img in images:
+        image = img.astype('float')
+        created.append(image)
+        image = np.transpose(image, (2, 0, 1))
+        created.append(image)
+        batch.append(image)
+    stacked = np.array(batch)
+    created.append(stacked)
+    # nd.array(batch_data) converts to float32 (the MXNet default dtype)
+    data = stacked.astype(np.float32)
+    created.append(data)
+    return data
+
+
+def buffered_preprocess(images, created, buffers):
+    # Nothing is created per batch: the buffer is reused and the transposes are views
+    return fill_batch(buffers.get(len(images)), images)
+
+
+def measure(fn, images, iterations):
+    # Owning arrays created per batch (views share memory and are not counted)
+    created = []
+    fn(images, created)
+    allocations = sum(1 for a in created if a.flags.owndata and a.base is None)
+    # Peak temporary memory of one batch
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    fn(images, [])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Time per batch
+    for _ in range(min(10, iterations)):
+        fn(images, [])
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(images, [])
+    elapsed = (time.perf_counter() - start) / iterations
+    return {
+        "allocations_per_batch": allocations,
+        "peak_bytes_per_batch": peak - base,
+        "ms_per_batch": elapsed * 1000.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preprocessing microbenchmark')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    buffers = BatchBuffers()
+    results = []
+    for batch_size in args.batch_sizes:
+        images = [rng.integers(0, 256, (112, 112, 3), dtype=np.uint8) for _ in range(batch_size)]
+        # Same values either way
+        assert np.array_equal(legacy_preprocess(images, []), buffered_preprocess(images, [], buffers))
+        # The preallocated buffer exists from the first request on, allocate it outside the measurement
+        buffers.get(batch_size)
+        legacy = measure(legacy_preprocess, images, args.iterations)
+        buffered = measure(lambda imgs, created: buffered_preprocess(imgs, created, buffers), images, args.iterations)
+        results.append({"batch_size": batch_size, "legacy": legacy, "buffered": buffered,
+                        "speedup": legacy["ms_per_batch"] / buffered["ms_per_batch"]})
+        print(f"batch {batch_size:3d}: legacy {legacy['ms_per_batch']:.3f} ms, "
+              f"{legacy['allocations_per_batch']} allocs, {legacy['peak_bytes_per_batch'] / 1024:.0f} KiB peak | "
+              f"buffered {buffered['ms_per_batch']:.3f} ms, {buffered['allocations_per_batch']} allocs, "
+              f"{buffered['peak_bytes_per_batch'] / 1024:.0f} KiB peak | x{results[-1]['speedup']:.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
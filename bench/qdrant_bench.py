@@ -0,0 +1,92 @@
+# Qdrant client benchmark against the fake_qdrant stand-in: per-call connections vs pooled session vs batch search
+#
+#   python bench/qdrant_bench.py --threads 8 --requests 200 --latency-ms 2
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_qdrant import FakeQdrant  # noqa: E402
+from qdrant import LatencyHistogram, QdrantClient, collection_url_from_search_url  # noqa: E402
+
+
+def legacy_search(url, vector, top):
+    """search_similar_faces before the client layer: new connection, json.dumps, no timeout"""
+    data = {"vector": vector.tolist(), "top": top, "with_payload": True}
+    return requests.post(url, headers={'Content-Type': 'application/json'}, data=json.dumps(data)).json()
+
+
+def run(search, queries, threads, per_thread):
+    histogram = LatencyHistogram()
+
+    def worker(offset):
+        for i in range(per_thread):
+            start = time.perf_counter()
+            search(queries[(offset + i) % len(queries)])
+            histogram.observe(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    stats = histogram.stats()
+    return {"qps": threads * per_thread / elapsed, "avg_ms": stats["avg_ms"], "p50_ms": stats["p50_ms"],
+            "p95_ms": stats["p95_ms"], "p99_ms": stats["p99_ms"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Qdrant client benchmark')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent request threads in one worker')
+    parser.add_argument('--requests', type=int, default=200, help='searches per thread')
+    parser.add_argument('--points', type=int, default=2502)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='fake server latency per HTTP request')
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    fake = FakeQdrant(points=args.points, latency_ms=args.latency_ms)
+    url = fake.serve()
+    queries = np.random.default_rng(1).standard_normal((256, 512)).astype(np.float32)
+    collection_url = collection_url_from_search_url(url)
+    pooled = QdrantClient(collection_url, pool_size=args.threads)
+    batched = QdrantClient(collection_url, pool_size=args.threads, batch_enabled=True,
+                           batch_max_size=args.threads, batch_max_wait_ms=1.0)
+    modes = [
+        ("legacy", lambda q: legacy_search(url, q, args.top)),
+        ("pooled", lambda q: pooled.search(q, args.top)),
+        ("pooled+batch", lambda q: batched.search(q, args.top)),
+    ]
+    # Same answers either way
+    assert [h["id"] for h in modes[0][1](queries[0])["result"]] == [h["id"] for h in modes[2][1](queries[0])["result"]]
+
+    results = []
+    for name, search in modes:
+        before_requests = sum(fake.requests.values())
+        before_connections = len(fake.connections)
+        result = run(search, queries, args.threads, args.requests)
+        result["mode"] = name
+        result["http_requests"] = sum(fake.requests.values()) - before_requests
+        result["connections"] = len(fake.connections) - before_connections
+        results.append(result)
+        print(f"{name:13s} {result['qps']:8.0f} QPS  p50 {result['p50_ms']:6.1f} ms  p95 {result['p95_ms']:6.1f} ms  "
+              f"{result['http_requests']:6d} HTTP requests  {result['connections']:5d} connections")
+    print("batched client:", json.dumps(batched.stats()["latency"].get("search_batch", {}).get("buckets")))
+    fake.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
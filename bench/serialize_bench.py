@@ -0,0 +1,107 @@
+# Embedding response serialization: encode/decode time and payload size per format
+#
+#   python bench/serialize_bench.py --batch-sizes 1 32 --iterations 500
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import serializers  # noqa: E402
+from serializers import ResponseFormat  # noqa: E402
+
+
+def legacy_encode(records):
+    """Response building before serializers: tolist() + json.dumps"""
+    out = []
+    for r in records:
+        r = dict(r, embedding=r["embedding"].tolist())
+        out.append(json.dumps(r))
+    return ('\n'.join(out) + '\n').encode('utf-8')
+
+
+def legacy_decode(body):
+    return [np.asarray(json.loads(line)["embedding"], dtype=np.float32) for line in body.splitlines()]
+
+
+def json_decode(body):
+    loads = serializers.orjson.loads if serializers.orjson is not None else json.loads
+    return [np.asarray(loads(line)["embedding"], dtype=np.float32) for line in body.splitlines()]
+
+
+def base64_decode(body):
+    out = []
+    for line in body.splitlines():
+        r = json.loads(line)
+        out.append(np.frombuffer(base64.b64decode(r["embedding"]), dtype=serializers.DTYPES[r["embedding_dtype"]]))
+    return out
+
+
+def msgpack_decode(body):
+    return [np.frombuffer(r["embedding"], dtype=serializers.DTYPES[r["embedding_dtype"]])
+            for r in serializers.msgpack.Unpacker(io.BytesIO(body))]
+
+
+def binary_decode(body):
+    return [e for _, embeddings in serializers.unpack_frames(body) for e in embeddings]
+
+
+def timed(fn, arg, iterations):
+    for _ in range(min(10, iterations)):
+        fn(arg)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn(arg)
+    return result, (time.perf_counter() - start) / iterations * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Embedding serialization benchmark')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32])
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args()
+
+    cases = [("legacy json (tolist)", legacy_encode, legacy_decode),
+             ("json" + (" (orjson)" if serializers.orjson is not None else ""),
+              lambda recs: serializers.encode_records(recs, ResponseFormat('json')), json_decode)]
+    for dtype in ('float32', 'float16'):
+        fmt = ResponseFormat('base64', dtype)
+        cases.append((f"base64 {dtype}", lambda recs, fmt=fmt: serializers.encode_records(recs, fmt), base64_decode))
+        fmt = ResponseFormat('binary', dtype)
+        cases.append((f"binary {dtype}", lambda recs, fmt=fmt: serializers.encode_records(recs, fmt), binary_decode))
+        if serializers.msgpack is not None:
+            fmt = ResponseFormat('msgpack', dtype)
+            cases.append((f"msgpack {dtype}", lambda recs, fmt=fmt: serializers.encode_records(recs, fmt), msgpack_decode))
+    if serializers.msgpack is None:
+        print("msgpack not installed, skipping the msgpack format")
+
+    rng = np.random.default_rng(0)
+    results = []
+    for batch_size in args.batch_sizes:
+        embeddings = rng.standard_normal((batch_size, args.dim)).astype(np.float32)
+        records = [{"index": i, "source_type": "file_path", "source_info": {"path": f"/images/{i}.jpg"},
+                    "embedding": e, "embedding_shape": e.shape} for i, e in enumerate(embeddings)]
+        print(f"batch {batch_size}:")
+        for name, encode, decode in cases:
+            body, encode_ms = timed(encode, records, args.iterations)
+            decoded, decode_ms = timed(decode, body, args.iterations)
+            max_error = float(np.max(np.abs(np.asarray(decoded, dtype=np.float32) - embeddings)))
+            results.append({"batch_size": batch_size, "format": name, "bytes": len(body),
+                            "encode_ms": encode_ms, "decode_ms": decode_ms, "max_abs_error": max_error})
+            print(f"  {name:22s} {len(body):9d} bytes  encode {encode_ms:8.3f} ms  "
+                  f"decode {decode_ms:8.3f} ms  max err {max_error:.1e}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+# Stage-level benchmark of the serving pipeline, in process: decode, preprocess, forward pass per
+# backend and batch size, flip TTA, serialization, search and the whole FaceEmbeddingService path.
+#
+#   python bench/stages.py --output results.json                       # small stand-in ONNX model
+#   python bench/stages.py --write-baseline bench/baseline.cpu.json    # store a baseline on this host
+#   python bench/stages.py --baseline bench/baseline.cpu.json --tolerance 0.25   # exit 1 on regression
+#
+# Runs CPU-only. Without --model a small ONNX stand-in encoder (same input/output contract as the
+# exported model) is generated, so the onnx package is needed; --backends mxnet needs the
+# MODEL_SYMBOL_PATH/MODEL_PARAMS_PATH files. Baselines are host specific: compare on the host that
+# wrote them.
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import face_align  # noqa: E402
+import image_decode  # noqa: E402
+import serializers  # noqa: E402
+from decode_bench import synthetic_jpeg  # noqa: E402
+from encoders import BatchBuffers, create_encoder, fill_batch  # noqa: E402
+
+STAGES = ('decode', 'align', 'preprocess', 'encoder', 'serialize', 'search', 'service')
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images')
+
+
+def make_standin_model(path, seed=0):
+    """Small ONNX encoder: (N, 3, 112, 112) raw 0-255 input -> (N, 512), dynamic batch"""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+    weights = [
+        numpy_helper.from_array((rng.standard_normal((16, 3, 3, 3)) * 0.01).astype(np.float32), 'conv1_w'),
+        numpy_helper.from_array((rng.standard_normal((32, 16, 3, 3)) * 0.05).astype(np.float32), 'conv2_w'),
+        numpy_helper.from_array(rng.standard_normal((32, 512)).astype(np.float32), 'fc1_w'),
+    ]
+    nodes = [
+        helper.make_node('Conv', ['data', 'conv1_w'], ['conv1'], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node('Relu', ['conv1'], ['relu1']),
+        helper.make_node('Conv', ['relu1', 'conv2_w'], ['conv2'], strides=[2, 2], pads=[1, 1, 1, 1]),
+        helper.make_node('Relu', ['conv2'], ['relu2']),
+        helper.make_node('GlobalAveragePool', ['relu2'], ['pool']),
+        helper.make_node('Flatten', ['pool'], ['flat']),
+        helper.make_node('MatMul', ['flat', 'fc1_w'], ['fc1_output']),
+    ]
+    graph = helper.make_graph(
+        nodes, 'standin',
+        [helper.make_tensor_value_info('data', TensorProto.FLOAT, ['N', 3, 112, 112])],
+        [helper.make_tensor_value_info('fc1_output', TensorProto.FLOAT, ['N', 512])], weights)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return path
+
+
+def measure(fn, iterations, items=1, warmup=3):
+    """Per-call timings of fn: median, p90, min and mean in ms, and the median per item"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+    times = np.asarray(times)
+    median = float(np.median(times))
+    return {"median_ms": median, "p90_ms": float(np.percentile(times, 90)), "min_ms": float(times.min()),
+            "mean_ms": float(times.mean()), "per_item_ms": median / items, "items": items,
+            "iterations": iterations}
+
+
+def load_images(images_dir):
+    raws = {}
+    for path in sorted(glob.glob(os.path.join(images_dir, '*.jpg'))):
+        with open(path, 'rb') as f:
+            raws[os.path.basename(path)] = f.read()
+    for width, height in ((1920, 1080), (4000, 3000)):
+        raws[f"synthetic-{width}x{height}.jpg"] = synthetic_jpeg(width, height)
+    return raws
+
+
+def bench_decode(raws, args):
+    results = {}
+    for name, raw in raws.items():
+        for reduced in (True, False):
+            key = f"decode/{name}/{'reduced' if reduced else 'full'}"
+            results[key] = measure(lambda: image_decode.decode_face(raw, 112, reduced=reduced), args.iterations)
+    return results
+
+
+def bench_align(raws, args):
+    """Batched similarity estimate and warps, as after detection, on landmarks jittered around the template"""
+    img = image_decode.decode_image(raws["synthetic-1920x1080.jpg"])
+    rng = np.random.default_rng(2)
+    template = face_align.reference_landmarks(112)
+    results = {}
+    for n in args.batch_sizes:
+        landmarks = template * 3 + 400 + rng.normal(0, 2, (n, 5, 2)).astype(np.float32)
+        results[f"align/b{n}"] = measure(lambda: face_align.align_faces(img, landmarks), args.iterations, n)
+    return results
+
+
+def bench_preprocess(faces, args):
+    results = {}
+    buffers = BatchBuffers()
+    for n in args.batch_sizes:
+        batch = faces[:n]
+        results[f"preprocess/b{n}"] = measure(lambda: fill_batch(buffers.get(n), batch), args.iterations, n)
+    return results
+
+
+def backend_config(backend, args, model_path):
+    config = {'INFERENCE_BACKEND': backend, 'FLIP_TTA': 'off', 'ONNX_MODEL_PATH': model_path,
+              'ONNX_MODEL_VARIANT': 'fp32', 'USE_GPU': False, 'BATCH_BUCKETS': sorted(set(args.batch_sizes)),
+              'ORT_INTRA_OP_THREADS': args.threads}
+    if backend == 'mxnet':
+        config['MODEL_SYMBOL_PATH'] = os.environ.get('MODEL_SYMBOL_PATH')
+        config['MODEL_PARAMS_PATH'] = os.environ.get('MODEL_PARAMS_PATH')
+    return config
+
+
+def bench_encoder(faces, encoders, args):
+    results = {}
+    for backend, encoder in encoders.items():
+        for n in args.batch_sizes:
+            batch = faces[:n]
+            # flip off is the forward pass alone; fused and sequential add flip TTA
+            for flip in ('off', 'fused', 'sequential'):
+                results[f"encoder/{backend}/{flip}/b{n}"] = measure(
+                    lambda: encoder.compute_embedding_images(batch, flip=flip, batch_size=n), args.iterations, n)
+    return results
+
+
+def bench_serialize(args):
+    rng = np.random.default_rng(0)
+    embedding = rng.standard_normal(512).astype(np.float32)
+    payload = {"success": True, "source_type": "file_upload", "source_info": {"filename": "face1.jpg"},
+               "embedding": embedding, "embedding_shape": embedding.shape, "flip_tta": "fused"}
+    records = [dict(payload, index=i) for i in range(32)]
+    results = {}
+    formats = ['json', 'base64', 'binary'] + (['msgpack'] if serializers.msgpack is not None else [])
+    for name in formats:
+        fmt = serializers.ResponseFormat(name)
+        results[f"serialize/{name}"] = measure(lambda: serializers.encode(payload, fmt), args.iterations)
+        results[f"serialize/{name}/records32"] = measure(
+            lambda: serializers.encode_records(records, fmt), args.iterations, len(records))
+    return results
+
+
+def bench_search(args, workdir):
+    from fake_qdrant import FakeQdrant
+    from gallery import LocalGallery
+    from qdrant import QdrantClient, collection_url_from_search_url
+
+    fake = FakeQdrant(points=args.points)
+    collection_url = collection_url_from_search_url(fake.serve())
+    queries = np.random.default_rng(1).standard_normal((64, 512)).astype(np.float32)
+    client = QdrantClient(collection_url)
+    gallery = LocalGallery(collection_url, os.path.join(workdir, 'gallery'), refresh_interval=0, qdrant=client)
+    results = {}
+    try:
+        # Qdrant over loopback HTTP: client, serialization and connection overhead plus the stand-in's search
+        results["search/qdrant-http/top5"] = measure(lambda: client.search(queries[0], 5), args.iterations)
+        results[f"search/local-exact/{args.points}/top5"] = measure(lambda: gallery.search(queries[0], 5),
+                                                                   args.iterations)
+        results[f"search/local-exact/{args.points}/batch16"] = measure(
+            lambda: gallery.search_many(queries[:16], 5), args.iterations, 16)
+    finally:
+        fake.shutdown()
+    return results
+
+
+def bench_service(raws, args, model_path):
+    from app import FaceEmbeddingService
+
+    config = dict(backend_config('onnxruntime', args, model_path), FLIP_TTA='fused', EMBEDDING_CACHE_SIZE=0,
+                  FTP_POOL_MAX_IDLE=0, REDUCED_DECODE=True)
+    service = FaceEmbeddingService(config)
+    samples = [raw for name, raw in raws.items() if not name.startswith('synthetic')] or list(raws.values())
+    results = {}
+    for n in args.batch_sizes:
+        batch = [samples[i % len(samples)] for i in range(n)]
+        results[f"service/embed_many/b{n}"] = measure(
+            lambda: service.embed_image_bytes_many(batch, batch_size=n), args.iterations, n)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Stages slower than baseline median * (1 + tolerance); prints a comparison table"""
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["median_ms"], results[key]["median_ms"]
+        ratio = new / old if old > 0 else 1.0
+        flag = ""
+        if ratio > 1.0 + tolerance:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print(f"{key:55s} {old:9.3f} -> {new:9.3f} ms  x{ratio:5.2f}{flag}")
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        print(f"Not measured this run: {', '.join(missing)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stage-level pipeline benchmark')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--backends', nargs='+', choices=('onnxruntime', 'mxnet'), default=['onnxruntime'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--iterations', type=int, default=30, help='timed calls per measurement')
+    parser.add_argument('--model', help='ONNX encoder to use instead of the generated stand-in')
+    parser.add_argument('--images', default=IMAGES_DIR, help='sample images (*.jpg), plus synthetic ones')
+    parser.add_argument('--points', type=int, default=20000, help='gallery size for the search stage')
+    parser.add_argument('--threads', type=int, default=1, help='onnxruntime intra-op threads (0 = default)')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare against this results JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed median slowdown vs the baseline before the run fails')
+    parser.add_argument('--write-baseline', help='write results as the baseline JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='stages-')
+    model_path = args.model or make_standin_model(os.path.join(workdir, 'standin.onnx'))
+    raws = load_images(args.images)
+    sample = next(iter(raws.values()))
+    face = image_decode.decode_face(sample, 112)
+    faces = [face] * max(args.batch_sizes)
+
+    results = {}
+    if 'decode' in args.stages:
+        results.update(bench_decode(raws, args))
+    if 'align' in args.stages:
+        results.update(bench_align(raws, args))
+    if 'preprocess' in args.stages:
+        results.update(bench_preprocess(faces, args))
+    if 'encoder' in args.stages:
+        encoders = {}
+        for backend in args.backends:
+            try:
+                encoders[backend] = create_encoder(backend_config(backend, args, model_path), max(args.batch_sizes))
+            except Exception as e:
+                print(f"Skipping backend {backend}: {e}")
+        results.update(bench_encoder(faces, encoders, args))
+    if 'serialize' in args.stages:
+        results.update(bench_serialize(args))
+    if 'search' in args.stages:
+        results.update(bench_search(args, workdir))
+    if 'service' in args.stages:
+        results.update(bench_service(raws, args, model_path))
+
+    for key, result in results.items():
+        print(f"{key:55s} median {result['median_ms']:9.3f} ms  p90 {result['p90_ms']:9.3f} ms  "
+              f"{result['per_item_ms']:8.3f} ms/item")
+
+    report = {
+        "meta": {"host": platform.node(), "machine": platform.machine(), "python": platform.python_version(),
+                 "numpy": np.__version__, "opencv": cv2.__version__, "cpus": os.cpu_count(),
+                 "model": args.model or "standin", "iterations": args.iterations, "time": time.time()},
+        "results": results,
+    }
+    for path in (args.output, args.write_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        print(f"\nAgainst {args.baseline} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,71 +1,290 @@
-import requests
-import time
+# Open-loop load generator for the face API: requests are sent on an arrival schedule (constant or
+# Poisson, one rate or a step ramp of rates) whether or not earlier ones have finished, and latency is
+# measured from the scheduled send time, so queueing in the server (or in this client) is not hidden.
+#
+#   python benchmark.py --url http://localhost:5000 --rates 20 --duration 30
+#   python benchmark.py --rates 10 20 40 80 160 --duration 20 --arrival poisson \
+#       --mix embed=8 search=1 batch=1 --output results.json --csv results.csv
+#
+# Each rate in --rates is one step; the per-step rows form the saturation curve (offered vs achieved
+# throughput and latency percentiles). The old usage `python benchmark.py URL NUM_REQUESTS` still works.
+import argparse
+import csv
+import glob
+import json
+import os
+import random
 import signal
 import sys
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
 
-URL = "http://localhost:5000/embed"
-IMAGE_PATH = "./images/face1.jpg"
-NUM_REQUESTS = 1000
-MAX_WORKERS = 8
+ENDPOINTS = {"embed": "/embed", "search": "/search", "batch": "/embed/batch"}
+PERCENTILES = (50, 90, 99, 99.9)
 
 shutdown_requested = False
 
+
 def signal_handler(sig, frame):
     global shutdown_requested
-    print("\n\nShutdown requested (Ctrl+C)... stopping gracefully...")
+    print("\n\nShutdown requested (Ctrl+C)... stopping after the current step...")
     shutdown_requested = True
 
-def send_request(image_bytes):
-    files = {"image": ("face1.jpg", image_bytes, "image/jpeg")}
-    start = time.time()
-    response = requests.post(URL, files=files)
-    elapsed = time.time() - start
-    return elapsed, response.status_code
 
-def benchmark():
-    global shutdown_requested
-    times = []
-    with open(IMAGE_PATH, "rb") as img_file:
-        image_bytes = img_file.read()
-    total_start = time.time()
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for i in range(NUM_REQUESTS):
-            if shutdown_requested:
-                break
-            futures.append(executor.submit(send_request, image_bytes))
-        
-        completed = 0
-        for future in as_completed(futures):
-            if shutdown_requested:
+def parse_mix(items):
+    """['embed=8', 'search=1'] -> [('embed', 8.0), ('search', 1.0)]"""
+    mix = []
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}' in --mix, expected one of {list(ENDPOINTS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def arrival_times(rate, duration, arrival, rng):
+    """Send offsets in seconds within one step: evenly spaced, or a Poisson process"""
+    if rate <= 0:
+        return []
+    if arrival == 'constant':
+        return list(np.arange(0.0, duration, 1.0 / rate))
+    times, t = [], rng.expovariate(rate)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+class LoadGenerator:
+    def __init__(self, base_url, images, mix, batch_size=8, top=5, timeout=30.0, max_in_flight=256,
+                 request_start=False, request_timeout=None):
+        self.base_url = base_url.rstrip('/')
+        self.images = images
+        self.mix = mix
+        self.batch_size = batch_size
+        self.top = top
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.request_start = request_start
+        self.request_timeout = request_timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def send(self, kind, index, scheduled_wall=None):
+        """POST one request of the given kind; returns (status code or None, error message)"""
+        headers = {}
+        # As a proxy would stamp it on arrival, so the server can shed requests that queued too long
+        if self.request_start and scheduled_wall is not None:
+            headers['X-Request-Start'] = f"t={scheduled_wall:.3f}"
+        if self.request_timeout:
+            headers['X-Request-Timeout'] = f"{self.request_timeout:g}"
+        name, image = self.images[index % len(self.images)]
+        url = self.base_url + ENDPOINTS[kind]
+        if kind == 'batch':
+            files = [('images', (f"{i}-{self.images[(index + i) % len(self.images)][0]}",
+                                 self.images[(index + i) % len(self.images)][1], 'image/jpeg'))
+                     for i in range(self.batch_size)]
+            data = None
+        else:
+            files = {'image': (name, image, 'image/jpeg')}
+            data = {'top': str(self.top)} if kind == 'search' else None
+        try:
+            response = self._session().post(url, files=files, data=data, headers=headers, timeout=self.timeout)
+            # Batch responses stream; the request is done when the body is
+            body = response.content
+            if response.status_code != 200:
+                return response.status_code, body[:200].decode('utf-8', 'replace')
+            if kind == 'batch' and b'"error"' in body:
+                return response.status_code, "error line in batch response"
+            return response.status_code, None
+        except requests.RequestException as e:
+            return None, type(e).__name__
+
+    def run_step(self, rate, duration, arrival, rng):
+        """Drive one arrival rate for duration seconds; returns the step's summary row and raw samples"""
+        schedule = arrival_times(rate, duration, arrival, rng)
+        kinds = rng.choices([k for k, _ in self.mix], weights=[w for _, w in self.mix], k=len(schedule))
+        samples = []
+        lock = threading.Lock()
+        in_flight = threading.Semaphore(self.max_in_flight)
+        dropped = 0
+
+        def task(kind, index, scheduled):
+            try:
+                status, error = self.send(kind, index, wall_start + scheduled - start)
+                finished = time.perf_counter()
+                with lock:
+                    samples.append({"kind": kind, "scheduled": scheduled - start, "latency_ms": (finished - scheduled) * 1000.0,
+                                    "status": status, "error": error})
+            finally:
+                in_flight.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            start = time.perf_counter()
+            wall_start = time.time()
+            for index, (offset, kind) in enumerate(zip(schedule, kinds)):
+                if shutdown_requested:
+                    break
+                delay = start + offset - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                # The client is out of connections: count the arrival as dropped instead of sending late
+                if not in_flight.acquire(blocking=False):
+                    dropped += 1
+                    continue
+                executor.submit(task, kind, index, start + offset)
+        # Until the last response: a saturated server's backlog lowers the achieved rate
+        elapsed = time.perf_counter() - start
+        return summarize(rate, samples, dropped, elapsed), samples
+
+
+def summarize(rate, samples, dropped, elapsed):
+    ok = [s["latency_ms"] for s in samples if s["error"] is None]
+    row = {"offered_rps": rate, "sent": len(samples), "dropped": dropped, "ok": len(ok),
+           "errors": len(samples) - len(ok), "achieved_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+           "error_rate": (len(samples) - len(ok)) / len(samples) if samples else 0.0,
+           "elapsed_s": elapsed}
+    latencies = np.asarray(ok) if ok else None
+    row["mean_ms"] = float(latencies.mean()) if ok else None
+    for p in PERCENTILES:
+        row[f"p{p:g}_ms"] = float(np.percentile(latencies, p)) if ok else None
+    row["max_ms"] = float(latencies.max()) if ok else None
+    by_kind = {}
+    for s in samples:
+        by_kind.setdefault(s["kind"], []).append(s)
+    row["by_endpoint"] = {}
+    for kind, items in sorted(by_kind.items()):
+        kind_ok = [s["latency_ms"] for s in items if s["error"] is None]
+        entry = {"sent": len(items), "errors": len(items) - len(kind_ok)}
+        for p in PERCENTILES:
+            entry[f"p{p:g}_ms"] = float(np.percentile(kind_ok, p)) if kind_ok else None
+        row["by_endpoint"][kind] = entry
+    errors = {}
+    for s in samples:
+        if s["error"] is not None:
+            key = f"{s['status']}: {s['error']}" if s["status"] else s["error"]
+            errors[key] = errors.get(key, 0) + 1
+    row["error_kinds"] = dict(sorted(errors.items(), key=lambda item: -item[1])[:10])
+    return row
+
+
+def format_ms(value):
+    return f"{value:9.1f}" if value is not None else f"{'-':>9s}"
+
+
+def print_row(row):
+    print(f"{row['offered_rps']:8.1f} {row['achieved_rps']:9.1f} {row['sent']:7d} {row['errors']:6d} {row['dropped']:7d}"
+          + "".join(format_ms(row[f"p{p:g}_ms"]) for p in PERCENTILES) + format_ms(row["max_ms"]))
+
+
+def load_images(paths):
+    images = []
+    for path in paths:
+        for match in sorted(glob.glob(path)) or [path]:
+            with open(match, 'rb') as f:
+                images.append((os.path.basename(match), f.read()))
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load generator for the face API')
+    parser.add_argument('legacy', nargs='*', help=argparse.SUPPRESS)
+    parser.add_argument('--url', default='http://localhost:5000', help='server base URL')
+    parser.add_argument('--rates', nargs='+', type=float, default=[20.0],
+                        help='requests/s; several values run one step each (a step ramp)')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds per step')
+    parser.add_argument('--arrival', choices=('constant', 'poisson'), default='constant')
+    parser.add_argument('--mix', nargs='+', default=['embed=1'],
+                        help='endpoint weights, e.g. embed=8 search=1 batch=1')
+    parser.add_argument('--images', nargs='+', default=['./images/*.jpg'], help='image files or globs')
+    parser.add_argument('--batch-size', type=int, default=8, help='images per /embed/batch request')
+    parser.add_argument('--top', type=int, default=5, help='top for /search requests')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per-request timeout in seconds')
+    parser.add_argument('--max-in-flight', type=int, default=256,
+                        help='client concurrency; arrivals beyond it are counted as dropped')
+    parser.add_argument('--request-start', action='store_true',
+                        help='send X-Request-Start with the scheduled time, as a proxy in front of the server would')
+    parser.add_argument('--request-timeout', type=float, help='send X-Request-Timeout (ms), the request deadline')
+    parser.add_argument('--pause', type=float, default=2.0, help='seconds between steps')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the summary and per-step rows as JSON')
+    parser.add_argument('--csv', help='write the saturation curve (one row per step) as CSV')
+    parser.add_argument('--samples', help='write every request (endpoint, schedule, latency, status) as CSV')
+    args = parser.parse_args()
+
+    # python benchmark.py http://host:5000/embed 1000 -> constant rate until 1000 requests are sent
+    if args.legacy:
+        url = args.legacy[0]
+        for path in ENDPOINTS.values():
+            if url.endswith(path):
+                args.mix, url = [f"{k}=1" for k, v in ENDPOINTS.items() if v == path], url[:-len(path)]
                 break
-            elapsed, status = future.result()
-            times.append(elapsed)
-            completed += 1
-            print(f"Request {completed}: {elapsed:.4f}s, Status: {status}")
-    
-    total_elapsed = time.time() - total_start
-    if times:
-        avg_time = sum(times) / len(times)
-        print(f"\nCompleted {len(times)} requests")
-        print(f"Average response time: {avg_time:.4f}s")
-        print(f"Total time: {total_elapsed:.4f}s")
-    else:
-        print("\nNo requests completed")
+        args.url = url
+        if len(args.legacy) > 1:
+            args.duration = int(args.legacy[1]) / args.rates[0]
+
+    mix = parse_mix(args.mix)
+    images = load_images(args.images)
+    if not images:
+        parser.error("No images found")
+    generator = LoadGenerator(args.url, images, mix, args.batch_size, args.top, args.timeout, args.max_in_flight,
+                              args.request_start, args.request_timeout)
+    rng = random.Random(args.seed)
+    signal.signal(signal.SIGINT, signal_handler)
+
+    print(f"Target {args.url}  mix {dict(mix)}  arrival {args.arrival}  {args.duration:g}s per step")
+    print(f"{'offered':>8s} {'achieved':>9s} {'sent':>7s} {'errors':>6s} {'dropped':>7s}"
+          + "".join(f"{'p' + format(p, 'g'):>9s}" for p in PERCENTILES) + f"{'max':>9s}  (ms)")
+    rows, all_samples = [], []
+    for step, rate in enumerate(args.rates):
+        if shutdown_requested:
+            break
+        if step and args.pause:
+            time.sleep(args.pause)
+        row, samples = generator.run_step(rate, args.duration, args.arrival, rng)
+        rows.append(row)
+        all_samples.extend(dict(s, offered_rps=rate) for s in samples)
+        print_row(row)
+        for kind, entry in row["by_endpoint"].items():
+            if len(row["by_endpoint"]) > 1:
+                print(f"{'':8s} {kind:>9s} {entry['sent']:7d} {entry['errors']:6d} {'':7s}"
+                      + "".join(format_ms(entry[f"p{p:g}_ms"]) for p in PERCENTILES))
+        for error, count in row["error_kinds"].items():
+            print(f"{'':8s} {count:6d} x {error}")
+
+    if rows:
+        best = max(rows, key=lambda r: r["achieved_rps"])
+        print(f"\nPeak achieved throughput {best['achieved_rps']:.1f} req/s at offered {best['offered_rps']:g} req/s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"config": {k: v for k, v in vars(args).items() if k != 'legacy'}, "steps": rows}, f, indent=2)
+    if args.csv:
+        columns = ["offered_rps", "achieved_rps", "sent", "ok", "errors", "dropped", "error_rate", "mean_ms"] \
+            + [f"p{p:g}_ms" for p in PERCENTILES] + ["max_ms", "elapsed_s"]
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.samples:
+        with open(args.samples, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=["offered_rps", "kind", "scheduled", "latency_ms", "status", "error"])
+            writer.writeheader()
+            writer.writerows(all_samples)
+
 
 if __name__ == "__main__":
     try:
-        # get URL and NUM_REQUESTS from args if provided
-        # python benchmark.py http://100.64.0.4:5000/embed 1000
-        if len(sys.argv) > 1:
-            URL = sys.argv[1]
-        if len(sys.argv) > 2:
-            NUM_REQUESTS = int(sys.argv[2])
-        benchmark()
+        main()
     except KeyboardInterrupt:
         print("\nBenchmark interrupted by user")
-        sys.exit(0)
\ No newline at end of file
+        sys.exit(0)
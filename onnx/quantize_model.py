@@ -0,0 +1,219 @@
+# Build an INT8 variant of face_encoder.onnx and report its drift against FP32
+#
+# dynamic: weights quantized offline, activations quantized at run time (no calibration data)
+#   python quantize_model.py --mode dynamic
+# static: weights and activations quantized offline, calibrated on aligned face crops
+#   python quantize_model.py --mode static --calib-dir ../images --report int8_report.json
+#
+# Serve the result with INFERENCE_BACKEND=onnxruntime ONNX_MODEL_VARIANT=int8
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import onnxruntime as ort
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                      QuantType, quantize_dynamic, quantize_static)
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'bmp', 'tiff')
+
+
+def list_images(image_dir, max_images=None):
+    files = []
+    for ext in IMAGE_EXTENSIONS:
+        files.extend(glob.glob(os.path.join(image_dir, '**', f'*.{ext}'), recursive=True))
+    files = sorted(set(files))
+    return files[:max_images] if max_images else files
+
+
+def load_face(image_file, image_size=112):
+    """Same preprocessing as the serving path: RGB, 112x112, raw 0-255 float32 CHW"""
+    img = cv2.imread(image_file)
+    if img is None:
+        return None
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, (image_size, image_size))
+    return np.transpose(img, (2, 0, 1)).astype(np.float32)
+
+
+def load_faces(image_files):
+    faces, names = [], []
+    for image_file in image_files:
+        face = load_face(image_file)
+        if face is None:
+            print(f"Skipping unreadable image: {image_file}")
+            continue
+        faces.append(face)
+        names.append(image_file)
+    if not faces:
+        raise ValueError("No readable images found")
+    return np.stack(faces), names
+
+
+def model_batch_size(session):
+    """1 for models exported with a fixed batch of 1 (export_model.py), None if dynamic"""
+    dim = session.get_inputs()[0].shape[0]
+    return dim if isinstance(dim, int) and dim > 0 else None
+
+
+class FaceCalibrationReader(CalibrationDataReader):
+    """Feeds aligned face crops to the static quantization calibrator"""
+
+    def __init__(self, faces, input_name, batch_size=1, flip=True):
+        if flip:
+            # Serving runs flipped copies through the model too, calibrate on both
+            faces = np.concatenate([faces, faces[:, :, :, ::-1]], axis=0)
+        step = batch_size or 1
+        self.batches = iter([{input_name: np.ascontiguousarray(faces[i:i + step])}
+                             for i in range(0, len(faces) - step + 1, step)])
+
+    def get_next(self):
+        return next(self.batches, None)
+
+
+def embed(session, faces, flip=True):
+    """Embeddings with the serving flip TTA (original + flipped, summed)"""
+    input_name = session.get_inputs()[0].name
+    step = model_batch_size(session) or len(faces)
+    out = []
+    for i in range(0, len(faces), step):
+        batch = np.ascontiguousarray(faces[i:i + step])
+        emb = session.run(None, {input_name: batch})[0].reshape(len(batch), -1)
+        if flip:
+            flipped = np.ascontiguousarray(batch[:, :, :, ::-1])
+            emb = emb + session.run(None, {input_name: flipped})[0].reshape(len(batch), -1)
+        out.append(emb)
+    return np.concatenate(out, axis=0)
+
+
+def l2_normalize(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def time_per_image(session, faces, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        embed(session, faces)
+        best = min(best, time.perf_counter() - start)
+    return best / len(faces)
+
+
+def top_k(queries, gallery, k, exclude_self=False):
+    scores = queries @ gallery.T
+    if exclude_self:
+        np.fill_diagonal(scores, -np.inf)
+    k = min(k, gallery.shape[0] - (1 if exclude_self else 0))
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def accuracy_report(fp32_model, int8_model, faces, gallery=None, k=5, threads=0):
+    opts = ort.SessionOptions()
+    if threads:
+        opts.intra_op_num_threads = threads
+    fp32 = ort.InferenceSession(fp32_model, sess_options=opts, providers=['CPUExecutionProvider'])
+    int8 = ort.InferenceSession(int8_model, sess_options=opts, providers=['CPUExecutionProvider'])
+
+    emb_fp32 = l2_normalize(embed(fp32, faces))
+    emb_int8 = l2_normalize(embed(int8, faces))
+    cosine = np.sum(emb_fp32 * emb_int8, axis=1)
+
+    # The gallery (e.g. Qdrant points) was built with the FP32 model, so INT8
+    # queries are ranked against FP32 gallery vectors. Without a gallery file the
+    # calibration set itself is the gallery, leaving each query's own row out.
+    exclude_self = gallery is None
+    gallery = emb_fp32 if gallery is None else l2_normalize(gallery.astype(np.float32))
+    ref = top_k(emb_fp32, gallery, k, exclude_self)
+    got = top_k(emb_int8, gallery, k, exclude_self)
+    overlap = np.array([len(set(a) & set(b)) / len(a) for a, b in zip(ref, got)])
+
+    fp32_time = time_per_image(fp32, faces)
+    int8_time = time_per_image(int8, faces)
+    return {
+        "images": int(len(faces)),
+        "gallery_size": int(gallery.shape[0]),
+        "cosine_similarity": {
+            "min": float(cosine.min()),
+            "p1": float(np.percentile(cosine, 1)),
+            "p5": float(np.percentile(cosine, 5)),
+            "median": float(np.median(cosine)),
+            "mean": float(cosine.mean()),
+            "histogram": {
+                "bins": [0.9, 0.95, 0.98, 0.99, 0.995, 0.999, 1.0001],
+                "counts": np.histogram(cosine, bins=[0.9, 0.95, 0.98, 0.99, 0.995, 0.999, 1.0001])[0].tolist(),
+                "below_0.9": int(np.sum(cosine < 0.9)),
+            },
+        },
+        f"top{k}_overlap": {
+            "mean": float(overlap.mean()),
+            "min": float(overlap.min()),
+            "top1_agreement": float(np.mean(ref[:, 0] == got[:, 0])),
+        },
+        "latency_ms_per_image": {
+            "fp32": fp32_time * 1000.0,
+            "int8": int8_time * 1000.0,
+            "speedup": fp32_time / int8_time if int8_time > 0 else None,
+        },
+        "model_size_bytes": {
+            "fp32": os.path.getsize(fp32_model),
+            "int8": os.path.getsize(int8_model),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an INT8 face_encoder.onnx and report drift against FP32")
+    parser.add_argument('--model', default='../models/face_encoder.onnx', help='FP32 ONNX model')
+    parser.add_argument('--output', default='../models/face_encoder.int8.onnx', help='INT8 ONNX model to write')
+    parser.add_argument('--mode', choices=['dynamic', 'static'], default='static')
+    parser.add_argument('--calib-dir', default='../images', help='aligned face crops for calibration and the report')
+    parser.add_argument('--max-images', type=int, default=500)
+    parser.add_argument('--calib-method', choices=['minmax', 'entropy', 'percentile'], default='minmax')
+    parser.add_argument('--per-channel', action='store_true', help='per-channel weight scales')
+    parser.add_argument('--gallery', help='.npy (N, 512) FP32 gallery embeddings for the top-k overlap')
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads for the timing runs')
+    parser.add_argument('--report', default='int8_report.json')
+    parser.add_argument('--skip-quantize', action='store_true', help='only write the report for an existing --output')
+    args = parser.parse_args()
+
+    faces, names = load_faces(list_images(args.calib_dir, args.max_images))
+    print(f"Loaded {len(faces)} face crops from {args.calib_dir}")
+
+    if not args.skip_quantize:
+        if args.mode == 'dynamic':
+            quantize_dynamic(args.model, args.output, weight_type=QuantType.QInt8,
+                             per_channel=args.per_channel)
+        else:
+            session = ort.InferenceSession(args.model, providers=['CPUExecutionProvider'])
+            reader = FaceCalibrationReader(faces, session.get_inputs()[0].name, model_batch_size(session))
+            method = {
+                'minmax': CalibrationMethod.MinMax,
+                'entropy': CalibrationMethod.Entropy,
+                'percentile': CalibrationMethod.Percentile,
+            }[args.calib_method]
+            quantize_static(args.model, args.output, reader,
+                            quant_format=QuantFormat.QDQ,
+                            activation_type=QuantType.QUInt8,
+                            weight_type=QuantType.QInt8,
+                            per_channel=args.per_channel,
+                            calibrate_method=method)
+        print(f"INT8 ({args.mode}) model written to {args.output}")
+
+    gallery = np.load(args.gallery) if args.gallery else None
+    report = accuracy_report(args.model, args.output, faces, gallery, args.top_k, args.threads)
+    report["mode"] = args.mode
+    report["calib_dir"] = args.calib_dir
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
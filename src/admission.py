@@ -0,0 +1,154 @@
+import contextvars
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """The request was shed before any work: queue full, queued too long, or no slot in time (503)"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before an expensive stage (504)"""
+
+
+class AdmissionController:
+    """
+    Per-worker admission: at most max_in_flight requests run at once and at most
+    max_queue more wait, each for up to queue_timeout seconds (or its deadline).
+    Anything beyond that is rejected at once with Overloaded, so under overload a
+    worker finishes the requests it admitted instead of slowing all of them down.
+    Only meaningful with more request threads than max_in_flight (gthread workers).
+    """
+
+    def __init__(self, max_in_flight=1, max_queue=0, queue_timeout=1.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, deadline=None):
+        """Take a slot or raise Overloaded; deadline (perf_counter clock) shortens the wait"""
+        with self._cond:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("Server overloaded, try again later")
+            wait_until = time.perf_counter() + self.queue_timeout
+            if deadline is not None:
+                wait_until = min(wait_until, deadline)
+            self.queued += 1
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = wait_until - time.perf_counter()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise Overloaded("Server overloaded, try again later")
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+            finally:
+                self.queued -= 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+
+def parse_request_start(value):
+    """
+    Unix time in seconds from an X-Request-Start header as set by proxies:
+    't=1700000000.123' (nginx $msec), or integer milli- or microseconds. None if absent or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        t = float(value)
+    except ValueError:
+        return None
+    if t > 1e14:
+        return t / 1e6
+    if t > 1e11:
+        return t / 1e3
+    return t
+
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+def start_request(request_start=None, timeout_ms=None, default_timeout_ms=0.0, max_queue_ms=0.0):
+    """
+    Deadline of a request on the perf_counter clock, made current for this thread
+    or task; None without one. request_start and timeout_ms are the raw
+    X-Request-Start and X-Request-Timeout header values. The time spent queued in
+    front of the worker (since request_start) counts against the budget, and a
+    request queued longer than max_queue_ms raises Overloaded. The client's
+    timeout is capped at default_timeout_ms, which also applies when none is sent.
+    """
+    now = time.perf_counter()
+    queued = 0.0
+    arrival = parse_request_start(request_start)
+    if arrival is not None:
+        queued = max(0.0, time.time() - arrival)
+        if max_queue_ms and queued * 1000.0 > max_queue_ms:
+            _deadline.set(None)
+            raise Overloaded(f"Request queued for {queued * 1000.0:.0f} ms, try again later")
+    budget_ms = default_timeout_ms or None
+    if timeout_ms:
+        try:
+            client_ms = float(timeout_ms)
+        except ValueError:
+            client_ms = None
+        if client_ms is not None and client_ms > 0:
+            budget_ms = min(client_ms, budget_ms) if budget_ms else client_ms
+    deadline = now - queued + budget_ms / 1000.0 if budget_ms else None
+    _deadline.set(deadline)
+    return deadline
+
+
+def end_request():
+    _deadline.set(None)
+
+
+def remaining():
+    """Seconds left before the current request's deadline, None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.perf_counter()
+
+
+def deadline_error(stage):
+    """DeadlineExceeded if the current request's deadline has passed, else None"""
+    deadline = _deadline.get()
+    if deadline is not None and time.perf_counter() >= deadline:
+        return DeadlineExceeded(f"Request deadline exceeded before {stage}")
+    return None
+
+
+def check_deadline(stage):
+    """Raise DeadlineExceeded if the current request's deadline has passed; called before expensive stages"""
+    error = deadline_error(stage)
+    if error is not None:
+        raise error
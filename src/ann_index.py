@@ -0,0 +1,300 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+INDEX_FORMAT_VERSION = 1
+INDEX_DTYPES = ('float32', 'float16')
+# Rows per matrix product when assigning vectors to lists, bounds temporary memory
+ASSIGN_CHUNK = 65536
+
+
+def point_label(point_id):
+    """int64 label for a Qdrant point id (unsigned int or UUID string)"""
+    if isinstance(point_id, int) and 0 <= point_id < 2 ** 63:
+        return point_id
+    digest = hashlib.blake2b(str(point_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def default_nlist(count):
+    """Number of inverted lists for count vectors (about 4 * sqrt(count))"""
+    return max(1, min(count, int(4 * np.sqrt(max(count, 1)))))
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def assign_lists(vectors, centroids):
+    """Nearest centroid (highest cosine) for each vector"""
+    out = np.empty(len(vectors), dtype=np.int64)
+    for i in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[i:i + ASSIGN_CHUNK], dtype=np.float32)
+        out[i:i + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(vectors, nlist, iterations=10, train_size=None, seed=0):
+    """Spherical k-means on a sample of the (normalized) vectors"""
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    train_size = min(count, train_size or max(64 * nlist, 10000))
+    sample = normalize(vectors[np.sort(rng.choice(count, train_size, replace=False))])
+    centroids = sample[rng.choice(train_size, nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(sample, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        order = np.argsort(assign, kind='stable')
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(sample[order], starts, axis=0)
+        # Empty lists are reseeded with random sample points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(train_size, len(empty), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine (inner product on normalized vectors) search.
+
+    Vectors are grouped by their nearest k-means centroid into contiguous
+    lists; a query scores the centroids, then only the nprobe closest lists.
+    nlist and nprobe trade recall for speed, dtype='float16' halves memory.
+
+    Saved as a directory of .npy files (centroids, list offsets, labels,
+    vectors) loaded with mmap. add() and remove() apply on top of the loaded
+    lists (pending rows and tombstones) until compact() or save() folds them in.
+    """
+
+    def __init__(self, centroids, offsets, labels, vectors, nprobe=16, trained_count=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.labels = labels
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.trained_count = trained_count if trained_count is not None else len(labels)
+        self._pending = {}
+        # Tombstones for base rows (pending rows are removed directly)
+        self._deleted = set()
+        self._deleted_array = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    @property
+    def dtype(self):
+        return self.vectors.dtype.name
+
+    def __len__(self):
+        pending = sum(len(labels) for labels, _ in self._pending.values())
+        return len(self.labels) + pending - len(self._deleted)
+
+    @classmethod
+    def build(cls, vectors, labels, nlist=None, nprobe=16, dtype='float32', iterations=10, train_size=None, seed=0):
+        """Train centroids on vectors and fill the lists"""
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Invalid index dtype '{dtype}'. Use one of {INDEX_DTYPES}")
+        labels = np.asarray(labels, dtype=np.int64)
+        nlist = nlist or default_nlist(len(labels))
+        centroids = train_centroids(vectors, nlist, iterations=iterations, train_size=train_size, seed=seed)
+        assign = assign_lists(vectors, centroids)
+        order = np.argsort(assign, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        grouped = np.empty((len(labels), centroids.shape[1]), dtype=dtype)
+        for i in range(0, len(order), ASSIGN_CHUNK):
+            rows = order[i:i + ASSIGN_CHUNK]
+            # Read rows in file order (sequential on a memmap), then put them in list order
+            grouped[i:i + len(rows)] = normalize(vectors[np.sort(rows)])[np.argsort(np.argsort(rows))]
+        return cls(centroids, offsets, labels[order], grouped, nprobe=nprobe, trained_count=len(labels))
+
+    def add(self, vectors, labels):
+        """
+        Insert vectors under their nearest existing centroid (no retraining).
+        To replace the vector of a label, remove() it first.
+        """
+        vectors = normalize(vectors).reshape(-1, self.dim)
+        labels = np.asarray(labels, dtype=np.int64)
+        assign = assign_lists(vectors, self.centroids)
+        for lst in np.unique(assign):
+            mask = assign == lst
+            old_labels, old_vectors = self._pending.get(lst, (np.empty(0, np.int64), np.empty((0, self.dim), self.vectors.dtype)))
+            self._pending[lst] = (np.concatenate([old_labels, labels[mask]]),
+                                  np.concatenate([old_vectors, vectors[mask].astype(self.vectors.dtype)]))
+
+    def remove(self, labels):
+        """Delete labels: base rows are tombstoned (skipped by search, dropped on compact())"""
+        labels = np.asarray(list(labels), dtype=np.int64)
+        if not len(labels):
+            return
+        for lst, (pending_labels, pending_vectors) in list(self._pending.items()):
+            keep = ~np.isin(pending_labels, labels)
+            self._pending[lst] = (pending_labels[keep], pending_vectors[keep])
+        self._deleted.update(labels[np.isin(labels, self.labels)].tolist())
+        self._deleted_array = None
+
+    def _tombstones(self):
+        if self._deleted_array is None:
+            self._deleted_array = np.fromiter(self._deleted, np.int64, len(self._deleted))
+        return self._deleted_array
+
+    def _list(self, lst):
+        """(labels, vectors) of one list: live base rows followed by pending rows"""
+        a, b = self.offsets[lst], self.offsets[lst + 1]
+        labels, vectors = self.labels[a:b], self.vectors[a:b]
+        if self._deleted and len(labels):
+            keep = ~np.isin(labels, self._tombstones())
+            if not keep.all():
+                labels, vectors = labels[keep], vectors[keep]
+        pending = self._pending.get(lst)
+        if pending is not None:
+            labels = np.concatenate([labels, pending[0]])
+            vectors = np.concatenate([vectors, pending[1]])
+        return labels, vectors
+
+    def search(self, query, k=5, nprobe=None):
+        """(labels, scores) of the k best matches, best first"""
+        query = normalize(query).reshape(-1)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        all_labels = []
+        all_scores = []
+        for lst in probe:
+            labels, vectors = self._list(lst)
+            if len(labels):
+                all_labels.append(labels)
+                all_scores.append(vectors @ query.astype(vectors.dtype))
+        if not all_labels:
+            return np.empty(0, np.int64), np.empty(0, np.float32)
+        labels = np.concatenate(all_labels)
+        scores = np.concatenate(all_scores).astype(np.float32)
+        k = min(k, len(labels))
+        if k <= 0:
+            return labels[:0], scores[:0]
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(labels) else np.arange(len(labels))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return labels[best], scores[best]
+
+    def compact(self):
+        """Fold pending rows into the lists and drop tombstoned rows"""
+        if not self._pending and not self._deleted:
+            return
+        label_parts, vector_parts, sizes = [], [], []
+        for lst in range(self.nlist):
+            labels, vectors = self._list(lst)
+            label_parts.append(np.asarray(labels))
+            vector_parts.append(np.asarray(vectors))
+            sizes.append(len(labels))
+        self.labels = np.concatenate(label_parts)
+        self.vectors = np.concatenate(vector_parts).reshape(-1, self.dim)
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self._pending = {}
+        self._deleted = set()
+        self._deleted_array = None
+
+    def save(self, path):
+        """Write the index directory (atomically replacing path)"""
+        self.compact()
+        tmp = f"{path.rstrip('/')}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'centroids.npy'), np.ascontiguousarray(self.centroids, dtype=np.float32))
+        np.save(os.path.join(tmp, 'offsets.npy'), np.ascontiguousarray(self.offsets))
+        np.save(os.path.join(tmp, 'labels.npy'), np.ascontiguousarray(self.labels))
+        np.save(os.path.join(tmp, 'vectors.npy'), np.ascontiguousarray(self.vectors))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({"version": INDEX_FORMAT_VERSION, "type": "ivf", "metric": "cosine",
+                       "dim": int(self.dim), "nlist": int(self.nlist), "count": int(len(self.labels)),
+                       "dtype": self.dtype, "nprobe": int(self.nprobe),
+                       "trained_count": int(self.trained_count)}, f)
+        if os.path.isdir(path):
+            old = f"{path.rstrip('/')}.{os.getpid()}.old"
+            os.replace(path, old)
+            os.replace(tmp, path)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, nprobe=None, mmap=True):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION or meta.get("type") != "ivf":
+            raise ValueError(f"Unsupported index format in {path}: {meta}")
+        mode = 'r' if mmap else None
+        return cls(np.load(os.path.join(path, 'centroids.npy')),
+                   np.load(os.path.join(path, 'offsets.npy')),
+                   np.load(os.path.join(path, 'labels.npy'), mmap_mode=mode),
+                   np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mode),
+                   nprobe=nprobe or meta.get("nprobe", 16),
+                   trained_count=meta.get("trained_count"))
+
+    def stats(self):
+        sizes = np.diff(self.offsets)
+        return {
+            "type": "ivf",
+            "count": len(self),
+            "nlist": self.nlist,
+            "nprobe": self.nprobe,
+            "dtype": self.dtype,
+            "trained_count": self.trained_count,
+            "pending": sum(len(labels) for labels, _ in self._pending.values()),
+            "deleted": len(self._deleted),
+            "largest_list": int(sizes.max()) if len(sizes) else 0,
+        }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build an IVF index for the local search gallery')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--vectors', help='.npy matrix of vectors (labels = row numbers unless --labels)')
+    source.add_argument('--gallery-dir', help='index the current generation of a LocalGallery directory')
+    parser.add_argument('--labels', help='.npy int64 labels for --vectors')
+    parser.add_argument('--output', help='index directory (default: ivf.<generation> next to the gallery)')
+    parser.add_argument('--nlist', type=int, default=0, help='inverted lists (default about 4*sqrt(N))')
+    parser.add_argument('--nprobe', type=int, default=16, help='default lists probed per query')
+    parser.add_argument('--dtype', choices=INDEX_DTYPES, default='float32')
+    parser.add_argument('--iterations', type=int, default=10, help='k-means iterations')
+    parser.add_argument('--train-size', type=int, default=0, help='k-means sample size (default 64*nlist)')
+    args = parser.parse_args()
+
+    if args.gallery_dir:
+        with open(os.path.join(args.gallery_dir, 'current.json')) as f:
+            generation = json.load(f)["generation"]
+        vectors = np.load(os.path.join(args.gallery_dir, f'vectors.{generation}.npy'), mmap_mode='r')
+        with open(os.path.join(args.gallery_dir, f'points.{generation}.json')) as f:
+            labels = [point_label(p[0]) for p in json.load(f)]
+        output = args.output or os.path.join(args.gallery_dir, f'ivf.{generation}')
+    else:
+        if not args.output:
+            parser.error('--output is required with --vectors')
+        vectors = np.load(args.vectors, mmap_mode='r')
+        labels = np.load(args.labels) if args.labels else np.arange(len(vectors))
+        output = args.output
+
+    start = time.perf_counter()
+    index = IVFIndex.build(vectors, labels, nlist=args.nlist or None, nprobe=args.nprobe, dtype=args.dtype,
+                           iterations=args.iterations, train_size=args.train_size or None)
+    index.save(output)
+    print(f"Built {output} in {time.perf_counter() - start:.1f}s: {json.dumps(index.stats())}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,127 +1,198 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import cv2
 import numpy as np
 import requests
 import json
+import hmac
+import math
 import os
 import tempfile
+import threading
+import time
 import logging
 from urllib.parse import urlparse
 import ftplib
 import io
+import itertools
+import random
+import tarfile
+import zipfile
 from werkzeug.utils import secure_filename
-
-class MyEncoder:
-    def __init__(self, mod, batch_size=2, context=None):
-        # Lazy import mxnet
-        global mx, nd
-        import mxnet as mx
-        from mxnet import nd
-        self.mod = mod # is mx.mod.Module
-        self.batch_size = batch_size
-        self.ctx = context or mx.gpu(0)
-    def _preprocess_input(self, image):
-        if isinstance(image, np.ndarray):
-            image = image.astype('float')
-            #image = (image - 127.5) / 128.0
-            if image.ndim == 3:
-                image = np.transpose(image, (2, 0, 1))
-        return image
-    def __preprocess_input(self, images):
-        """Batch preprocessing"""
-        batch = []
-        for img in images:
-            preprocessed = self._preprocess_input(img)
-            batch.append(preprocessed)
-        return np.array(batch)
-    def compute_embedding_images(self, list_aligned_face_images, flip=True):
-        # Lazy import nd
-        global nd
-        from mxnet import nd
-        embeddings = []
-        # Process in batches
-        for i in range(0, len(list_aligned_face_images), self.batch_size):
-            batch_img = list_aligned_face_images[i:i + self.batch_size]
-            # Preprocess
-            batch_data = self.__preprocess_input(batch_img)
-            # Convert to MXNet array
-            data = nd.array(batch_data, ctx=self.ctx)
-            # Create data batch
-            db = mx.io.DataBatch(data=[data])
-            # Forward pass
-            self.mod.forward(db, is_train=False)
-            # Get output
-            net_out = self.mod.get_outputs()
-            # Extract embeddings (typically fc1_output or similar)
-            embedding = net_out[0].asnumpy()
-            if flip:
-                # Apply flip augmentation
-                flipped_data = nd.flip(data, axis=3)
-                db_flip = mx.io.DataBatch(data=[flipped_data])
-                self.mod.forward(db_flip, is_train=False)
-                net_out_flip = self.mod.get_outputs()
-                embedding_flip = net_out_flip[0].asnumpy()
-                # Average original and flipped embeddings
-                embedding = (embedding + embedding_flip) #/ 2.0
-            embeddings.append(embedding)
-        # Concatenate all embeddings
-        embeddings = np.concatenate(embeddings, axis=0)
-        return embeddings
+from werkzeug.datastructures import FileStorage
+from batcher import MicroBatcher
+from encoders import create_encoder, model_fingerprint
+from embedding_cache import EmbeddingCache
+import image_decode
+from decode_pool import DecodePool, StageTimer
+import serializers
+from gallery import LocalGallery
+from ftp_pool import FTPPool
+import face_align
+import admission
+import metrics
+import procmem
+import profiler
+from qdrant import QdrantClient, collection_url_from_search_url
 
 class FaceEmbeddingService:
     def __init__(self, config):
-        # Lazy import mxnet
-        global mx, nd
-        import mxnet as mx
-        from mxnet import nd
-
-        # Initialize model
-        symbol_file = config.get('MODEL_SYMBOL_PATH')
-        params_file = config.get('MODEL_PARAMS_PATH')
-
-        # Determine context (GPU or CPU)
-        use_gpu = config.get('USE_GPU', True)
-        gpu_id = config.get('GPU_ID', 0)
-        print("Using GPU:", use_gpu, "GPU ID:", gpu_id)
-        context = mx.gpu(gpu_id) if use_gpu else mx.cpu()
-        
-        # load model
-        sym = mx.sym.load(symbol_file)
-        model = mx.mod.Module(symbol=sym, context=context, label_names=None)
-        model.bind(for_training=False, data_shapes=[('data', (1, 3,112, 112))],
-                          label_shapes=None, force_rebind=True)
-        model.load_params(params_file)
-
-        # logging with process id
-        print(f"Process {os.getpid()}: Model loaded successfully.")
-        
         batch_size = config.get('BATCH_SIZE', 1)
-        self.encoder = MyEncoder(model, batch_size=batch_size, context=context)
+        # Cross-request micro-batching: concurrent requests in this worker share forward passes
+        self.batcher = None
+        if config.get('MICRO_BATCH_ENABLED', False):
+            max_batch = config.get('MICRO_BATCH_MAX_SIZE', 8)
+            batch_size = max(batch_size, max_batch)
+            self.batcher = MicroBatcher(
+                lambda images: self.encoder.compute_embedding_images(images),
+                max_batch_size=max_batch,
+                max_wait_ms=config.get('MICRO_BATCH_MAX_WAIT_MS', 5.0),
+                name='encoder-batcher')
+
+        # Inference backend (INFERENCE_BACKEND=mxnet|onnxruntime)
+        self.encoder = create_encoder(config, batch_size)
+        # Weights mapped from a file shared by the workers (SHARED_WEIGHTS), reported in stats()
+        self.shared_weights_dir = None
+        if config.get('SHARED_WEIGHTS', False) and self.encoder.backend == 'onnxruntime':
+            self.shared_weights_dir = config.get('SHARED_WEIGHTS_DIR')
         self.qdrant_url = config.get('QDRANT_URL', 'http://qdrant:6333/collections/f4r/points/search')
-        self.headers = {'Content-Type': 'application/json'}
+        # Pooled keep-alive client; concurrent searches can share /points/search/batch calls
+        self.qdrant = QdrantClient(
+            collection_url_from_search_url(self.qdrant_url),
+            connect_timeout=config.get('QDRANT_CONNECT_TIMEOUT', 2.0),
+            read_timeout=config.get('QDRANT_READ_TIMEOUT', 10.0),
+            retries=config.get('QDRANT_RETRIES', 2),
+            pool_size=config.get('QDRANT_POOL_SIZE', 10),
+            batch_enabled=config.get('QDRANT_BATCH_ENABLED', False),
+            batch_max_size=config.get('QDRANT_BATCH_MAX_SIZE', 16),
+            batch_max_wait_ms=config.get('QDRANT_BATCH_MAX_WAIT_MS', 2.0))
         self.max_search_results = config.get('MAX_SEARCH_RESULTS', 100)
+        # SEARCH_BACKEND=local: exact search over a memory-mapped snapshot of the Qdrant collection
+        self.gallery = None
+        search_backend = config.get('SEARCH_BACKEND', 'qdrant')
+        if search_backend not in ('qdrant', 'local'):
+            raise ValueError(f"Invalid SEARCH_BACKEND '{search_backend}'. Use 'qdrant' or 'local'")
+        if search_backend == 'local':
+            self.gallery = LocalGallery(
+                collection_url_from_search_url(self.qdrant_url),
+                config.get('GALLERY_DIR', '/tmp/face-gallery'),
+                qdrant=self.qdrant,
+                refresh_interval=config.get('GALLERY_REFRESH_INTERVAL', 60.0),
+                full_refresh_interval=config.get('GALLERY_FULL_REFRESH_INTERVAL', 3600.0),
+                index=config.get('GALLERY_INDEX', 'exact'),
+                ivf_nlist=config.get('GALLERY_IVF_NLIST', 0),
+                ivf_nprobe=config.get('GALLERY_IVF_NPROBE', 16),
+                ivf_dtype=config.get('GALLERY_IVF_DTYPE', 'float32'),
+                index_min_points=config.get('GALLERY_INDEX_MIN_POINTS', 50000))
+        self.reduced_decode = config.get('REDUCED_DECODE', True)
+
+        # Optional detection + 5-point alignment stage ahead of the encoder
+        self.max_faces = config.get('MAX_FACES_PER_IMAGE', 100)
+        self.face_crop_margin = config.get('FACE_CROP_MARGIN', 0.0)
+        self.detector = None
+        if config.get('FACE_DETECTION', False):
+            from face_detect import create_detector
+            self.detector = create_detector(config)
+
+        # Logged-in FTP sessions reused across requests (FTP_POOL_MAX_IDLE=0: connection per image)
+        self.ftp_timeout = config.get('FTP_TIMEOUT', 10.0)
+        self.ftp_pool = None
+        if config.get('FTP_POOL_MAX_IDLE', 0) > 0:
+            self.ftp_pool = FTPPool(
+                max_idle=config.get('FTP_POOL_MAX_IDLE'),
+                idle_timeout=config.get('FTP_POOL_IDLE_TIMEOUT', 60.0),
+                health_check_interval=config.get('FTP_POOL_HEALTH_CHECK_INTERVAL', 5.0),
+                timeout=self.ftp_timeout)
+
+        # Decode/resize stage in its own process pool, decoupled from inference
+        self.decode_pool = None
+        if config.get('DECODE_POOL_WORKERS', 0) > 0:
+            self.decode_pool = DecodePool(
+                workers=config.get('DECODE_POOL_WORKERS'),
+                queue_size=config.get('DECODE_POOL_QUEUE_SIZE', 64),
+                queue_timeout=config.get('DECODE_POOL_QUEUE_TIMEOUT', 10.0),
+                reduced=self.reduced_decode,
+                start_method=config.get('DECODE_POOL_START_METHOD', 'spawn'))
+        self._inference = StageTimer('inference')
+        self._detection = StageTimer('detection')
+
+        # Embedding cache keyed by image bytes + model/preprocessing version
+        self.cache = None
+        cache_size = config.get('EMBEDDING_CACHE_SIZE', 0)
+        cache_dir = config.get('EMBEDDING_CACHE_DIR')
+        if cache_size > 0 or cache_dir:
+            self.cache = EmbeddingCache(
+                max_entries=cache_size,
+                disk_dir=cache_dir,
+                disk_max_entries=config.get('EMBEDDING_CACHE_DISK_MAX_ENTRIES', 1000000),
+                version=model_fingerprint(config))
     
-    def load_image_from_path(self, image_path):
-        """Load image from local file path"""
+    def decode_image(self, raw):
+        """Decode encoded image bytes to a 112x112 RGB image, None if they cannot be decoded"""
+        admission.check_deadline('decode')
+        if self.detector is not None:
+            face = self.detect_and_align([raw])[0]
+            if isinstance(face, Exception):
+                raise face
+            return face
+        # Decode worker processes when configured, inline otherwise
+        if self.decode_pool is not None:
+            return self.decode_pool.decode(raw)
+        # Large JPEGs are decoded at reduced scale when they still cover 112x112
+        with metrics.stage('decode'):
+            return image_decode.decode_face(raw, 112, reduced=self.reduced_decode)
+
+    def detect_and_align(self, raws):
+        """
+        Aligned 112x112 RGB crop of the largest detected face for each encoded image
+        (None if undecodable, the exception if it failed). The similarity transforms
+        of all faces are estimated in one vectorized step. An image without a
+        detected face, e.g. an already cropped one, is resized whole as without detection.
+        """
+        results = [None] * len(raws)
+        images = {}
+        landmarks = []
+        for i, raw in enumerate(raws):
+            try:
+                with metrics.stage('decode'):
+                    img = image_decode.decode_image(raw, min_size=self.detector.min_size, reduced=self.reduced_decode)
+                if img is None:
+                    continue
+                with self._detection, metrics.stage('detect'):
+                    boxes, _, points = self.detector.detect(img)
+            except Exception as e:
+                results[i] = e
+                continue
+            if len(boxes) == 0:
+                results[i] = cv2.resize(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), (112, 112))
+                continue
+            largest = np.argmax((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))
+            images[i] = img
+            landmarks.append(points[largest])
+        if landmarks:
+            matrices = face_align.estimate_similarity(np.stack(landmarks), face_align.reference_landmarks(112))
+            for (i, img), matrix in zip(images.items(), matrices):
+                face = cv2.warpAffine(img, matrix, (112, 112), borderValue=0.0)
+                results[i] = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+        return results
+
+    def read_image_bytes_from_path(self, image_path):
+        """Read encoded image bytes from local file path"""
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image file not found: {image_path}")
-        
-        oimg = cv2.imread(image_path)
-        if oimg is None:
-            raise ValueError(f"Unable to load image from: {image_path}")
-        
-        img = cv2.cvtColor(oimg, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (112, 112))
-        return img
-    
-    def load_image_from_ftp(self, ftp_url, username=None, password=None):
-        """Load image from FTP URL"""
+        with open(image_path, 'rb') as f:
+            return f.read()
+
+    def read_image_bytes_from_ftp(self, ftp_url, username=None, password=None):
+        """Download encoded image bytes from FTP URL"""
         try:
+            if self.ftp_pool is not None:
+                return self.ftp_pool.retrieve(ftp_url, username, password)
+
             parsed_url = urlparse(ftp_url)
             if parsed_url.scheme != 'ftp':
                 raise ValueError("Invalid FTP URL")
             
-            ftp = ftplib.FTP()
+            ftp = ftplib.FTP(timeout=self.ftp_timeout)
             ftp.connect(parsed_url.hostname, parsed_url.port or 21)
             
             if username and password:
@@ -133,56 +204,221 @@ class FaceEmbeddingService:
             bio = io.BytesIO()
             ftp.retrbinary(f'RETR {parsed_url.path}', bio.write)
             ftp.quit()
-            
-            # Convert to image
-            bio.seek(0)
-            img_array = np.frombuffer(bio.getvalue(), np.uint8)
-            oimg = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            
-            if oimg is None:
-                raise ValueError("Unable to decode image from FTP")
-            
-            img = cv2.cvtColor(oimg, cv2.COLOR_BGR2RGB)
-            img = cv2.resize(img, (112, 112))
-            return img
+            return bio.getvalue()
             
         except Exception as e:
             raise ValueError(f"Error loading image from FTP: {str(e)}")
+
+    def read_image_bytes_from_ftp_many(self, ftp_urls, username=None, password=None):
+        """Encoded image bytes or the exception for each FTP URL, one session per host when pooled"""
+        if self.ftp_pool is None:
+            results = []
+            for ftp_url in ftp_urls:
+                try:
+                    results.append(self.read_image_bytes_from_ftp(ftp_url, username, password))
+                except Exception as e:
+                    results.append(e)
+            return results
+        return [ValueError(f"Error loading image from FTP: {str(r)}") if isinstance(r, Exception) else r
+                for r in self.ftp_pool.retrieve_many(ftp_urls, username, password)]
+
+    def read_image_bytes_from_file_upload(self, file):
+        """Read encoded image bytes from uploaded file"""
+        return file.read()
+
+    def load_image_from_path(self, image_path):
+        """Load image from local file path"""
+        img = self.decode_image(self.read_image_bytes_from_path(image_path))
+        if img is None:
+            raise ValueError(f"Unable to load image from: {image_path}")
+        return img
+    
+    def load_image_from_ftp(self, ftp_url, username=None, password=None):
+        """Load image from FTP URL"""
+        img = self.decode_image(self.read_image_bytes_from_ftp(ftp_url, username, password))
+        if img is None:
+            raise ValueError("Error loading image from FTP: Unable to decode image from FTP")
+        return img
     
     def load_image_from_file_upload(self, file):
         """Load image from uploaded file"""
-        try:
-            # Read file content
-            file_content = file.read()
-            
-            # Convert to numpy array and decode
-            img_array = np.frombuffer(file_content, np.uint8)
-            oimg = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
-            
-            if oimg is None:
-                raise ValueError("Unable to decode uploaded image")
-            
-            img = cv2.cvtColor(oimg, cv2.COLOR_BGR2RGB)
-            img = cv2.resize(img, (112, 112))
-            return img
-            
-        except Exception as e:
-            raise ValueError(f"Error processing uploaded image: {str(e)}")
+        img = self.decode_image(self.read_image_bytes_from_file_upload(file))
+        if img is None:
+            raise ValueError("Error processing uploaded image: Unable to decode uploaded image")
+        return img
+
+    def embed_image_bytes(self, raw, decode_error="Unable to decode image"):
+        """Embedding for encoded image bytes, from the embedding cache when possible"""
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(raw)
+            embedding = self.cache.get(key)
+            if embedding is not None:
+                return embedding
+        img = self.decode_image(raw)
+        if img is None:
+            raise ValueError(decode_error)
+        embedding = self.compute_embedding(img)
+        if key is not None:
+            self.cache.put(key, embedding)
+        return embedding
+    
+    def embed_image_bytes_many(self, raws, batch_size=None):
+        """
+        Embeddings for several encoded images: cache lookups, one decode fan-out and
+        one batched forward for the misses. Items may be exceptions (failed reads),
+        which are passed through. Each result is an embedding or the exception for
+        that item, in input order.
+        """
+        results = [None] * len(raws)
+        keys = [None] * len(raws)
+        pending = []
+        for i, raw in enumerate(raws):
+            if isinstance(raw, Exception):
+                results[i] = raw
+                continue
+            if self.cache is not None:
+                keys[i] = self.cache.key(raw)
+                embedding = self.cache.get(keys[i])
+                if embedding is not None:
+                    results[i] = embedding
+                    continue
+            pending.append(i)
+        # Past the deadline: fail the remaining items instead of decoding them
+        expired = admission.deadline_error('decode')
+        if expired is not None:
+            for i in pending:
+                results[i] = expired
+            return results
+        if self.detector is not None:
+            decoded = self.detect_and_align([raws[i] for i in pending])
+        elif self.decode_pool is not None:
+            decoded = self.decode_pool.decode_many([raws[i] for i in pending])
+        else:
+            decoded = []
+            for i in pending:
+                try:
+                    with metrics.stage('decode'):
+                        decoded.append(image_decode.decode_face(raws[i], 112, reduced=self.reduced_decode))
+                except Exception as e:
+                    decoded.append(e)
+        images = []
+        image_indices = []
+        for i, img in zip(pending, decoded):
+            if img is None:
+                results[i] = ValueError("Unable to decode image")
+            elif isinstance(img, Exception):
+                results[i] = img
+            else:
+                images.append(img)
+                image_indices.append(i)
+        if images:
+            try:
+                admission.check_deadline('forward')
+                with self._inference:
+                    embeddings = self.encoder.compute_embedding_images(images, batch_size=batch_size)
+            except Exception as e:
+                embeddings = [e] * len(images)
+            for i, embedding in zip(image_indices, embeddings):
+                results[i] = embedding
+                if keys[i] is not None and not isinstance(embedding, Exception):
+                    self.cache.put(keys[i], embedding)
+        return results
     
     def compute_embedding(self, img):
         """Compute embedding for a single image"""
-        rs = self.encoder.compute_embedding_images([img])
-        return rs[0]
+        admission.check_deadline('forward')
+        with self._inference:
+            if self.batcher is not None:
+                return self.batcher.submit(img)
+            rs = self.encoder.compute_embedding_images([img])
+            return rs[0]
+
+    def stats(self):
+        """Runtime statistics for this worker"""
+        return {
+            "pid": os.getpid(),
+            "batcher": self.batcher.stats() if self.batcher is not None else None,
+            "decode_pool": self.decode_pool.stats() if self.decode_pool is not None else None,
+            "inference": self._inference.stats(),
+            "detection": self._detection.stats() if self.detector is not None else None,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "gallery": self.gallery.stats() if self.gallery is not None else None,
+            "qdrant": self.qdrant.stats(),
+            "ftp_pool": self.ftp_pool.stats() if self.ftp_pool is not None else None,
+            # uss: memory unique to this worker; mapped: the shared weights file's pages
+            "memory": procmem.memory_usage(mapped_prefix=self.shared_weights_dir),
+        }
     
     def search_similar_faces(self, embedding, top=5):
-        """Search for similar faces in Qdrant"""
-        data = {
-            "vector": embedding.tolist(),
-            "top": top,
-            "with_payload": True
-        }
-        response = requests.post(self.qdrant_url, headers=self.headers, data=json.dumps(data))
-        return response.json()
+        """Search for similar faces in Qdrant, or in the local gallery snapshot"""
+        admission.check_deadline('search')
+        if self.gallery is not None:
+            with metrics.stage('gallery'):
+                return self.gallery.search(embedding, top)
+        return self.qdrant.search(embedding, top)
+
+    def search_similar_faces_many(self, embeddings, top=5):
+        """One search response per embedding, in one Qdrant batch call or one local gallery pass"""
+        if not embeddings:
+            return []
+        admission.check_deadline('search')
+        if self.gallery is not None:
+            with metrics.stage('gallery'):
+                return self.gallery.search_many(embeddings, top)
+        return self.qdrant.search_many(embeddings, top)
+
+    def find_faces(self, raw, boxes=None, decode_error="Unable to decode image"):
+        """
+        (BGR image, faces, crops) for every face of an encoded image: the client-supplied
+        boxes, cropped like FaceAligner.crop_image, else the detected faces, aligned.
+        Each face is {"box"} plus "score" and "landmarks" when detected, in original
+        image coordinates; crops are 112x112 RGB.
+        """
+        if boxes is None and self.detector is None:
+            raise ValueError("faces=all needs FACE_DETECTION=true or client-supplied 'boxes'")
+        admission.check_deadline('decode')
+        if boxes is not None:
+            # Client boxes are in original image coordinates: full-size decode
+            with metrics.stage('decode'):
+                img, _ = image_decode.decode_image_scaled(raw, reduced=False)
+            if img is None:
+                raise ValueError(decode_error)
+            # Crops are taken at integer pixels inside the image; a box without any would embed an empty crop
+            height, width = img.shape[:2]
+            for i, box in enumerate(boxes):
+                x1, y1, x2, y2 = (int(v) for v in box)
+                if min(x2, width) <= max(x1, 0) or min(y2, height) <= max(y1, 0):
+                    raise ValueError(f"Box {i} {box} does not cover any pixel of the {width}x{height} image")
+            crops = face_align.crop_faces(img, boxes, 112, margin=self.face_crop_margin)
+            faces = [{"box": [float(v) for v in box]} for box in boxes]
+        else:
+            with metrics.stage('decode'):
+                img, scale = image_decode.decode_image_scaled(raw, min_size=self.detector.min_size,
+                                                              reduced=self.reduced_decode)
+            if img is None:
+                raise ValueError(decode_error)
+            with self._detection, metrics.stage('detect'):
+                det_boxes, scores, landmarks = self.detector.detect(img)
+            det_boxes, scores, landmarks = (a[:self.max_faces] for a in (det_boxes, scores, landmarks))
+            crops = face_align.align_faces(img, landmarks, 112)
+            faces = [{"box": np.round(box.astype(np.float64) * scale, 1).tolist(), "score": round(float(score), 4),
+                      "landmarks": np.round(points.astype(np.float64) * scale, 1).tolist()}
+                     for box, score, points in zip(det_boxes, scores, landmarks)]
+        return img, faces, [cv2.cvtColor(crop, cv2.COLOR_BGR2RGB) for crop in crops]
+
+    def embed_faces(self, raw, boxes=None, decode_error="Unable to decode image"):
+        """find_faces entries with their "embedding", all crops in one forward pass"""
+        _, faces, crops = self.find_faces(raw, boxes, decode_error)
+        if not faces:
+            return []
+        admission.check_deadline('forward')
+        with self._inference:
+            embeddings = self.encoder.compute_embedding_images(crops, batch_size=len(crops))
+        for face, embedding in zip(faces, embeddings):
+            face["embedding"] = embedding
+            face["embedding_shape"] = embedding.shape
+        return faces
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -207,17 +443,229 @@ def get_face_service():
         get_face_service._instance = FaceEmbeddingService(app.config)
     return get_face_service._instance
 
+def metrics_endpoint():
+    """Route pattern of the request, a bounded label for metrics"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def note_error(e):
+    """Label the failed request's error metric with the exception class"""
+    g.metrics_error = type(e).__name__
+
+# Per-request stage timelines: Server-Timing header and sampled traces
+server_timing = app.config.get('SERVER_TIMING', False)
+trace_sample_rate = app.config.get('TRACE_SAMPLE_RATE', 0.0)
+trace_slow_seconds = app.config.get('TRACE_SLOW_MS', 0.0) / 1000.0
+trace_log = None
+if trace_sample_rate > 0 or trace_slow_seconds > 0:
+    trace_log = metrics.TraceLog(app.config.get('TRACE_LOG_PATH'), app.logger)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.request_started()
+    if server_timing or trace_log is not None:
+        g.timeline = metrics.begin_timeline(g.request_start, sampled=random.random() < trace_sample_rate)
+
+# Admission control: bounded in-flight requests per worker, request deadlines, fast 503s
+admission_controller = None
+if app.config.get('ADMISSION_MAX_IN_FLIGHT', 0) > 0:
+    admission_controller = admission.AdmissionController(
+        max_in_flight=app.config.get('ADMISSION_MAX_IN_FLIGHT'),
+        max_queue=app.config.get('ADMISSION_MAX_QUEUE', 8),
+        queue_timeout=app.config.get('ADMISSION_QUEUE_TIMEOUT', 1.0))
+# Cheap endpoints stay available under overload
+ADMISSION_EXEMPT = ('/health', '/stats', '/metrics', '/debug/profile')
+
+def overloaded_response(e):
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(app.config.get('ADMISSION_RETRY_AFTER', 1))
+    return response
+
+@app.before_request
+def admit_request():
+    if request.path in ADMISSION_EXEMPT:
+        return None
+    try:
+        deadline = admission.start_request(
+            request.headers.get('X-Request-Start'), request.headers.get('X-Request-Timeout'),
+            default_timeout_ms=app.config.get('REQUEST_TIMEOUT_MS', 0),
+            max_queue_ms=app.config.get('ADMISSION_MAX_QUEUE_MS', 0))
+        if admission_controller is not None:
+            admission_controller.acquire(deadline)
+            g.admitted = True
+    except admission.Overloaded as e:
+        note_error(e)
+        return overloaded_response(e)
+    return None
+
+@app.after_request
+def count_error_response(response):
+    g.status = response.status_code
+    if response.status_code >= 400:
+        metrics.count_error(metrics_endpoint(), g.get('metrics_error') or f"http_{response.status_code}")
+    # Stages of a streamed body are not done yet; the trace has them
+    if server_timing and 'timeline' in g:
+        response.headers['Server-Timing'] = g.timeline.server_timing(time.perf_counter() - g.request_start)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # A streamed response tears down twice, when the view returns and after the body: count the second
+    if g.pop('streaming', False):
+        return
+    if g.pop('admitted', False):
+        admission_controller.release()
+    admission.end_request()
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    total = time.perf_counter() - start
+    metrics.request_finished(metrics_endpoint(), total)
+    timeline = g.pop('timeline', None)
+    if timeline is not None:
+        metrics.end_timeline()
+        if trace_log is not None and (timeline.sampled or (trace_slow_seconds > 0 and total >= trace_slow_seconds)):
+            trace_log.write(timeline.trace(
+                total, ts=time.time(), pid=os.getpid(), method=request.method, endpoint=metrics_endpoint(),
+                status=g.get('status', 500), request_id=request.headers.get('X-Request-ID'),
+                reason="sampled" if timeline.sampled else "slow"))
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def parse_faces_params(request, data, max_faces):
+    """
+    (multi-face mode, client boxes or None) from 'faces' and 'boxes' in the query
+    string, form fields or JSON body. Supplied boxes imply faces=all.
+    """
+    faces = request.args.get('faces') or request.form.get('faces') or (data or {}).get('faces') or 'one'
+    boxes = (data or {}).get('boxes')
+    if boxes is None and request.form.get('boxes'):
+        try:
+            boxes = json.loads(request.form['boxes'])
+        except ValueError:
+            raise ValueError("Invalid 'boxes'. Use a JSON list of [x1, y1, x2, y2]")
+    if faces not in ('one', 'all'):
+        raise ValueError("Invalid 'faces' parameter. Use 'one' or 'all'")
+    if boxes is None:
+        return faces == 'all', None
+    if not isinstance(boxes, list) or not all(
+            isinstance(b, list) and len(b) == 4
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in b)
+            for b in boxes):
+        raise ValueError("Invalid 'boxes'. Use a JSON list of [x1, y1, x2, y2]")
+    if len(boxes) > max_faces:
+        raise ValueError(f"Too many boxes. At most {max_faces} per image")
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        if x2 <= x1 or y2 <= y1:
+            raise ValueError(f"Invalid box {i}: {boxes[i]}. Needs x2 > x1 and y2 > y1")
+    return True, boxes
+
+def format_response(payload, fmt, status=200):
+    """Response body in the negotiated format (see serializers.negotiate)"""
+    with metrics.stage('serialize'):
+        body = serializers.encode(payload, fmt)
+    return Response(body, status=status, mimetype=fmt.mimetype)
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({"status": "healthy", "message": "Face embedding API is running"})
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus exposition, summed over all gunicorn workers (multiprocess mode)"""
+    exposition = metrics.render()
+    if exposition is None:
+        return jsonify({"error": "Metrics are disabled (METRICS_ENABLED=false or prometheus_client not installed)"}), 404
+    body, content_type = exposition
+    return Response(body, content_type=content_type)
+
+_profile_lock = threading.Lock()
+
+def debug_authorized(authorization):
+    """Whether an Authorization header carries DEBUG_PROFILE_TOKEN (constant-time comparison)"""
+    token = app.config.get('DEBUG_PROFILE_TOKEN')
+    return bool(token) and hmac.compare_digest((authorization or '').encode(), f"Bearer {token}".encode())
+
+def run_profile(args):
+    """
+    (body, mimetype) of a /debug/profile request; blocks for its seconds. mode=python
+    samples every thread of this worker (format=collapsed stacks, a top table, or a
+    pstats file; idle=true keeps threads blocked in waits); mode=operators times the
+    MXNet encoder's operators over the forward passes run meanwhile.
+    """
+    try:
+        seconds = float(args.get('seconds', 10))
+        interval_ms = float(args.get('interval_ms', 5))
+        limit = int(args.get('limit', 50))
+    except ValueError:
+        raise ValueError("Invalid 'seconds', 'interval_ms' or 'limit'. Must be numbers")
+    max_seconds = app.config.get('DEBUG_PROFILE_MAX_SECONDS', 60)
+    if not 0 < seconds <= max_seconds:
+        raise ValueError(f"Parameter 'seconds' must be between 0 and {max_seconds:g}")
+    mode = args.get('mode', 'python')
+    if mode == 'operators':
+        encoder = get_face_service().encoder
+        if not hasattr(encoder, 'profile_operators'):
+            raise ValueError("Operator profiling needs INFERENCE_BACKEND=mxnet")
+        return encoder.profile_operators(seconds), 'text/plain'
+    if mode != 'python':
+        raise ValueError("Invalid 'mode'. Use 'python' or 'operators'")
+    fmt = args.get('format', 'collapsed')
+    if fmt not in ('collapsed', 'top', 'pstats'):
+        raise ValueError("Invalid 'format'. Use 'collapsed', 'top' or 'pstats'")
+    if not 0.5 <= interval_ms <= 1000:
+        raise ValueError("Parameter 'interval_ms' must be between 0.5 and 1000")
+    idle = args.get('idle', 'false')
+    if idle not in ('true', 'false'):
+        raise ValueError("Invalid 'idle'. Use 'true' or 'false'")
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running in this worker")
+    try:
+        # The thread serving this request only sleeps: leave it out
+        result = profiler.SamplingProfiler(interval_ms / 1000.0, exclude_threads={threading.get_ident()},
+                                           include_idle=idle == 'true').run(seconds)
+    finally:
+        _profile_lock.release()
+    if fmt == 'collapsed':
+        return result.collapsed(), 'text/plain'
+    if fmt == 'pstats':
+        return result.pstats(), 'application/octet-stream'
+    return result.top(limit, sort=args.get('sort', 'self')), 'text/plain'
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """
+    Profile this worker for ?seconds=N (needs DEBUG_PROFILE_TOKEN). Other requests
+    are only seen when the worker serves several at once (GUNICORN_THREADS > 1 or asyncio mode).
+    """
+    if not app.config.get('DEBUG_PROFILE_TOKEN'):
+        return jsonify({"error": "Not found"}), 404
+    if not debug_authorized(request.headers.get('Authorization')):
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        body, mimetype = run_profile(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    headers = {'X-Profile-PID': str(os.getpid())}
+    if isinstance(body, bytes):
+        headers['Content-Disposition'] = f'attachment; filename="profile-{os.getpid()}.pstats"'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Per-worker runtime statistics (micro-batching queue depth, batch sizes)"""
+    stats = get_face_service().stats()
+    stats["admission"] = admission_controller.stats() if admission_controller is not None else None
+    return jsonify(stats)
+
 @app.route('/embed', methods=['POST'])
 def embed_image():
     """
@@ -226,7 +674,12 @@ def embed_image():
     - File upload (multipart/form-data with 'image' field)
     - Local file path (JSON with 'image_path' field)
     - FTP URL (JSON with 'ftp_url' field and optional 'username', 'password')
+    Response format by Accept header or ?format=json|base64|binary|msgpack (&dtype=float16)
     """
+    try:
+        fmt = serializers.negotiate(request)
+    except serializers.NotAcceptable as e:
+        return jsonify({"error": str(e)}), 406
     try:
         face_service = get_face_service()
         # Check if it's a file upload
@@ -238,7 +691,8 @@ def embed_image():
             if not allowed_file(file.filename):
                 return jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff"}), 400
             
-            img = face_service.load_image_from_file_upload(file)
+            raw = face_service.read_image_bytes_from_file_upload(file)
+            decode_error = "Error processing uploaded image: Unable to decode uploaded image"
             source_type = "file_upload"
             source_info = {"filename": secure_filename(file.filename)}
         
@@ -247,14 +701,16 @@ def embed_image():
             data = request.get_json()
             
             if 'image_path' in data:
-                img = face_service.load_image_from_path(data['image_path'])
+                raw = face_service.read_image_bytes_from_path(data['image_path'])
+                decode_error = f"Unable to load image from: {data['image_path']}"
                 source_type = "file_path"
                 source_info = {"path": data['image_path']}
             
             elif 'ftp_url' in data:
                 username = data.get('username')
                 password = data.get('password')
-                img = face_service.load_image_from_ftp(data['ftp_url'], username, password)
+                raw = face_service.read_image_bytes_from_ftp(data['ftp_url'], username, password)
+                decode_error = "Error loading image from FTP: Unable to decode image from FTP"
                 source_type = "ftp_url"
                 source_info = {"url": data['ftp_url']}
             
@@ -264,25 +720,221 @@ def embed_image():
         else:
             return jsonify({"error": "No image data provided. Use file upload or JSON with image_path/ftp_url"}), 400
         
+        metrics.count_image(metrics_endpoint(), source_type)
+        multi_face, boxes = parse_faces_params(request, request.get_json(silent=True) if request.is_json else None,
+                                               face_service.max_faces)
+        if multi_face:
+            # One embedding per detected or supplied face, all in one forward pass
+            faces = face_service.embed_faces(raw, boxes, decode_error)
+            return format_response({
+                "success": True,
+                "source_type": source_type,
+                "source_info": source_info,
+                "faces": faces,
+                "face_count": len(faces),
+                "flip_tta": face_service.encoder.flip_mode
+            }, fmt)
+
         # Compute embedding
         app.logger.info(f"Computing embedding for source type: {source_type}")  
-        embedding = face_service.compute_embedding(img)
+        embedding = face_service.embed_image_bytes(raw, decode_error)
         
-        return jsonify({
+        return format_response({
             "success": True,
             "source_type": source_type,
             "source_info": source_info,
-            "embedding": embedding.tolist(),
-            "embedding_shape": embedding.shape
-        })
+            "embedding": embedding,
+            "embedding_shape": embedding.shape,
+            "flip_tta": face_service.encoder.flip_mode
+        }, fmt)
     
     except FileNotFoundError as e:
+        note_error(e)
         return jsonify({"error": str(e)}), 404
     except ValueError as e:
+        note_error(e)
         return jsonify({"error": str(e)}), 400
+    except TimeoutError as e:
+        # Deadline passed (504) or a full decode queue (503)
+        note_error(e)
+        return timeout_response(e)
     except Exception as e:
+        note_error(e)
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+def error_status(e):
+    """HTTP status for a per-item error, matching the single-image endpoints"""
+    if isinstance(e, FileNotFoundError):
+        return 404
+    if isinstance(e, ValueError):
+        return 400
+    if isinstance(e, admission.DeadlineExceeded):
+        return 504
+    if isinstance(e, (TimeoutError, admission.Overloaded)):
+        return 503
+    return 500
+
+def timeout_response(e):
+    """504 for a passed request deadline, 503 + Retry-After for a full queue"""
+    if isinstance(e, admission.DeadlineExceeded):
+        response = jsonify({"error": str(e)})
+        response.status_code = 504
+        return response
+    return overloaded_response(e)
+
+def keep_upload_open(file):
+    """
+    Copy of an uploaded file whose stream outlives the request: Flask closes
+    request.files when the view returns, before a streamed response body runs.
+    """
+    try:
+        # Spooled temp file: share the underlying file through a second descriptor
+        stream = os.fdopen(os.dup(file.stream.fileno()), 'rb')
+        stream.seek(0)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        file.stream.seek(0)
+        stream = io.BytesIO(file.stream.read())
+    return FileStorage(stream=stream, filename=file.filename, name=file.name,
+                       content_type=file.content_type)
+
+def iter_archive_images(file):
+    """(member name, bytes or exception) for the image members of an uploaded zip or tar archive"""
+    stream = file.stream
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not allowed_file(info.filename):
+                    continue
+                try:
+                    yield info.filename, zf.read(info)
+                except Exception as e:
+                    yield info.filename, ValueError(f"Error reading archive member: {str(e)}")
+        return
+    stream.seek(0)
+    # Streamed tar read (plain, gz, bz2 or xz): members are read one at a time
+    try:
+        tf = tarfile.open(fileobj=stream, mode='r|*')
+    except tarfile.TarError:
+        raise ValueError("Invalid archive. Use a zip or tar file")
+    with tf:
+        for member in tf:
+            if not member.isfile() or not allowed_file(member.name):
+                continue
+            yield member.name, tf.extractfile(member).read()
+
+def iter_batch_items(face_service, uploads, archives, data, chunk_size=32):
+    """(source_type, source_info, bytes or exception) for every image of a /embed/batch request"""
+    for file in uploads:
+        source_info = {"filename": secure_filename(file.filename or '')}
+        if not allowed_file(file.filename or ''):
+            yield "file_upload", source_info, ValueError("Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff")
+            continue
+        try:
+            yield "file_upload", source_info, face_service.read_image_bytes_from_file_upload(file)
+        finally:
+            file.close()
+    for file in archives:
+        archive = secure_filename(file.filename or '')
+        try:
+            for name, raw in iter_archive_images(file):
+                yield "archive", {"archive": archive, "member": name}, raw
+        finally:
+            file.close()
+    for image_path in data.get('image_paths') or []:
+        try:
+            raw = face_service.read_image_bytes_from_path(image_path)
+        except Exception as e:
+            raw = e
+        yield "file_path", {"path": image_path}, raw
+    username = data.get('username')
+    password = data.get('password')
+    ftp_urls = data.get('ftp_urls') or []
+    # Fetched a chunk at a time over pooled sessions
+    for start in range(0, len(ftp_urls), chunk_size):
+        urls = ftp_urls[start:start + chunk_size]
+        for ftp_url, raw in zip(urls, face_service.read_image_bytes_from_ftp_many(urls, username, password)):
+            yield "ftp_url", {"url": ftp_url}, raw
+
+@app.route('/embed/batch', methods=['POST'])
+def embed_batch():
+    """
+    Compute embeddings for many images in one request
+    Supports:
+    - File uploads (multipart/form-data with repeated 'images' fields and/or zip/tar 'archive' fields)
+    - Local file paths (JSON with 'image_paths' list)
+    - FTP URLs (JSON with 'ftp_urls' list and optional 'username', 'password')
+    Results are streamed as NDJSON, one line per image as each model-sized chunk
+    finishes, followed by a summary line. A bad image gives an error line, not a failed request.
+    Other formats by Accept header or ?format=: base64 (NDJSON), msgpack (one object per
+    image) or binary (one frame per chunk, no summary).
+    """
+    try:
+        fmt = serializers.negotiate(request)
+    except serializers.NotAcceptable as e:
+        return jsonify({"error": str(e)}), 406
+    face_service = get_face_service()
+    data = {}
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Invalid JSON body"}), 400
+        for field in ('image_paths', 'ftp_urls'):
+            if field in data and not isinstance(data[field], list):
+                return jsonify({"error": f"'{field}' must be a list"}), 400
+    uploads = [keep_upload_open(f) for f in request.files.getlist('images')]
+    archives = [keep_upload_open(f) for f in request.files.getlist('archive')]
+    if not (uploads or archives or data.get('image_paths') or data.get('ftp_urls')):
+        return jsonify({"error": "No image data provided. Use 'images'/'archive' file uploads or JSON with image_paths/ftp_urls"}), 400
+
+    chunk_size = max(1, app.config.get('EMBED_BATCH_CHUNK_SIZE', 32))
+    max_items = app.config.get('EMBED_BATCH_MAX_ITEMS', 10000)
+    flip_mode = face_service.encoder.flip_mode
+    items = iter_batch_items(face_service, uploads, archives, data, chunk_size)
+    endpoint = metrics_endpoint()
+
+    def generate():
+        index = 0
+        failed = 0
+        while True:
+            try:
+                chunk = list(itertools.islice(items, chunk_size))
+            except Exception as e:
+                # The input itself is unreadable (e.g. a corrupt archive): report and stop
+                failed += 1
+                yield serializers.encode_records([{"index": index, "error": str(e), "status": error_status(e)}], fmt)
+                break
+            if not chunk:
+                break
+            if index + len(chunk) > max_items:
+                failed += 1
+                yield serializers.encode_records([{"index": index, "error": f"Batch limit of {max_items} images exceeded", "status": 413}], fmt)
+                break
+            results = face_service.embed_image_bytes_many([raw for _, _, raw in chunk], batch_size=chunk_size)
+            records = []
+            for (source_type, source_info, _), result in zip(chunk, results):
+                record = {"index": index, "source_type": source_type, "source_info": source_info}
+                metrics.count_image(endpoint, source_type)
+                if isinstance(result, Exception):
+                    metrics.count_error(endpoint, result)
+                    failed += 1
+                    record["error"] = str(result)
+                    record["status"] = error_status(result)
+                else:
+                    record["embedding"] = result
+                    record["embedding_shape"] = result.shape
+                records.append(record)
+                index += 1
+            with metrics.stage('serialize'):
+                body = serializers.encode_records(records, fmt)
+            yield body
+        app.logger.info(f"Batch embedding done: {index} images, {failed} errors")
+        if fmt.name != 'binary':
+            yield serializers.encode_records([{"done": True, "count": index, "failed": failed, "flip_tta": flip_mode}], fmt)
+
+    g.streaming = True
+    return Response(stream_with_context(generate()), mimetype=fmt.stream_mimetype)
+
 
 def handle_embed_and_search(request):
     """
@@ -298,7 +950,8 @@ def handle_embed_and_search(request):
                 return None, None, None, None, jsonify({"error": "No file selected"}), 400
             if not allowed_file(file.filename):
                 return None, None, None, None, jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff"}), 400
-            img = face_service.load_image_from_file_upload(file)
+            raw = face_service.read_image_bytes_from_file_upload(file)
+            decode_error = "Error processing uploaded image: Unable to decode uploaded image"
             source_type = "file_upload"
             source_info = {"filename": secure_filename(file.filename)}
             # Get top parameter from form data if available
@@ -317,13 +970,15 @@ def handle_embed_and_search(request):
                 except (ValueError, TypeError):
                     return None, None, None, None, jsonify({"error": "Invalid 'top' parameter. Must be an integer"}), 400
             if 'image_path' in data:
-                img = face_service.load_image_from_path(data['image_path'])
+                raw = face_service.read_image_bytes_from_path(data['image_path'])
+                decode_error = f"Unable to load image from: {data['image_path']}"
                 source_type = "file_path"
                 source_info = {"path": data['image_path']}
             elif 'ftp_url' in data:
                 username = data.get('username')
                 password = data.get('password')
-                img = face_service.load_image_from_ftp(data['ftp_url'], username, password)
+                raw = face_service.read_image_bytes_from_ftp(data['ftp_url'], username, password)
+                decode_error = "Error loading image from FTP: Unable to decode image from FTP"
                 source_type = "ftp_url"
                 source_info = {"url": data['ftp_url']}
             else:
@@ -334,15 +989,30 @@ def handle_embed_and_search(request):
         max_results = face_service.max_search_results
         if top < 1 or top > max_results:
             return None, None, None, None, jsonify({"error": f"Parameter 'top' must be between 1 and {max_results}"}), 400
+        metrics.count_image(metrics_endpoint(), source_type)
+        multi_face, boxes = parse_faces_params(request, request.get_json(silent=True) if request.is_json else None,
+                                               face_service.max_faces)
+        if multi_face:
+            # All faces in one forward pass, their searches in one batch
+            faces = face_service.embed_faces(raw, boxes, decode_error)
+            search_results = face_service.search_similar_faces_many([f["embedding"] for f in faces], top)
+            return faces, None, source_type, source_info, search_results, top
         # Compute embedding and search
-        embedding = face_service.compute_embedding(img)
+        embedding = face_service.embed_image_bytes(raw, decode_error)
         search_results = face_service.search_similar_faces(embedding, top)
-        return embedding, img, source_type, source_info, search_results, top
+        return embedding, None, source_type, source_info, search_results, top
     except FileNotFoundError as e:
+        note_error(e)
         return None, None, None, None, jsonify({"error": str(e)}), 404
     except ValueError as e:
+        note_error(e)
         return None, None, None, None, jsonify({"error": str(e)}), 400
+    except TimeoutError as e:
+        note_error(e)
+        response = timeout_response(e)
+        return None, None, None, None, response, response.status_code
     except Exception as e:
+        note_error(e)
         return None, None, None, None, jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 @app.route('/search', methods=['POST'])
@@ -358,22 +1028,44 @@ def search_similar():
     # elif 'embedding' in request.form:
     #     embedding_param = request.form.get('embedding', 'false').lower() == 'true'
     print("Embedding param check disabled for /search endpoint")
+    try:
+        # Search results are structured, so no binary frames here
+        fmt = serializers.negotiate(request, allowed=('json', 'base64', 'msgpack'))
+    except serializers.NotAcceptable as e:
+        return jsonify({"error": str(e)}), 406
     result = handle_embed_and_search(request)
   
     embedding, img, source_type, source_info, search_results, top = result
+    if embedding is None:
+        # Error: search_results holds the error response and top its status code
+        return search_results, top
+    if isinstance(embedding, list):
+        # faces=all: embedding holds the faces, search_results one response per face
+        return format_response({
+            "success": True,
+            "source_type": source_type,
+            "source_info": source_info,
+            "top": top,
+            "flip_tta": get_face_service().encoder.flip_mode,
+            "faces": [dict({k: v for k, v in face.items() if k not in ("embedding", "embedding_shape")},
+                           search_results=results)
+                      for face, results in zip(embedding, search_results)],
+            "face_count": len(embedding)
+        }, fmt, 200)
     response = {
         "success": True,
         "source_type": source_type,
         "source_info": source_info,
         "top": top,
+        "flip_tta": get_face_service().encoder.flip_mode,
         "search_results": search_results
     }
     if embedding_param:
-        response["embedding"] = embedding.tolist()
+        response["embedding"] = embedding
         response["embedding_shape"] = embedding.shape
 
     print("Response:", response)
-    return jsonify(response) , 200
+    return format_response(response, fmt, 200)
     
 if __name__ == '__main__':
     # For development only - use gunicorn for production
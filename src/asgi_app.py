@@ -0,0 +1,573 @@
+"""
+Asyncio serving mode: the endpoints of app.py as an ASGI application.
+
+Network I/O (FTP fetches, Qdrant calls) runs as coroutines on the event loop;
+decode and the forward pass run in a bounded thread pool. One process with one
+model copy keeps many requests in flight, and /embed/batch fetches its next
+chunk while the current one is embedded.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+    gunicorn -k uvicorn.workers.UvicornWorker --config gunicorn_config.py asgi_app:app
+"""
+import asyncio
+import contextvars
+import functools
+import io
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.utils import secure_filename
+from werkzeug.wrappers import Request
+
+import admission
+import app as wsgi_app
+import async_ftp
+import metrics
+import serializers
+from qdrant import AsyncQdrantClient
+
+config = wsgi_app.app.config
+logger = wsgi_app.app.logger
+
+
+class HTTPError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class CPUExecutor:
+    """
+    Thread pool for decode and inference. At most threads + queue_size calls are
+    pending; beyond that a call waits up to queue_timeout seconds for a slot and
+    then fails with admission.Overloaded (503).
+    """
+
+    def __init__(self, threads=4, queue_size=64, queue_timeout=10.0):
+        self.threads = threads
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='cpu')
+        self._slots = asyncio.Semaphore(threads + queue_size)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        # No longer than the request has left: past its deadline the result would be wasted
+        timeout = self.queue_timeout
+        remaining = admission.remaining()
+        if remaining is not None and remaining < timeout:
+            admission.check_deadline('queue')
+            timeout = remaining
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            admission.check_deadline('queue')
+            self.rejected += 1
+            raise admission.Overloaded("Inference queue is full, try again later")
+        self.pending += 1
+        try:
+            # In the caller's context, so stages land on the request's timeline
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self.pool, context.run, functools.partial(fn, *args))
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "threads": self.threads,
+            "queue_size": self.queue_size,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+class AsyncFaceService:
+    """FaceEmbeddingService calls for the event loop"""
+
+    def __init__(self, face_service, config):
+        self.face_service = face_service
+        self.cpu = CPUExecutor(
+            threads=config.get('ASGI_CPU_THREADS', 4),
+            queue_size=config.get('ASGI_CPU_QUEUE_SIZE', 64),
+            queue_timeout=config.get('ASGI_CPU_QUEUE_TIMEOUT', 10.0))
+        self.qdrant = None
+        if face_service.gallery is None:
+            self.qdrant = AsyncQdrantClient(
+                face_service.qdrant.collection_url,
+                connect_timeout=config.get('QDRANT_CONNECT_TIMEOUT', 2.0),
+                read_timeout=config.get('QDRANT_READ_TIMEOUT', 10.0),
+                retries=config.get('QDRANT_RETRIES', 2),
+                pool_size=config.get('QDRANT_POOL_SIZE', 10))
+        self.ftp_timeout = config.get('FTP_TIMEOUT', 10.0)
+        self.ftp_limit = asyncio.Semaphore(config.get('ASGI_FTP_CONCURRENCY', 8))
+
+    async def read_image_bytes_from_path(self, image_path):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.face_service.read_image_bytes_from_path, image_path)
+
+    async def read_image_bytes_from_ftp(self, ftp_url, username=None, password=None):
+        async with self.ftp_limit:
+            return await async_ftp.fetch(ftp_url, username, password, timeout=self.ftp_timeout)
+
+    async def embed_image_bytes(self, raw, decode_error):
+        return await self.cpu.run(self.face_service.embed_image_bytes, raw, decode_error)
+
+    async def embed_image_bytes_many(self, raws, batch_size=None):
+        return await self.cpu.run(self.face_service.embed_image_bytes_many, raws, batch_size)
+
+    async def embed_faces(self, raw, boxes, decode_error):
+        return await self.cpu.run(self.face_service.embed_faces, raw, boxes, decode_error)
+
+    async def search_similar_faces_many(self, embeddings, top=5):
+        admission.check_deadline('search')
+        if self.qdrant is None or not embeddings:
+            return await self.cpu.run(self.face_service.search_similar_faces_many, embeddings, top)
+        return await self.qdrant.search_many(embeddings, top)
+
+    async def search_similar_faces(self, embedding, top=5):
+        admission.check_deadline('search')
+        if self.qdrant is None:
+            return await self.cpu.run(self.face_service.search_similar_faces, embedding, top)
+        return await self.qdrant.search(embedding, top)
+
+    def stats(self):
+        stats = self.face_service.stats()
+        stats["asgi"] = {"cpu": self.cpu.stats()}
+        if self.qdrant is not None:
+            stats["qdrant"] = self.qdrant.stats()
+        return stats
+
+    async def close(self):
+        if self.qdrant is not None:
+            await self.qdrant.close()
+        self.cpu.pool.shutdown(wait=False)
+
+
+_service = None
+_service_lock = None
+
+
+async def get_async_service():
+    """Lazily create the service; the model loads off the event loop"""
+    global _service, _service_lock
+    if _service is None:
+        if _service_lock is None:
+            _service_lock = asyncio.Lock()
+        async with _service_lock:
+            if _service is None:
+                loop = asyncio.get_running_loop()
+                face_service = await loop.run_in_executor(None, wsgi_app.get_face_service)
+                _service = AsyncFaceService(face_service, config)
+    return _service
+
+
+async def read_body(receive, max_length):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionError("Client disconnected")
+        body = message.get('body', b'')
+        size += len(body)
+        if max_length and size > max_length:
+            raise HTTPError("Request too large", 413)
+        chunks.append(body)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def make_request(scope, body):
+    """werkzeug Request over a buffered body: form, files, JSON and Accept parsing as in app.py"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_NAME': (scope.get('server') or ('localhost', 80))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 80))[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return Request(environ)
+
+
+def error_response(e):
+    if isinstance(e, HTTPError):
+        return e.status, 'application/json', serializers.dumps_json({"error": str(e)})
+    status = wsgi_app.error_status(e)
+    message = str(e) if status != 500 else f"Internal server error: {str(e)}"
+    return status, 'application/json', serializers.dumps_json({"error": message})
+
+
+async def read_image_source(service, request):
+    """(raw, decode_error, source_type, source_info) of a single-image request, as in app.py"""
+    if 'image' in request.files:
+        file = request.files['image']
+        if file.filename == '':
+            raise HTTPError("No file selected")
+        if not wsgi_app.allowed_file(file.filename):
+            raise HTTPError("Invalid file type. Allowed: png, jpg, jpeg, gif, bmp, tiff")
+        return (file.read(), "Error processing uploaded image: Unable to decode uploaded image",
+                "file_upload", {"filename": secure_filename(file.filename)})
+    if request.is_json:
+        data = request.get_json()
+        if 'image_path' in data:
+            raw = await service.read_image_bytes_from_path(data['image_path'])
+            return raw, f"Unable to load image from: {data['image_path']}", "file_path", {"path": data['image_path']}
+        if 'ftp_url' in data:
+            raw = await service.read_image_bytes_from_ftp(data['ftp_url'], data.get('username'), data.get('password'))
+            return (raw, "Error loading image from FTP: Unable to decode image from FTP",
+                    "ftp_url", {"url": data['ftp_url']})
+        raise HTTPError("Missing 'image_path' or 'ftp_url' in JSON data")
+    raise HTTPError("No image data provided. Use file upload or JSON with image_path/ftp_url")
+
+
+def encode(payload, fmt):
+    with metrics.stage('serialize'):
+        return serializers.encode(payload, fmt)
+
+
+async def health(service, request):
+    return 200, 'application/json', serializers.dumps_json({"status": "healthy", "message": "Face embedding API is running"})
+
+
+async def stats(service, request):
+    return 200, 'application/json', serializers.dumps_json(service.stats())
+
+
+async def debug_profile(service, request):
+    if not config.get('DEBUG_PROFILE_TOKEN'):
+        raise HTTPError("Not found", 404)
+    if not wsgi_app.debug_authorized(request.headers.get('Authorization')):
+        raise HTTPError("Unauthorized", 401)
+    try:
+        # Off the CPU pool: the profile only waits, the event loop and the pool keep serving
+        body, mimetype = await asyncio.get_running_loop().run_in_executor(None, wsgi_app.run_profile, request.args)
+    except RuntimeError as e:
+        raise HTTPError(str(e), 409)
+    if isinstance(body, bytes):
+        return 200, mimetype, body
+    return 200, f'{mimetype}; charset=utf-8', body.encode('utf-8')
+
+
+async def prometheus_metrics(service, request):
+    exposition = await asyncio.get_running_loop().run_in_executor(None, metrics.render)
+    if exposition is None:
+        raise HTTPError("Metrics are disabled (METRICS_ENABLED=false or prometheus_client not installed)", 404)
+    body, content_type = exposition
+    return 200, content_type, body
+
+
+async def embed(service, request):
+    try:
+        fmt = serializers.negotiate(request)
+    except serializers.NotAcceptable as e:
+        raise HTTPError(str(e), 406)
+    raw, decode_error, source_type, source_info = await read_image_source(service, request)
+    metrics.count_image('/embed', source_type)
+    multi_face, boxes = wsgi_app.parse_faces_params(request, request.get_json(silent=True) if request.is_json else None,
+                                                    service.face_service.max_faces)
+    if multi_face:
+        faces = await service.embed_faces(raw, boxes, decode_error)
+        return 200, fmt.mimetype, encode({
+            "success": True,
+            "source_type": source_type,
+            "source_info": source_info,
+            "faces": faces,
+            "face_count": len(faces),
+            "flip_tta": service.face_service.encoder.flip_mode
+        }, fmt)
+    logger.info(f"Computing embedding for source type: {source_type}")
+    embedding = await service.embed_image_bytes(raw, decode_error)
+    return 200, fmt.mimetype, encode({
+        "success": True,
+        "source_type": source_type,
+        "source_info": source_info,
+        "embedding": embedding,
+        "embedding_shape": embedding.shape,
+        "flip_tta": service.face_service.encoder.flip_mode
+    }, fmt)
+
+
+async def search(service, request):
+    try:
+        fmt = serializers.negotiate(request, allowed=('json', 'base64', 'msgpack'))
+    except serializers.NotAcceptable as e:
+        raise HTTPError(str(e), 406)
+    top = 5
+    try:
+        if 'image' in request.files and 'top' in request.form:
+            top = int(request.form['top'])
+        elif request.is_json and 'top' in request.get_json():
+            top = int(request.get_json()['top'])
+    except (ValueError, TypeError):
+        raise HTTPError("Invalid 'top' parameter. Must be an integer")
+    raw, decode_error, source_type, source_info = await read_image_source(service, request)
+    metrics.count_image('/search', source_type)
+    max_results = service.face_service.max_search_results
+    if top < 1 or top > max_results:
+        raise HTTPError(f"Parameter 'top' must be between 1 and {max_results}")
+    multi_face, boxes = wsgi_app.parse_faces_params(request, request.get_json(silent=True) if request.is_json else None,
+                                                    service.face_service.max_faces)
+    if multi_face:
+        # All faces in one forward pass, their searches in one batch call
+        faces = await service.embed_faces(raw, boxes, decode_error)
+        search_results = await service.search_similar_faces_many([f["embedding"] for f in faces], top)
+        return 200, fmt.mimetype, encode({
+            "success": True,
+            "source_type": source_type,
+            "source_info": source_info,
+            "top": top,
+            "flip_tta": service.face_service.encoder.flip_mode,
+            "faces": [dict({k: v for k, v in face.items() if k not in ("embedding", "embedding_shape")},
+                           search_results=results)
+                      for face, results in zip(faces, search_results)],
+            "face_count": len(faces)
+        }, fmt)
+    embedding = await service.embed_image_bytes(raw, decode_error)
+    search_results = await service.search_similar_faces(embedding, top)
+    return 200, fmt.mimetype, encode({
+        "success": True,
+        "source_type": source_type,
+        "source_info": source_info,
+        "top": top,
+        "flip_tta": service.face_service.encoder.flip_mode,
+        "search_results": search_results
+    }, fmt)
+
+
+async def iter_batch_chunks(service, uploads, archives, data, chunk_size):
+    """Chunks of (source_type, source_info, bytes or exception), FTP fetches of a chunk concurrent"""
+    loop = asyncio.get_running_loop()
+    # Uploads, archive members and local paths: blocking reads off the event loop
+    items = wsgi_app.iter_batch_items(service.face_service, uploads, archives,
+                                      {'image_paths': data.get('image_paths')})
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, lambda: list(itertools.islice(items, chunk_size)))
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        items.close()
+    username = data.get('username')
+    password = data.get('password')
+    ftp_urls = data.get('ftp_urls') or []
+    for start in range(0, len(ftp_urls), chunk_size):
+        urls = ftp_urls[start:start + chunk_size]
+        raws = await asyncio.gather(*(service.read_image_bytes_from_ftp(url, username, password) for url in urls),
+                                    return_exceptions=True)
+        yield [("ftp_url", {"url": url}, raw) for url, raw in zip(urls, raws)]
+
+
+async def embed_batch(service, request):
+    try:
+        fmt = serializers.negotiate(request)
+    except serializers.NotAcceptable as e:
+        raise HTTPError(str(e), 406)
+    data = {}
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            raise HTTPError("Invalid JSON body")
+        for field in ('image_paths', 'ftp_urls'):
+            if field in data and not isinstance(data[field], list):
+                raise HTTPError(f"'{field}' must be a list")
+    uploads = request.files.getlist('images')
+    archives = request.files.getlist('archive')
+    if not (uploads or archives or data.get('image_paths') or data.get('ftp_urls')):
+        raise HTTPError("No image data provided. Use 'images'/'archive' file uploads or JSON with image_paths/ftp_urls")
+
+    chunk_size = max(1, config.get('EMBED_BATCH_CHUNK_SIZE', 32))
+    max_items = config.get('EMBED_BATCH_MAX_ITEMS', 10000)
+    flip_mode = service.face_service.encoder.flip_mode
+    chunks = iter_batch_chunks(service, uploads, archives, data, chunk_size)
+
+    async def generate():
+        index = 0
+        failed = 0
+        next_chunk = asyncio.ensure_future(chunks.__anext__())
+        try:
+            while True:
+                try:
+                    chunk = await next_chunk
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    # The input itself is unreadable (e.g. a corrupt archive): report and stop
+                    failed += 1
+                    yield serializers.encode_records([{"index": index, "error": str(e), "status": wsgi_app.error_status(e)}], fmt)
+                    break
+                if index + len(chunk) > max_items:
+                    failed += 1
+                    yield serializers.encode_records([{"index": index, "error": f"Batch limit of {max_items} images exceeded", "status": 413}], fmt)
+                    break
+                # Read or fetch the next chunk while this one is decoded and embedded
+                next_chunk = asyncio.ensure_future(chunks.__anext__())
+                try:
+                    results = await service.embed_image_bytes_many([raw for _, _, raw in chunk], batch_size=chunk_size)
+                except Exception as e:
+                    results = [e] * len(chunk)
+                records = []
+                for (source_type, source_info, _), result in zip(chunk, results):
+                    record = {"index": index, "source_type": source_type, "source_info": source_info}
+                    metrics.count_image('/embed/batch', source_type)
+                    if isinstance(result, Exception):
+                        metrics.count_error('/embed/batch', result)
+                        failed += 1
+                        record["error"] = str(result)
+                        record["status"] = wsgi_app.error_status(result)
+                    else:
+                        record["embedding"] = result
+                        record["embedding_shape"] = result.shape
+                    records.append(record)
+                    index += 1
+                with metrics.stage('serialize'):
+                    body = serializers.encode_records(records, fmt)
+                yield body
+            logger.info(f"Batch embedding done: {index} images, {failed} errors")
+            if fmt.name != 'binary':
+                yield serializers.encode_records([{"done": True, "count": index, "failed": failed, "flip_tta": flip_mode}], fmt)
+        finally:
+            # Let an in-progress read finish before closing the sources
+            if not next_chunk.done():
+                await asyncio.gather(next_chunk, return_exceptions=True)
+            await chunks.aclose()
+
+    return 200, fmt.stream_mimetype, generate()
+
+
+ROUTES = {
+    '/health': ('GET', health),
+    '/stats': ('GET', stats),
+    '/metrics': ('GET', prometheus_metrics),
+    '/debug/profile': ('GET', debug_profile),
+    '/embed': ('POST', embed),
+    '/embed/batch': ('POST', embed_batch),
+    '/search': ('POST', search),
+}
+
+
+async def handle(scope, receive, send):
+    path = scope['path'].rstrip('/') or '/'
+    route = ROUTES.get(path)
+    endpoint = path if route is not None else 'unmatched'
+    start = time.perf_counter()
+    metrics.request_started()
+    timeline = None
+    if wsgi_app.server_timing or wsgi_app.trace_log is not None:
+        timeline = metrics.begin_timeline(start, sampled=random.random() < wsgi_app.trace_sample_rate)
+    status = 500
+    try:
+        status = await respond(scope, receive, send, route, endpoint, timeline)
+    finally:
+        admission.end_request()
+        total = time.perf_counter() - start
+        metrics.request_finished(endpoint, total)
+        if timeline is not None:
+            metrics.end_timeline()
+            slow = wsgi_app.trace_slow_seconds > 0 and total >= wsgi_app.trace_slow_seconds
+            if wsgi_app.trace_log is not None and (timeline.sampled or slow):
+                headers = dict(scope.get('headers', []))
+                request_id = headers.get(b'x-request-id')
+                wsgi_app.trace_log.write(timeline.trace(
+                    total, ts=time.time(), pid=os.getpid(), method=scope['method'], endpoint=endpoint,
+                    status=status, request_id=request_id.decode('latin-1') if request_id else None,
+                    reason="sampled" if timeline.sampled else "slow"))
+
+
+def path_admitted(path):
+    """Whether a request is subject to deadlines and queue-age shedding; cheap endpoints are not"""
+    return (path.rstrip('/') or '/') not in wsgi_app.ADMISSION_EXEMPT
+
+
+async def respond(scope, receive, send, route, endpoint, timeline=None):
+    """Run the route's handler and send its response; returns the status"""
+    try:
+        if route is None:
+            raise HTTPError("Not found", 404)
+        method, handler = route
+        if scope['method'] != method:
+            raise HTTPError("Method not allowed", 405)
+        if path_admitted(scope['path']):
+            headers = dict(scope.get('headers', []))
+            admission.start_request(
+                headers.get(b'x-request-start', b'').decode('latin-1'),
+                headers.get(b'x-request-timeout', b'').decode('latin-1'),
+                default_timeout_ms=config.get('REQUEST_TIMEOUT_MS', 0),
+                max_queue_ms=config.get('ADMISSION_MAX_QUEUE_MS', 0))
+        body = await read_body(receive, config.get('MAX_CONTENT_LENGTH'))
+        request = make_request(scope, body)
+        if request.mimetype == 'multipart/form-data':
+            # Parse uploads off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, lambda: request.files)
+        status, content_type, body = await handler(await get_async_service(), request)
+    except ConnectionError:
+        return 499
+    except Exception as e:
+        status, content_type, body = error_response(e)
+        metrics.count_error(endpoint, f"http_{status}" if isinstance(e, HTTPError) else e)
+    headers = [(b'content-type', content_type.encode('latin-1'))]
+    if status == 503:
+        headers.append((b'retry-after', str(config.get('ADMISSION_RETRY_AFTER', 1)).encode('latin-1')))
+    if wsgi_app.server_timing and timeline is not None:
+        # Stages of a streamed body are not done yet; the trace has them
+        headers.append((b'server-timing', timeline.server_timing(time.perf_counter() - timeline.start).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    if isinstance(body, bytes):
+        await send({'type': 'http.response.body', 'body': body})
+        return status
+    try:
+        async for chunk in body:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    except Exception as e:
+        # Client gone or a failure mid-stream: the response cannot be completed
+        logger.error(f"Streamed response failed: {e}")
+    finally:
+        await body.aclose()
+    return status
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                # Load the model before taking traffic
+                await get_async_service()
+                await send({'type': 'lifespan.startup.complete'})
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+        elif message['type'] == 'lifespan.shutdown':
+            if _service is not None:
+                await _service.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
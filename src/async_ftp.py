@@ -0,0 +1,120 @@
+import asyncio
+import re
+from urllib.parse import urlparse
+
+_PASV_RE = re.compile(r'(\d+),(\d+),(\d+),(\d+),(\d+),(\d+)')
+
+
+class FTPError(Exception):
+    """Unexpected FTP reply"""
+
+
+class AsyncFTP:
+    """
+    Minimal asyncio FTP client: login, binary RETR over passive mode, quit.
+    Every command and transfer is bounded by timeout (seconds).
+    """
+
+    def __init__(self, timeout=10.0):
+        self.timeout = timeout
+        self.host = None
+        self._reader = None
+        self._writer = None
+
+    async def _reply(self):
+        """(code, text) of the next reply, multi-line replies joined"""
+        line = (await asyncio.wait_for(self._reader.readline(), self.timeout)).decode('latin-1')
+        if len(line) < 4:
+            raise FTPError(f"Bad FTP reply: {line!r}")
+        code, lines = line[:3], [line.rstrip('\r\n')]
+        if line[3] == '-':
+            while True:
+                line = (await asyncio.wait_for(self._reader.readline(), self.timeout)).decode('latin-1')
+                if not line:
+                    raise FTPError("Connection closed during FTP reply")
+                lines.append(line.rstrip('\r\n'))
+                if line.startswith(code + ' '):
+                    break
+        return int(code), '\n'.join(lines)
+
+    async def _command(self, command, expect):
+        self._writer.write(command.encode('latin-1') + b'\r\n')
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+        code, text = await self._reply()
+        if code // 100 not in expect:
+            raise FTPError(text)
+        return code, text
+
+    async def connect(self, host, port=21):
+        self.host = host
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+        code, text = await self._reply()
+        if code // 100 != 2:
+            raise FTPError(text)
+
+    async def login(self, username=None, password=None):
+        username = username or 'anonymous'
+        password = password or ('anonymous@' if username == 'anonymous' else '')
+        code, _ = await self._command(f'USER {username}', expect=(2, 3))
+        if code // 100 == 3:
+            await self._command(f'PASS {password}', expect=(2,))
+        await self._command('TYPE I', expect=(2,))
+
+    async def retrieve(self, path):
+        """Contents of path, read over a passive data connection"""
+        _, text = await self._command('PASV', expect=(2,))
+        match = _PASV_RE.search(text)
+        if match is None:
+            raise FTPError(f"Bad PASV reply: {text}")
+        numbers = [int(n) for n in match.groups()]
+        # Connect to the control host, like ftplib: the advertised address may be a private one
+        data_reader, data_writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, numbers[4] * 256 + numbers[5]), self.timeout)
+        try:
+            await self._command(f'RETR {path}', expect=(1,))
+            chunks = []
+            while True:
+                chunk = await asyncio.wait_for(data_reader.read(65536), self.timeout)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            data_writer.close()
+        code, text = await self._reply()
+        if code // 100 != 2:
+            raise FTPError(text)
+        return b''.join(chunks)
+
+    async def quit(self):
+        try:
+            await self._command('QUIT', expect=(2,))
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+async def fetch(ftp_url, username=None, password=None, timeout=10.0):
+    """Bytes of the file at an ftp:// URL, same errors as FaceEmbeddingService.read_image_bytes_from_ftp"""
+    try:
+        parsed_url = urlparse(ftp_url)
+        if parsed_url.scheme != 'ftp':
+            raise ValueError("Invalid FTP URL")
+        ftp = AsyncFTP(timeout)
+        try:
+            await ftp.connect(parsed_url.hostname, parsed_url.port or 21)
+            if username and password:
+                await ftp.login(username, password)
+            else:
+                await ftp.login()  # Anonymous login
+            data = await ftp.retrieve(parsed_url.path)
+            await ftp.quit()
+            return data
+        finally:
+            ftp.close()
+    except Exception as e:
+        raise ValueError(f"Error loading image from FTP: {str(e) or type(e).__name__}")
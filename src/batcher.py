@@ -0,0 +1,116 @@
+import threading
+import time
+import queue
+from collections import deque
+
+
+class _Request:
+    __slots__ = ('item', 'event', 'result', 'error', 'enqueued_at')
+
+    def __init__(self, item):
+        self.item = item
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from concurrent request threads and runs them
+    through `batch_fn` together.
+
+    A batch is flushed as soon as it holds `max_batch_size` items or the oldest
+    item has waited `max_wait_ms`. `batch_fn` receives a list of items and must
+    return a sequence of results of the same length; each caller gets back the
+    result at its own position.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5.0, name='batcher'):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._recent_sizes = deque(maxlen=1000)
+        self._size_histogram = {}
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Queue one item and block until its result is available."""
+        req = _Request(item)
+        self._queue.put(req)
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+        if not req.event.wait(timeout):
+            raise TimeoutError(f"{self.name}: no result within {timeout}s")
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.monotonic()
+            try:
+                results = self.batch_fn([req.item for req in batch])
+                for req, result in zip(batch, results):
+                    req.result = result
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+            finally:
+                elapsed = time.monotonic() - start
+                self._record(len(batch), elapsed)
+                for req in batch:
+                    req.event.set()
+
+    def _record(self, size, elapsed):
+        with self._lock:
+            self._batches += 1
+            self._items += size
+            self._busy_seconds += elapsed
+            self._recent_sizes.append(size)
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        """Queue-depth and batch-size statistics since startup."""
+        with self._lock:
+            recent = list(self._recent_sizes)
+            uptime = time.monotonic() - self._started_at
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "recent_avg_batch_size": (sum(recent) / len(recent)) if recent else 0.0,
+                "batch_size_histogram": dict(sorted(self._size_histogram.items())),
+                "busy_ratio": (self._busy_seconds / uptime) if uptime > 0 else 0.0,
+            }
@@ -6,7 +6,7 @@ import multiprocessing
 class Config:
     # Flask Configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-change-in-production'
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB
     
     # Model Configuration
     MODEL_SYMBOL_PATH = os.environ.get('MODEL_SYMBOL_PATH', '/app/models/face_encoder_symbol.json')
@@ -14,15 +14,123 @@ class Config:
 
     # Qdrant Configuration
     QDRANT_URL = os.environ.get('QDRANT_URL', 'http://qdrant:6333/collections/f4r/points/search')
+    QDRANT_CONNECT_TIMEOUT = float(os.environ.get('QDRANT_CONNECT_TIMEOUT', '2'))  # seconds
+    QDRANT_READ_TIMEOUT = float(os.environ.get('QDRANT_READ_TIMEOUT', '10'))
+    QDRANT_RETRIES = int(os.environ.get('QDRANT_RETRIES', '2'))  # connection errors and 429/502/503/504
+    QDRANT_POOL_SIZE = int(os.environ.get('QDRANT_POOL_SIZE', '10'))  # keep-alive connections per worker
+    # Combine concurrent searches of a worker into /points/search/batch calls (needs GUNICORN_THREADS > 1)
+    QDRANT_BATCH_ENABLED = os.environ.get('QDRANT_BATCH_ENABLED', 'false').lower() == 'true'
+    QDRANT_BATCH_MAX_SIZE = int(os.environ.get('QDRANT_BATCH_MAX_SIZE', '16'))
+    QDRANT_BATCH_MAX_WAIT_MS = float(os.environ.get('QDRANT_BATCH_MAX_WAIT_MS', '2'))
+    # Search backend: qdrant (HTTP search per query) | local (memory-mapped snapshot of the collection)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'qdrant').lower()
+    GALLERY_DIR = os.environ.get('GALLERY_DIR', '/tmp/face-gallery')  # shared by the workers on a host
+    GALLERY_REFRESH_INTERVAL = float(os.environ.get('GALLERY_REFRESH_INTERVAL', '60'))  # seconds, incremental
+    GALLERY_FULL_REFRESH_INTERVAL = float(os.environ.get('GALLERY_FULL_REFRESH_INTERVAL', '3600'))
+    # Local search index: exact | ivf (approximate, used from GALLERY_INDEX_MIN_POINTS points on)
+    GALLERY_INDEX = os.environ.get('GALLERY_INDEX', 'exact').lower()
+    GALLERY_IVF_NLIST = int(os.environ.get('GALLERY_IVF_NLIST', '0'))  # 0 = about 4 * sqrt(points)
+    GALLERY_IVF_NPROBE = int(os.environ.get('GALLERY_IVF_NPROBE', '16'))  # lists scanned per query: recall vs speed
+    GALLERY_IVF_DTYPE = os.environ.get('GALLERY_IVF_DTYPE', 'float32').lower()  # float32 | float16
+    GALLERY_INDEX_MIN_POINTS = int(os.environ.get('GALLERY_INDEX_MIN_POINTS', '50000'))
     
+    # Inference backend: mxnet | onnxruntime
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'mxnet').lower()
+
+    # ONNX Runtime Configuration (INFERENCE_BACKEND=onnxruntime)
+    ONNX_MODEL_PATH = os.environ.get('ONNX_MODEL_PATH', '/app/models/face_encoder.onnx')
+    ONNX_INT8_MODEL_PATH = os.environ.get('ONNX_INT8_MODEL_PATH', '/app/models/face_encoder.int8.onnx')
+    ONNX_MODEL_VARIANT = os.environ.get('ONNX_MODEL_VARIANT', 'fp32').lower()  # fp32 | int8
+    ORT_INTRA_OP_THREADS = int(os.environ.get('ORT_INTRA_OP_THREADS', '0'))  # 0 = onnxruntime default
+    ORT_INTER_OP_THREADS = int(os.environ.get('ORT_INTER_OP_THREADS', '0'))
+    ORT_GRAPH_OPT_LEVEL = os.environ.get('ORT_GRAPH_OPT_LEVEL', 'all').lower()  # disable | basic | extended | all
+    ORT_OPTIMIZED_MODEL_PATH = os.environ.get('ORT_OPTIMIZED_MODEL_PATH')  # optimized model cache file
+    # Weights shared by all workers: the optimized model's weights are written once to a
+    # file in SHARED_WEIGHTS_DIR that every worker's session maps instead of copying
+    SHARED_WEIGHTS = os.environ.get('SHARED_WEIGHTS', 'false').lower() == 'true'
+    SHARED_WEIGHTS_DIR = os.environ.get('SHARED_WEIGHTS_DIR', '/tmp/face-api-weights')
+
     # MXNet Configuration
     USE_GPU = os.environ.get('USE_GPU', 'false').lower() == 'true'
     GPU_ID = int(os.environ.get('GPU_ID', '0'))
     
     # API Configuration
     BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '1'))
+    # Batch sizes bound up front; a batch runs on the smallest bucket that fits it
+    BATCH_BUCKETS = [int(b) for b in os.environ.get('BATCH_BUCKETS', '1,2,4,8,16,32').split(',') if b.strip()]
+    # Face detection + 5-point alignment before the encoder (SCRFD ONNX model with keypoints);
+    # off: callers send cropped faces, which are resized to 112x112
+    FACE_DETECTION = os.environ.get('FACE_DETECTION', 'false').lower() == 'true'
+    FACE_DETECTOR_MODEL_PATH = os.environ.get('FACE_DETECTOR_MODEL_PATH', '/app/models/scrfd_500m_kps.onnx')
+    FACE_DETECTOR_INPUT_SIZE = int(os.environ.get('FACE_DETECTOR_INPUT_SIZE', '640'))  # for dynamic-size models
+    FACE_DETECTOR_SCORE_THRESHOLD = float(os.environ.get('FACE_DETECTOR_SCORE_THRESHOLD', '0.5'))
+    FACE_DETECTOR_NMS_THRESHOLD = float(os.environ.get('FACE_DETECTOR_NMS_THRESHOLD', '0.4'))
+    FACE_DETECTOR_MAX_FACES = int(os.environ.get('FACE_DETECTOR_MAX_FACES', '0'))  # 0 = no limit
+    FACE_DETECTOR_THREADS = int(os.environ.get('FACE_DETECTOR_THREADS', '0'))  # 0 = onnxruntime default
+    # faces=all on /embed and /search: faces per image (detected or client 'boxes'), box crop margin
+    MAX_FACES_PER_IMAGE = int(os.environ.get('MAX_FACES_PER_IMAGE', '100'))
+    FACE_CROP_MARGIN = float(os.environ.get('FACE_CROP_MARGIN', '0'))  # fraction of box size, as FaceAligner
+    # Decode large JPEGs at 1/2, 1/4 or 1/8 scale when the result still covers 112x112
+    REDUCED_DECODE = os.environ.get('REDUCED_DECODE', 'true').lower() == 'true'
+    # Decode/resize process pool (0 = decode inline in the request thread)
+    DECODE_POOL_WORKERS = int(os.environ.get('DECODE_POOL_WORKERS', '0'))
+    DECODE_POOL_QUEUE_SIZE = int(os.environ.get('DECODE_POOL_QUEUE_SIZE', '64'))
+    DECODE_POOL_QUEUE_TIMEOUT = float(os.environ.get('DECODE_POOL_QUEUE_TIMEOUT', '10'))
+    DECODE_POOL_START_METHOD = os.environ.get('DECODE_POOL_START_METHOD', 'spawn')
+    # Embedding cache: in-memory LRU entries per worker (0 = off), optional disk tier shared by workers
+    EMBEDDING_CACHE_SIZE = int(os.environ.get('EMBEDDING_CACHE_SIZE', '0'))
+    EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR')
+    EMBEDDING_CACHE_DISK_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_DISK_MAX_ENTRIES', '1000000'))
+    # Flip test-time augmentation: off | fused (one 2N forward pass) | sequential (legacy, two passes)
+    FLIP_TTA = os.environ.get('FLIP_TTA', 'fused').lower()
     MAX_SEARCH_RESULTS = int(os.environ.get('MAX_SEARCH_RESULTS', '100'))
+    # /embed/batch: images per decode/forward chunk (one NDJSON flush each) and per request
+    EMBED_BATCH_CHUNK_SIZE = int(os.environ.get('EMBED_BATCH_CHUNK_SIZE', '32'))
+    EMBED_BATCH_MAX_ITEMS = int(os.environ.get('EMBED_BATCH_MAX_ITEMS', '10000'))
+    FTP_TIMEOUT = float(os.environ.get('FTP_TIMEOUT', '10'))  # seconds per FTP command or transfer read
+    # Logged-in FTP sessions kept per worker and host/port/user (0 = new connection per image)
+    FTP_POOL_MAX_IDLE = int(os.environ.get('FTP_POOL_MAX_IDLE', '0'))
+    FTP_POOL_IDLE_TIMEOUT = float(os.environ.get('FTP_POOL_IDLE_TIMEOUT', '60'))  # close sessions idle longer
+    FTP_POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get('FTP_POOL_HEALTH_CHECK_INTERVAL', '5'))  # NOOP before reuse
+
+    # Asyncio serving mode (asgi_app.py): decode/inference threads and queued calls per process
+    ASGI_CPU_THREADS = int(os.environ.get('ASGI_CPU_THREADS', '4'))
+    ASGI_CPU_QUEUE_SIZE = int(os.environ.get('ASGI_CPU_QUEUE_SIZE', '64'))
+    ASGI_CPU_QUEUE_TIMEOUT = float(os.environ.get('ASGI_CPU_QUEUE_TIMEOUT', '10'))  # then 503
+    ASGI_FTP_CONCURRENCY = int(os.environ.get('ASGI_FTP_CONCURRENCY', '8'))  # concurrent FTP fetches per process
+
+    # Micro-batching Configuration (needs a threaded worker, e.g. GUNICORN_THREADS > 1)
+    MICRO_BATCH_ENABLED = os.environ.get('MICRO_BATCH_ENABLED', 'false').lower() == 'true'
+    MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', '8'))
+    MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', '5'))
     
+    # Admission control. Requests beyond ADMISSION_MAX_IN_FLIGHT running + ADMISSION_MAX_QUEUE
+    # waiting (up to ADMISSION_QUEUE_TIMEOUT seconds) per worker get 503 + Retry-After;
+    # 0 = no limit (use it with GUNICORN_THREADS above the limit)
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '0'))
+    ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '8'))
+    ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', '1'))
+    # Shed requests that waited longer than this in front of the worker (needs X-Request-Start from the proxy)
+    ADMISSION_MAX_QUEUE_MS = float(os.environ.get('ADMISSION_MAX_QUEUE_MS', '0'))
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '1'))  # seconds
+    # Request deadline, checked before decode, forward and search (504 once passed): a client's
+    # X-Request-Timeout (ms) capped at this; keep it below the gunicorn timeout so workers are not killed
+    REQUEST_TIMEOUT_MS = float(os.environ.get('REQUEST_TIMEOUT_MS', '0'))  # 0 = none
+
+    # Prometheus /metrics (needs prometheus_client); gunicorn workers share PROMETHEUS_MULTIPROC_DIR
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    # Per-request stage timings: Server-Timing response header, and a JSON trace of sampled
+    # requests (TRACE_SAMPLE_RATE, e.g. 0.01) and of any request slower than TRACE_SLOW_MS
+    SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0'))
+    TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '0'))  # 0 = off
+    TRACE_LOG_PATH = os.environ.get('TRACE_LOG_PATH')  # JSON lines file; unset logs through the app logger
+
+    # /debug/profile: sampling profiler and MXNet operator profiler of the handling worker.
+    # Off unless a token is set; requests authenticate with 'Authorization: Bearer <token>'
+    DEBUG_PROFILE_TOKEN = os.environ.get('DEBUG_PROFILE_TOKEN')
+    DEBUG_PROFILE_MAX_SECONDS = float(os.environ.get('DEBUG_PROFILE_MAX_SECONDS', '60'))
+
     # Logging Configuration
     LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 
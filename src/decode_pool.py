@@ -0,0 +1,198 @@
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+FACE_SHAPE = (112, 112, 3)
+
+# Worker-process side: the shared slot array, attached once per process
+_worker_shm = None
+_worker_slots = None
+
+
+def _init_worker(shm_name, num_slots):
+    global _worker_shm, _worker_slots
+    # Pool workers share the parent's resource tracker, which unlinks the segment only once
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_slots = np.ndarray((num_slots,) + FACE_SHAPE, dtype=np.uint8, buffer=_worker_shm.buf)
+
+
+def _decode_into_slot(raw, slot, reduced):
+    """Decode and resize in the worker, write the face into its shared-memory slot"""
+    import image_decode
+    start = time.perf_counter()
+    img = image_decode.decode_face(raw, FACE_SHAPE[0], reduced=reduced)
+    if img is not None:
+        _worker_slots[slot] = img
+    return img is not None, time.perf_counter() - start
+
+
+class StageTimer:
+    """Busy time of one pipeline stage, as a context manager around each unit of work"""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._calls = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    def __enter__(self):
+        self._local.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.add(time.monotonic() - self._local.start)
+        return False
+
+    def add(self, seconds):
+        with self._lock:
+            self._calls += 1
+            self._busy_seconds += seconds
+
+    def stats(self, parallelism=1):
+        with self._lock:
+            uptime = time.monotonic() - self._started_at
+            return {
+                "calls": self._calls,
+                "busy_seconds": self._busy_seconds,
+                "avg_ms": (self._busy_seconds / self._calls * 1000.0) if self._calls else 0.0,
+                "utilization": (self._busy_seconds / (uptime * parallelism)) if uptime > 0 else 0.0,
+            }
+
+
+class DecodePool:
+    """
+    Process pool that turns encoded image bytes into 112x112 RGB uint8 faces.
+
+    Decoded faces come back through a shared-memory slot array rather than
+    being pickled. The number of slots bounds how many decodes can be queued
+    or running at once; callers wait up to queue_timeout for a free slot.
+    """
+
+    def __init__(self, workers=2, queue_size=64, queue_timeout=10.0, reduced=True, start_method='spawn'):
+        self.workers = workers
+        self.queue_size = max(queue_size, workers)
+        self.queue_timeout = queue_timeout
+        self.reduced = reduced
+        slot_bytes = int(np.prod(FACE_SHAPE))
+        self._shm = shared_memory.SharedMemory(create=True, size=self.queue_size * slot_bytes)
+        self._slots = np.ndarray((self.queue_size,) + FACE_SHAPE, dtype=np.uint8, buffer=self._shm.buf)
+        self._free = queue.Queue()
+        for slot in range(self.queue_size):
+            self._free.put(slot)
+        # spawn by default: forking a process that has MXNet/CUDA state is not safe
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(start_method),
+            initializer=_init_worker,
+            initargs=(self._shm.name, self.queue_size))
+        self._lock = threading.Lock()
+        self._decoded = 0
+        self._failed = 0
+        self._rejected = 0
+        self._queue_wait_seconds = 0.0
+        self._worker_timer = StageTimer('decode')
+        atexit.register(self.close)
+
+    def _acquire_slot(self):
+        start = time.monotonic()
+        try:
+            slot = self._free.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            with self._lock:
+                self._rejected += 1
+            raise TimeoutError(f"Decode queue full: no free slot within {self.queue_timeout}s")
+        with self._lock:
+            self._queue_wait_seconds += time.monotonic() - start
+        return slot
+
+    def _collect(self, future, slot):
+        try:
+            ok, busy = future.result()
+            self._worker_timer.add(busy)
+            metrics.observe('decode', busy)
+            with self._lock:
+                if ok:
+                    self._decoded += 1
+                else:
+                    self._failed += 1
+            # Copy out so the slot can be reused right away
+            return self._slots[slot].copy() if ok else None
+        finally:
+            self._free.put(slot)
+
+    def decode(self, raw):
+        """Decode one image, None if the bytes are not a decodable image"""
+        slot = self._acquire_slot()
+        try:
+            future = self._executor.submit(_decode_into_slot, raw, slot, self.reduced)
+        except Exception:
+            self._free.put(slot)
+            raise
+        return self._collect(future, slot)
+
+    def decode_many(self, raws):
+        """
+        Decode several images concurrently across the pool, in input order.
+        Each result is a face array, None for undecodable bytes, or the exception raised.
+        """
+        results = [None] * len(raws)
+        pending = deque()
+        for i, raw in enumerate(raws):
+            # Never hold every slot: collect the oldest decode before taking another
+            while pending and self._free.empty():
+                j, future, slot = pending.popleft()
+                results[j] = self._collect_safe(future, slot)
+            try:
+                slot = self._acquire_slot()
+            except TimeoutError as e:
+                results[i] = e
+                continue
+            try:
+                pending.append((i, self._executor.submit(_decode_into_slot, raw, slot, self.reduced), slot))
+            except Exception as e:
+                self._free.put(slot)
+                results[i] = e
+        while pending:
+            j, future, slot = pending.popleft()
+            results[j] = self._collect_safe(future, slot)
+        return results
+
+    def _collect_safe(self, future, slot):
+        try:
+            return self._collect(future, slot)
+        except Exception as e:
+            return e
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "in_flight": self.queue_size - self._free.qsize(),
+                "decoded": self._decoded,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "queue_wait_seconds": self._queue_wait_seconds,
+            }
+        stats["workers_busy"] = self._worker_timer.stats(parallelism=self.workers)
+        return stats
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._executor = None
+        self._slots = None
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Embedding cache keyed by a hash of the raw image bytes plus a version
+    string that covers the model and preprocessing.
+
+    Two tiers: a size-bounded in-memory LRU per worker, and an optional disk
+    directory shared by all workers on the host (one raw float32 file per key,
+    written atomically). Disk hits are promoted to memory.
+    """
+
+    def __init__(self, max_entries=10000, disk_dir=None, disk_max_entries=1000000, version=''):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self.version = version
+        self._prefix = hashlib.blake2b(version.encode('utf-8'), digest_size=16).digest()
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "disk_errors": 0,
+        }
+        self._disk_writes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def key(self, raw):
+        """Cache key for encoded image bytes under the current model/preprocessing version"""
+        h = hashlib.blake2b(self._prefix, digest_size=20)
+        h.update(raw)
+        return h.hexdigest()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.f32')
+
+    def get(self, key):
+        """Cached embedding (read-only float32 array) or None"""
+        if self.max_entries > 0:
+            with self._lock:
+                embedding = self._memory.get(key)
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return embedding
+        if self.disk_dir:
+            try:
+                embedding = np.fromfile(self._disk_path(key), dtype='<f4')
+            except FileNotFoundError:
+                embedding = None
+            except OSError:
+                embedding = None
+                self._count("disk_errors")
+            if embedding is not None and embedding.size:
+                embedding.setflags(write=False)
+                self._count("disk_hits")
+                self._put_memory(key, embedding)
+                return embedding
+        self._count("misses")
+        return None
+
+    def put(self, key, embedding):
+        embedding = np.ascontiguousarray(embedding, dtype='<f4')
+        embedding.setflags(write=False)
+        self._put_memory(key, embedding)
+        if self.disk_dir:
+            self._put_disk(key, embedding)
+
+    def _put_memory(self, key, embedding):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters["memory_evictions"] += 1
+
+    def _put_disk(self, key, embedding):
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            embedding.tofile(tmp)
+            # Atomic for readers in other workers
+            os.replace(tmp, path)
+        except OSError:
+            self._count("disk_errors")
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % 1000 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop the least recently written files once the disk tier exceeds disk_max_entries"""
+        entries = []
+        try:
+            for shard in os.scandir(self.disk_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.f32'):
+                        entries.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            self._count("disk_errors")
+            return
+        excess = len(entries) - self.disk_max_entries
+        if excess <= 0:
+            return
+        entries.sort()
+        removed = 0
+        for _, path in entries[:excess]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        self._count("disk_evictions", removed)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = ((stats["memory_hits"] + stats["disk_hits"]) / lookups) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["disk_dir"] = self.disk_dir
+        stats["version"] = self.version
+        return stats
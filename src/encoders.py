@@ -0,0 +1,439 @@
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+
+import metrics
+import shared_weights
+
+# Flip test-time augmentation modes:
+#   off        - original images only
+#   fused      - originals and flipped copies in one 2N batch, halves summed on device
+#   sequential - legacy: a second forward pass over the flipped batch
+FLIP_TTA_MODES = ('off', 'fused', 'sequential')
+
+def resolve_flip_mode(flip, default):
+    """None uses the configured mode, a bool keeps the legacy flip=True/False meaning"""
+    if flip is None:
+        return default
+    if flip is True:
+        return 'sequential'
+    if flip is False:
+        return 'off'
+    if flip not in FLIP_TTA_MODES:
+        raise ValueError(f"Invalid flip mode '{flip}'. Use one of {FLIP_TTA_MODES}")
+    return flip
+
+def bind_bucketed_modules(sym, context, params_file, buckets):
+    """
+    Bind one executor per batch-size bucket. The largest bucket owns the
+    parameters and the memory pool; smaller buckets are bound against it with
+    shared_module so no bucket rebinds or re-plans memory at request time.
+    """
+    # Lazy import mxnet
+    global mx
+    import mxnet as mx
+    buckets = sorted(set(int(b) for b in buckets))
+    largest = buckets[-1]
+    base = mx.mod.Module(symbol=sym, context=context, label_names=None)
+    base.bind(for_training=False, data_shapes=[('data', (largest, 3, 112, 112))],
+              label_shapes=None, force_rebind=True)
+    base.load_params(params_file)
+    modules = {largest: base}
+    for bucket in buckets[:-1]:
+        mod = mx.mod.Module(symbol=sym, context=context, label_names=None)
+        mod.bind(for_training=False, data_shapes=[('data', (bucket, 3, 112, 112))],
+                 label_shapes=None, shared_module=base)
+        modules[bucket] = mod
+    return modules
+
+class BatchBuffers:
+    """
+    Reusable float32 NCHW input buffers, one per batch size. Decoded uint8 HWC
+    faces are cast and transposed straight into a buffer row, so preprocessing
+    allocates nothing per request.
+    """
+    def __init__(self, image_size=112):
+        self.image_size = image_size
+        self._buffers = {}
+    def get(self, n):
+        buf = self._buffers.get(n)
+        if buf is None:
+            # zeros, not empty: padded rows are fed to the model too
+            buf = np.zeros((n, 3, self.image_size, self.image_size), dtype=np.float32)
+            self._buffers[n] = buf
+        return buf
+
+def fill_batch(buffer, images, offset=0):
+    """Write uint8 HWC images into buffer rows offset.. as float32 CHW (cast during the copy)"""
+    for i, img in enumerate(images):
+        np.copyto(buffer[offset + i], img.transpose(2, 0, 1))
+    return buffer
+
+class MyEncoder:
+    def __init__(self, mod, batch_size=2, context=None, flip_mode='sequential'):
+        # Lazy import mxnet
+        global mx, nd
+        import mxnet as mx
+        from mxnet import nd
+        # mod is a mx.mod.Module, or a dict {batch size: mx.mod.Module} of bucketed
+        # modules sharing one parameter set (see bind_bucketed_modules)
+        if isinstance(mod, dict):
+            self.modules = dict(mod)
+        else:
+            self.modules = {mod.data_shapes[0].shape[0]: mod}
+        self.buckets = sorted(self.modules)
+        self.mod = self.modules[self.buckets[-1]]
+        self.batch_size = batch_size
+        self.ctx = context or mx.gpu(0)
+        if flip_mode not in FLIP_TTA_MODES:
+            raise ValueError(f"Invalid flip mode '{flip_mode}'. Use one of {FLIP_TTA_MODES}")
+        # A fused pass needs a bucket of at least 2 images
+        if flip_mode == 'fused' and self.buckets[-1] < 2:
+            flip_mode = 'sequential'
+        self.flip_mode = flip_mode
+        # Per-bucket host buffers and their device-side counterparts; the lock
+        # keeps concurrent callers (threaded workers, batch endpoints) off them
+        self._host_buffers = BatchBuffers()
+        self._device_buffers = {}
+        self._lock = threading.Lock()
+        # Set while profile_operators runs: forward passes are recorded by the MXNet profiler
+        self._profiling_operators = False
+        self._profile_lock = threading.Lock()
+    def _select_bucket(self, n):
+        """Smallest bound batch size that fits n images"""
+        for bucket in self.buckets:
+            if bucket >= n:
+                return bucket
+        return self.buckets[-1]
+    def _device_buffer(self, bucket):
+        data = self._device_buffers.get(bucket)
+        if data is None:
+            data = nd.zeros((bucket, 3, 112, 112), ctx=self.ctx, dtype='float32')
+            self._device_buffers[bucket] = data
+        return data
+    def _forward(self, bucket, data):
+        """Forward a full bucket-sized batch, output stays on device"""
+        mod = self.modules[bucket]
+        # Create data batch
+        db = mx.io.DataBatch(data=[data])
+        if self._profiling_operators:
+            # Synchronous, so the engine's operators run inside the profiled window
+            mx.profiler.set_state('run')
+            try:
+                mod.forward(db, is_train=False)
+                mod.get_outputs()[0].wait_to_read()
+            finally:
+                mx.profiler.set_state('stop')
+            return mod.get_outputs()[0]
+        # Forward pass
+        mod.forward(db, is_train=False)
+        # Get output (typically fc1_output or similar)
+        return mod.get_outputs()[0]
+    def profile_operators(self, seconds):
+        """
+        Per-operator timings of the forward passes run in the next seconds, as the
+        MXNet profiler's aggregate table (count, total/min/max/avg time per operator)
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            raise RuntimeError("An operator profile is already running")
+        try:
+            mx.profiler.set_config(profile_symbolic=True, profile_imperative=False, profile_memory=False,
+                                   profile_api=False, aggregate_stats=True,
+                                   filename=os.path.join(tempfile.gettempdir(), f"mxnet-profile-{os.getpid()}.json"))
+            mx.profiler.dumps(reset=True)
+            self._profiling_operators = True
+            try:
+                time.sleep(seconds)
+            finally:
+                self._profiling_operators = False
+            # The lock waits out a forward pass still in the profiled window
+            with self._lock:
+                return mx.profiler.dumps(reset=True)
+        finally:
+            self._profile_lock.release()
+    def compute_embedding_images(self, list_aligned_face_images, flip=None, batch_size=None):
+        # Lazy import nd
+        global nd
+        from mxnet import nd
+        mode = resolve_flip_mode(flip, self.flip_mode)
+        if mode == 'fused' and self.buckets[-1] < 2:
+            mode = 'sequential'
+        embeddings = []
+        step = min(batch_size or self.batch_size, self.buckets[-1])
+        if mode == 'fused':
+            step = max(1, min(step, self.buckets[-1] // 2))
+        with self._lock:
+            # Process in batches
+            for i in range(0, len(list_aligned_face_images), step):
+                batch_img = list_aligned_face_images[i:i + step]
+                n = len(batch_img)
+                rows = 2 * n if mode == 'fused' else n
+                bucket = self._select_bucket(rows)
+                # Preprocess into the bucket's host buffer, then one host-to-device copy.
+                # Rows past n are padding; their outputs are dropped.
+                with metrics.stage('preprocess'):
+                    host = fill_batch(self._host_buffers.get(bucket), batch_img)
+                    data = self._device_buffer(bucket)
+                    data[:] = host
+                if mode == 'fused':
+                    # Flipped copies written on device next to the originals,
+                    # one forward pass and one device-to-host copy
+                    with metrics.stage('flip'):
+                        data[n:2 * n] = nd.flip(data[0:n], axis=3)
+                    with metrics.stage('forward'):
+                        out = self._forward(bucket, data)
+                        embedding = (out[0:n] + out[n:2 * n]).asnumpy()
+                else:
+                    with metrics.stage('forward'):
+                        embedding = self._forward(bucket, data)[0:n].asnumpy()
+                    if mode == 'sequential':
+                        with metrics.stage('flip'):
+                            # Apply flip augmentation
+                            flipped_data = nd.flip(data, axis=3)
+                            embedding_flip = self._forward(bucket, flipped_data)[0:n].asnumpy()
+                        # Average original and flipped embeddings
+                        embedding = (embedding + embedding_flip) #/ 2.0
+                metrics.model_batch(n, rows, bucket)
+                embeddings.append(embedding)
+        # Concatenate all embeddings
+        embeddings = np.concatenate(embeddings, axis=0)
+        return embeddings
+
+def load_mxnet_encoder(config, batch_size, flip_mode):
+    """MXNet 1.x Module backend"""
+    # Lazy import mxnet
+    global mx, nd
+    import mxnet as mx
+    from mxnet import nd
+
+    # Initialize model
+    symbol_file = config.get('MODEL_SYMBOL_PATH')
+    params_file = config.get('MODEL_PARAMS_PATH')
+
+    # Determine context (GPU or CPU)
+    use_gpu = config.get('USE_GPU', True)
+    gpu_id = config.get('GPU_ID', 0)
+    print("Using GPU:", use_gpu, "GPU ID:", gpu_id)
+    context = mx.gpu(gpu_id) if use_gpu else mx.cpu()
+
+    # load model, one pre-bound executor per batch-size bucket
+    sym = mx.sym.load(symbol_file)
+    buckets = set(config.get('BATCH_BUCKETS', [1, 2, 4, 8, 16, 32])) | {batch_size}
+    if flip_mode == 'fused':
+        buckets.add(2 * batch_size)
+    modules = bind_bucketed_modules(sym, context, params_file, buckets)
+
+    # logging with process id
+    print(f"Process {os.getpid()}: Model loaded successfully. Buckets: {sorted(modules)}")
+
+    return MyEncoder(modules, batch_size=batch_size, context=context, flip_mode=flip_mode)
+
+class OnnxEncoder:
+    """
+    ONNX Runtime backend with the same compute_embedding_images contract as
+    MyEncoder: uint8 HWC RGB 112x112 faces in, (N, 512) float32 embeddings out.
+    The exported graph takes the same raw 0-255 input as the MXNet symbol.
+    """
+    def __init__(self, session, batch_size=1, flip_mode='fused'):
+        self.session = session
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        # export_model.py exports with a fixed batch dimension (dynamic=False);
+        # a symbolic dimension means any batch size can be fed in one run
+        batch_dim = model_input.shape[0]
+        self.fixed_batch = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
+        self.batch_size = batch_size
+        if flip_mode not in FLIP_TTA_MODES:
+            raise ValueError(f"Invalid flip mode '{flip_mode}'. Use one of {FLIP_TTA_MODES}")
+        self.flip_mode = flip_mode
+        self._buffers = BatchBuffers()
+        self._lock = threading.Lock()
+    def _run(self, batch):
+        if self.fixed_batch is None:
+            return self.session.run(None, {self.input_name: batch})[0]
+        # Fixed batch dimension: run fixed-size chunks, padding the last one
+        n = batch.shape[0]
+        outputs = []
+        for i in range(0, n, self.fixed_batch):
+            chunk = batch[i:i + self.fixed_batch]
+            rows = chunk.shape[0]
+            if rows < self.fixed_batch:
+                pad = np.zeros((self.fixed_batch - rows,) + chunk.shape[1:], dtype=chunk.dtype)
+                chunk = np.concatenate([chunk, pad], axis=0)
+            outputs.append(self.session.run(None, {self.input_name: chunk})[0][:rows])
+        return np.concatenate(outputs, axis=0)
+    def compute_embedding_images(self, list_aligned_face_images, flip=None, batch_size=None):
+        mode = resolve_flip_mode(flip, self.flip_mode)
+        embeddings = []
+        step = max(1, batch_size or self.batch_size)
+        with self._lock:
+            for i in range(0, len(list_aligned_face_images), step):
+                batch_img = list_aligned_face_images[i:i + step]
+                n = len(batch_img)
+                # Preprocess straight into a reusable buffer that is fed to the session as is
+                rows = 2 * n if mode == 'fused' else n
+                with metrics.stage('preprocess'):
+                    data = fill_batch(self._buffers.get(rows), batch_img)
+                if mode == 'fused':
+                    # Originals and flipped copies in one 2N run
+                    with metrics.stage('flip'):
+                        np.copyto(data[n:2 * n], data[0:n, :, :, ::-1])
+                    with metrics.stage('forward'):
+                        out = self._run(data).reshape(2 * n, -1)
+                    embedding = out[0:n] + out[n:2 * n]
+                else:
+                    with metrics.stage('forward'):
+                        embedding = self._run(data).reshape(n, -1)
+                    if mode == 'sequential':
+                        with metrics.stage('flip'):
+                            flipped = np.ascontiguousarray(data[:, :, :, ::-1])
+                            embedding = embedding + self._run(flipped).reshape(n, -1)
+                # A fixed batch dimension pads the last chunk
+                capacity = -(-rows // self.fixed_batch) * self.fixed_batch if self.fixed_batch else rows
+                metrics.model_batch(n, rows, capacity)
+                embeddings.append(embedding)
+        return np.concatenate(embeddings, axis=0)
+
+ORT_GRAPH_OPT_LEVELS = ('disable', 'basic', 'extended', 'all')
+ONNX_MODEL_VARIANTS = ('fp32', 'int8')
+
+def onnx_source_model(config):
+    """(variant, path): the fp32 model, or the INT8 variant built by onnx/quantize_model.py"""
+    variant = config.get('ONNX_MODEL_VARIANT', 'fp32')
+    if variant not in ONNX_MODEL_VARIANTS:
+        raise ValueError(f"Invalid ONNX_MODEL_VARIANT '{variant}'. Use one of {ONNX_MODEL_VARIANTS}")
+    return variant, config.get('ONNX_INT8_MODEL_PATH') if variant == 'int8' else config.get('ONNX_MODEL_PATH')
+
+def ort_optimization_level(ort, level_name):
+    if level_name not in ORT_GRAPH_OPT_LEVELS:
+        raise ValueError(f"Invalid ORT_GRAPH_OPT_LEVEL '{level_name}'. Use one of {ORT_GRAPH_OPT_LEVELS}")
+    return {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }[level_name]
+
+def onnx_providers(ort, use_gpu=False, gpu_id=0):
+    providers = ['CPUExecutionProvider']
+    if use_gpu and 'CUDAExecutionProvider' in ort.get_available_providers():
+        providers = [('CUDAExecutionProvider', {'device_id': gpu_id})] + providers
+    return providers
+
+def create_onnx_session(config):
+    """onnxruntime InferenceSession configured from ORT_* settings"""
+    import onnxruntime as ort
+
+    variant, model_path = onnx_source_model(config)
+    opts = ort.SessionOptions()
+    intra_threads = config.get('ORT_INTRA_OP_THREADS', 0)
+    inter_threads = config.get('ORT_INTER_OP_THREADS', 0)
+    if intra_threads:
+        opts.intra_op_num_threads = intra_threads
+    if inter_threads:
+        opts.inter_op_num_threads = inter_threads
+        if inter_threads > 1:
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+    level = ort_optimization_level(ort, config.get('ORT_GRAPH_OPT_LEVEL', 'all'))
+
+    # Shared weights: the model is optimized once and its weights file is mapped by
+    # every worker's session. Optimizing again, or prepacking, would make private copies.
+    if config.get('SHARED_WEIGHTS', False):
+        model_path = shared_weights.prepare_onnx(config, model_path)
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        opts.add_session_config_entry('session.disable_prepacking', '1')
+        session = ort.InferenceSession(model_path, sess_options=opts,
+                                       providers=onnx_providers(ort, config.get('USE_GPU', False), config.get('GPU_ID', 0)))
+        print(f"Process {os.getpid()}: ONNX {variant} model loaded from {model_path} with shared weights, "
+              f"{session.get_providers()}")
+        return session
+
+    # Optimized model cache: reuse it while it is newer than the source model,
+    # otherwise optimize the source model and write the cache for the next start.
+    # The cache is hardware specific with level 'all', keep it per host.
+    cache_path = config.get('ORT_OPTIMIZED_MODEL_PATH')
+    if cache_path and variant != 'fp32':
+        root, ext = os.path.splitext(cache_path)
+        cache_path = f"{root}.{variant}{ext}"
+    write_cache = None
+    if cache_path and os.path.exists(cache_path) \
+            and os.path.getmtime(cache_path) >= os.path.getmtime(model_path):
+        model_path = cache_path
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    else:
+        opts.graph_optimization_level = level
+        if cache_path:
+            # Several workers may start at once: write privately, then rename
+            write_cache = f"{cache_path}.{os.getpid()}.tmp"
+            opts.optimized_model_filepath = write_cache
+
+    providers = onnx_providers(ort, config.get('USE_GPU', False), config.get('GPU_ID', 0))
+    session = ort.InferenceSession(model_path, sess_options=opts, providers=providers)
+    if write_cache and os.path.exists(write_cache):
+        os.replace(write_cache, cache_path)
+    print(f"Process {os.getpid()}: ONNX {variant} model loaded from {model_path} with {session.get_providers()}")
+    return session
+
+def load_onnx_encoder(config, batch_size, flip_mode):
+    """ONNX Runtime backend"""
+    session = create_onnx_session(config)
+    return OnnxEncoder(session, batch_size=batch_size, flip_mode=flip_mode)
+
+INFERENCE_BACKENDS = {
+    'mxnet': load_mxnet_encoder,
+    'onnxruntime': load_onnx_encoder,
+}
+
+def prepare_shared_weights(config):
+    """
+    Build the shared weights file before any worker starts (gunicorn on_starting).
+    Only the onnxruntime backend can map its weights from a file: MXNet modules
+    copy parameters into arrays owned by each executor.
+    """
+    if not config.get('SHARED_WEIGHTS', False):
+        return None
+    if config.get('INFERENCE_BACKEND', 'mxnet') != 'onnxruntime':
+        print("SHARED_WEIGHTS needs INFERENCE_BACKEND=onnxruntime (export the model with onnx/export_model.py); ignored")
+        return None
+    _, source_path = onnx_source_model(config)
+    return shared_weights.prepare_onnx(config, source_path, spawn=True)
+
+def create_encoder(config, batch_size):
+    """Build the encoder for the configured INFERENCE_BACKEND"""
+    backend = config.get('INFERENCE_BACKEND', 'mxnet')
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Invalid INFERENCE_BACKEND '{backend}'. Use one of {tuple(INFERENCE_BACKENDS)}")
+    flip_mode = config.get('FLIP_TTA', 'fused')
+    encoder = INFERENCE_BACKENDS[backend](config, batch_size, flip_mode)
+    encoder.backend = backend
+    return encoder
+
+# Bump when decoding/preprocessing changes in a way that changes embeddings
+PREPROCESS_VERSION = 1
+
+def model_fingerprint(config):
+    """Identity of the configured model and preprocessing, for keying cached embeddings"""
+    backend = config.get('INFERENCE_BACKEND', 'mxnet')
+    if backend == 'onnxruntime':
+        variant = config.get('ONNX_MODEL_VARIANT', 'fp32')
+        files = [config.get('ONNX_INT8_MODEL_PATH') if variant == 'int8' else config.get('ONNX_MODEL_PATH')]
+    else:
+        files = [config.get('MODEL_SYMBOL_PATH'), config.get('MODEL_PARAMS_PATH')]
+    parts = [f"pre{PREPROCESS_VERSION}", backend,
+             f"flip={config.get('FLIP_TTA', 'fused')}",
+             f"reduced={config.get('REDUCED_DECODE', True)}"]
+    if config.get('FACE_DETECTION', False):
+        # Detected and aligned crops embed differently from whole resized images
+        parts.append(f"detect={config.get('FACE_DETECTOR_INPUT_SIZE', 640)}:"
+                     f"{config.get('FACE_DETECTOR_SCORE_THRESHOLD', 0.5)}")
+        files.append(config.get('FACE_DETECTOR_MODEL_PATH'))
+    for path in files:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}")
+        except (OSError, TypeError):
+            parts.append(f"{path}:missing")
+    return "|".join(parts)
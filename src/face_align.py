@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+
+# 5-point ArcFace template for 112x112 crops: left eye, right eye, nose tip, left and right mouth corners
+# (the reference landmarks of test/aligner.py FaceAligner)
+REFERENCE_LANDMARKS = np.array([
+    [30.2946 + 8.0, 51.6963],
+    [65.5318 + 8.0, 51.5014],
+    [48.0252 + 8.0, 71.7366],
+    [33.5493 + 8.0, 92.3655],
+    [62.7299 + 8.0, 92.2041],
+], dtype=np.float32)
+
+
+def reference_landmarks(image_size=112):
+    return REFERENCE_LANDMARKS * (image_size / 112.0)
+
+
+def estimate_similarity(src, dst):
+    """
+    2x3 similarity transforms (rotation, uniform scale, translation) mapping each
+    landmark set of src (N, K, 2) onto dst (K, 2) in the least-squares sense,
+    all N solved at once in closed form. Same result as skimage
+    SimilarityTransform.estimate for the non-reflected faces it is used on.
+    """
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    src_mean = src.mean(axis=1, keepdims=True)
+    dst_mean = dst.mean(axis=0)
+    x = src - src_mean
+    y = dst - dst_mean
+    # As complex numbers the transform is z -> (a + ib) z + t, with a + ib = sum(conj(x) y) / sum(|x|^2)
+    norm = np.maximum((x ** 2).sum(axis=(1, 2)), 1e-12)
+    a = (x[..., 0] * y[..., 0] + x[..., 1] * y[..., 1]).sum(axis=1) / norm
+    b = (x[..., 0] * y[..., 1] - x[..., 1] * y[..., 0]).sum(axis=1) / norm
+    matrices = np.empty((len(src), 2, 3), dtype=np.float64)
+    matrices[:, 0, 0] = a
+    matrices[:, 0, 1] = -b
+    matrices[:, 1, 0] = b
+    matrices[:, 1, 1] = a
+    matrices[:, :, 2] = dst_mean - np.einsum('nij,nj->ni', matrices[:, :, :2], src_mean[:, 0])
+    return matrices
+
+
+def align_faces(img, landmarks, image_size=112):
+    """(N, image_size, image_size, C) crops of img warped so each landmark set lands on the template"""
+    landmarks = np.asarray(landmarks, dtype=np.float32).reshape(-1, 5, 2)
+    matrices = estimate_similarity(landmarks, reference_landmarks(image_size))
+    crops = np.empty((len(landmarks), image_size, image_size) + img.shape[2:], dtype=img.dtype)
+    for i, matrix in enumerate(matrices):
+        crops[i] = cv2.warpAffine(img, matrix, (image_size, image_size), borderValue=0.0)
+    return crops
+
+
+def crop_faces(img, boxes, image_size=112, margin=0.0):
+    """(N, image_size, image_size, C) box crops, with the semantics of FaceAligner.crop_image"""
+    height, width = img.shape[:2]
+    crops = np.zeros((len(boxes), image_size, image_size) + img.shape[2:], dtype=img.dtype)
+    for i, box in enumerate(np.asarray(boxes, dtype=np.int32).reshape(-1, 4)):
+        x1, y1, x2, y2 = (int(v) for v in box)
+        if margin > 0:
+            w, h = x2 - x1, y2 - y1
+            x1 = max(0, x1 - int(w * margin))
+            y1 = max(0, y1 - int(h * margin))
+            x2 = min(width, x2 + int(w * margin))
+            y2 = min(height, y2 + int(h * margin))
+        x1, x2 = (max(0, min(v, width)) for v in (x1, x2))
+        y1, y2 = (max(0, min(v, height)) for v in (y1, y2))
+        # An empty crop stays zeros
+        if y2 > y1 and x2 > x1:
+            crops[i] = cv2.resize(img[y1:y2, x1:x2], (image_size, image_size))
+    return crops
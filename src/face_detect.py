@@ -0,0 +1,136 @@
+import os
+
+import cv2
+import numpy as np
+
+
+def nms(boxes, scores, threshold):
+    """Indices of the boxes kept by greedy non-maximum suppression, best score first"""
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+        inter = np.maximum(0.0, xx2 - xx1 + 1) * np.maximum(0.0, yy2 - yy1 + 1)
+        overlap = inter / (areas[i] + areas[order[1:]] - inter)
+        order = order[1:][overlap <= threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+class FaceDetector:
+    """
+    SCRFD face detector (insightface ONNX export with 5-point keypoints, e.g.
+    det_500m / det_2.5g) on onnxruntime. detect() takes a BGR image and returns
+    boxes (N, 4) as x1, y1, x2, y2, scores (N,) and landmarks (N, 5, 2) in
+    image coordinates, best score first.
+    """
+
+    def __init__(self, session, input_size=640, score_threshold=0.5, nms_threshold=0.4, max_faces=0):
+        self.session = session
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        self.max_faces = max_faces
+        model_input = session.get_inputs()[0]
+        self.input_name = model_input.name
+        height, width = model_input.shape[2:4]
+        # Dynamic input axes take the configured size
+        self.input_size = (width, height) if isinstance(width, int) and isinstance(height, int) \
+            else (input_size, input_size)
+        outputs = session.get_outputs()
+        self.output_names = [o.name for o in outputs]
+        if len(outputs) == 9:
+            self.strides, self.num_anchors = (8, 16, 32), 2
+        elif len(outputs) == 15:
+            self.strides, self.num_anchors = (8, 16, 32, 64, 128), 1
+        else:
+            raise ValueError(f"Expected an SCRFD model with keypoints (9 or 15 outputs), got {len(outputs)}")
+        # Exports with a batch axis have 3-d outputs
+        self.batched = len(outputs[0].shape) == 3
+        self._centers = {}
+
+    @property
+    def min_size(self):
+        """Smallest image side worth decoding for this detector"""
+        return min(self.input_size)
+
+    def _anchor_centers(self, height, width, stride):
+        key = (height, width, stride)
+        if key not in self._centers:
+            centers = np.stack(np.mgrid[:height, :width][::-1], axis=-1).astype(np.float32)
+            centers = (centers * stride).reshape(-1, 2)
+            if self.num_anchors > 1:
+                centers = np.repeat(centers, self.num_anchors, axis=0)
+            self._centers[key] = centers
+        return self._centers[key]
+
+    def _blob(self, img):
+        """Letterboxed, normalized NCHW RGB input and the image -> input scale"""
+        input_w, input_h = self.input_size
+        height, width = img.shape[:2]
+        if height / width > input_h / input_w:
+            new_h, new_w = input_h, max(1, int(input_h * width / height))
+        else:
+            new_w, new_h = input_w, max(1, int(input_w * height / width))
+        scale = new_h / height
+        canvas = np.zeros((input_h, input_w, 3), dtype=np.uint8)
+        canvas[:new_h, :new_w] = cv2.resize(img, (new_w, new_h))
+        blob = cv2.dnn.blobFromImage(canvas, 1.0 / 128, (input_w, input_h), (127.5, 127.5, 127.5), swapRB=True)
+        return blob, scale
+
+    def detect(self, img):
+        blob, scale = self._blob(img)
+        outputs = self.session.run(self.output_names, {self.input_name: blob})
+        if self.batched:
+            outputs = [o[0] for o in outputs]
+        count = len(self.strides)
+        input_w, input_h = self.input_size
+        all_boxes, all_scores, all_landmarks = [], [], []
+        for i, stride in enumerate(self.strides):
+            scores = outputs[i].reshape(-1)
+            keep = np.nonzero(scores >= self.score_threshold)[0]
+            if keep.size == 0:
+                continue
+            centers = self._anchor_centers(input_h // stride, input_w // stride, stride)[keep]
+            distances = outputs[i + count].reshape(-1, 4)[keep] * stride
+            offsets = outputs[i + 2 * count].reshape(-1, 5, 2)[keep] * stride
+            all_boxes.append(np.concatenate([centers - distances[:, :2], centers + distances[:, 2:]], axis=1))
+            all_landmarks.append(centers[:, None, :] + offsets)
+            all_scores.append(scores[keep])
+        if not all_scores:
+            return np.zeros((0, 4), np.float32), np.zeros((0,), np.float32), np.zeros((0, 5, 2), np.float32)
+        boxes = np.concatenate(all_boxes) / scale
+        landmarks = np.concatenate(all_landmarks) / scale
+        scores = np.concatenate(all_scores)
+        keep = nms(boxes, scores, self.nms_threshold)
+        if self.max_faces:
+            keep = keep[:self.max_faces]
+        return boxes[keep].astype(np.float32), scores[keep].astype(np.float32), landmarks[keep].astype(np.float32)
+
+
+def create_detector(config):
+    """FaceDetector for FACE_DETECTOR_MODEL_PATH, configured from FACE_DETECTOR_* settings"""
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    threads = config.get('FACE_DETECTOR_THREADS', 0)
+    if threads:
+        opts.intra_op_num_threads = threads
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = ['CPUExecutionProvider']
+    if config.get('USE_GPU', False) and 'CUDAExecutionProvider' in ort.get_available_providers():
+        providers = [('CUDAExecutionProvider', {'device_id': config.get('GPU_ID', 0)})] + providers
+    model_path = config.get('FACE_DETECTOR_MODEL_PATH', '/app/models/scrfd_500m_kps.onnx')
+    session = ort.InferenceSession(model_path, sess_options=opts, providers=providers)
+    print(f"Process {os.getpid()}: face detector loaded from {model_path} with {session.get_providers()}")
+    return FaceDetector(
+        session,
+        input_size=config.get('FACE_DETECTOR_INPUT_SIZE', 640),
+        score_threshold=config.get('FACE_DETECTOR_SCORE_THRESHOLD', 0.5),
+        nms_threshold=config.get('FACE_DETECTOR_NMS_THRESHOLD', 0.4),
+        max_faces=config.get('FACE_DETECTOR_MAX_FACES', 0))
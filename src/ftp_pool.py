@@ -0,0 +1,188 @@
+import ftplib
+import io
+import threading
+import time
+from urllib.parse import urlparse
+
+# Errors after which a session is not reused; error_perm (e.g. 550 no such file) leaves it usable
+BROKEN_SESSION_ERRORS = (OSError, EOFError, ftplib.error_temp, ftplib.error_reply, ftplib.error_proto)
+
+
+def parse_ftp_url(ftp_url):
+    """(host, port, path) of an ftp:// URL"""
+    parsed_url = urlparse(ftp_url)
+    if parsed_url.scheme != 'ftp' or not parsed_url.hostname:
+        raise ValueError("Invalid FTP URL")
+    return parsed_url.hostname, parsed_url.port or 21, parsed_url.path
+
+
+class FTPPool:
+    """
+    Logged-in ftplib sessions kept per worker process, keyed by host, port and
+    user, so a fetch is one RETR instead of connect + login + RETR + QUIT.
+
+    Up to max_idle sessions per key stay open for idle_timeout seconds. A session
+    idle for more than health_check_interval seconds is probed with NOOP before
+    reuse; a failed probe, or a connection error on a reused session, falls back
+    to a new connection. Every socket operation is bounded by timeout.
+    """
+
+    def __init__(self, max_idle=4, idle_timeout=60.0, health_check_interval=5.0, timeout=10.0):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # key -> [(ftp, last used), ...], most recently used last
+        self._idle = {}
+        self._counters = {"connects": 0, "reuses": 0, "health_checks": 0, "health_check_failures": 0,
+                          "expired": 0, "discarded": 0, "retries": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _connect(self, host, port, username, password):
+        ftp = ftplib.FTP(timeout=self.timeout)
+        try:
+            ftp.connect(host, port)
+            if username and password:
+                ftp.login(username, password)
+            else:
+                ftp.login()  # Anonymous login
+        except Exception:
+            ftp.close()
+            raise
+        self._count("connects")
+        return ftp
+
+    def _close(self, ftp):
+        try:
+            ftp.quit()
+        except Exception:
+            ftp.close()
+
+    def _expire(self, now):
+        """Remove sessions idle for more than idle_timeout; returns them for closing"""
+        expired = []
+        for key in list(self._idle):
+            fresh = []
+            for ftp, last_used in self._idle[key]:
+                (expired if now - last_used > self.idle_timeout else fresh).append((ftp, last_used))
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+        self._counters["expired"] += len(expired)
+        return [ftp for ftp, _ in expired]
+
+    def acquire(self, host, port=21, username=None, password=None):
+        """(ftp, reused) for the key: an idle session that passes its health check, else a new one"""
+        # The password is part of the key: a session is only reused for the credentials it logged in with
+        key = (host, port, username, password)
+        while True:
+            with self._lock:
+                expired = self._expire(time.monotonic())
+                sessions = self._idle.get(key)
+                ftp, last_used = sessions.pop() if sessions else (None, None)
+            for stale in expired:
+                self._close(stale)
+            if ftp is None:
+                return self._connect(host, port, username, password), False
+            if time.monotonic() - last_used <= self.health_check_interval:
+                self._count("reuses")
+                return ftp, True
+            self._count("health_checks")
+            try:
+                ftp.voidcmd('NOOP')
+                self._count("reuses")
+                return ftp, True
+            except Exception:
+                self._count("health_check_failures")
+                ftp.close()
+
+    def release(self, ftp, host, port=21, username=None, password=None, broken=False):
+        """Return a session to the pool, or close it if broken or the pool is full"""
+        key = (host, port, username, password)
+        if not broken:
+            with self._lock:
+                sessions = self._idle.setdefault(key, [])
+                if len(sessions) < self.max_idle:
+                    sessions.append((ftp, time.monotonic()))
+                    return
+        self._count("discarded")
+        if broken:
+            ftp.close()
+        else:
+            self._close(ftp)
+
+    def _retrieve_on(self, ftp, path):
+        bio = io.BytesIO()
+        ftp.retrbinary(f'RETR {path}', bio.write)
+        return bio.getvalue()
+
+    def retrieve(self, ftp_url, username=None, password=None):
+        """Bytes of the file at an ftp:// URL"""
+        result = self.retrieve_many([ftp_url], username, password)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def retrieve_many(self, ftp_urls, username=None, password=None):
+        """
+        Bytes of several ftp:// URLs, each host's paths fetched over one session.
+        Failed items are returned as their exception, in input order.
+        """
+        if not (username and password):
+            username = password = None  # Anonymous login
+        results = [None] * len(ftp_urls)
+        by_host = {}
+        for i, ftp_url in enumerate(ftp_urls):
+            try:
+                host, port, path = parse_ftp_url(ftp_url)
+            except ValueError as e:
+                results[i] = e
+                continue
+            by_host.setdefault((host, port), []).append((i, path))
+        for (host, port), items in by_host.items():
+            ftp, used = None, False
+            for i, path in items:
+                for attempt in range(2):
+                    if ftp is None:
+                        try:
+                            ftp, used = self.acquire(host, port, username, password)
+                        except Exception as e:
+                            results[i] = e
+                            break
+                    try:
+                        results[i] = self._retrieve_on(ftp, path)
+                        used = True
+                        break
+                    except BROKEN_SESSION_ERRORS as e:
+                        self.release(ftp, host, port, username, password, broken=True)
+                        ftp = None
+                        # The server may have dropped a session that served earlier requests: retry once
+                        if used and attempt == 0:
+                            self._count("retries")
+                            continue
+                        results[i] = e
+                        break
+                    except Exception as e:
+                        results[i] = e
+                        break
+            if ftp is not None:
+                self.release(ftp, host, port, username, password)
+        return results
+
+    def stats(self):
+        with self._lock:
+            idle = {f"{host}:{port}:{username or 'anonymous'}": len(sessions)
+                    for (host, port, username, _), sessions in self._idle.items()}
+            return dict(self._counters, idle=idle)
+
+    def close(self):
+        with self._lock:
+            sessions = [ftp for items in self._idle.values() for ftp, _ in items]
+            self._idle = {}
+        for ftp in sessions:
+            self._close(ftp)
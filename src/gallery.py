@@ -0,0 +1,447 @@
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, point_label
+from qdrant import QdrantClient, collection_url_from_search_url
+
+# Qdrant page sizes for the scroll (ids + payloads) and retrieve (vectors) calls
+SCROLL_LIMIT = 1000
+RETRIEVE_BATCH = 256
+# How often a worker checks the shared directory for a newer generation
+RELOAD_CHECK_SECONDS = 1.0
+GALLERY_INDEXES = ('exact', 'ivf')
+
+
+def _f32_score(score):
+    """Python float that serializes like Qdrant's f32 scores (shortest float32 repr)"""
+    return float(str(np.float32(score)))
+
+
+class LocalGallery:
+    """
+    Exact cosine search over a snapshot of a Qdrant collection.
+
+    The snapshot lives in a directory shared by all workers: a float32 .npy
+    matrix of L2-normalized vectors, memory-mapped read-only by every worker,
+    and a JSON side-file of (id, payload) per row. Each refresh writes a new
+    generation and switches current.json atomically; workers pick it up on
+    their next search. One worker at a time refreshes, under a file lock.
+
+    Incremental refreshes scroll ids and payloads only and fetch vectors for
+    new ids; a full refresh (at startup, and every full_refresh_interval)
+    re-reads every vector, which also picks up vectors re-upserted under an
+    existing id.
+
+    With index='ivf' and at least index_min_points points, each generation
+    also gets an IVF index (ann_index.IVFIndex) in ivf.<generation>, updated
+    incrementally from the previous one and retrained once the gallery has
+    doubled since training. Smaller galleries stay on exact search.
+    """
+
+    def __init__(self, collection_url, gallery_dir, refresh_interval=60.0, full_refresh_interval=3600.0,
+                 qdrant=None, index='exact', ivf_nlist=0, ivf_nprobe=16, ivf_dtype='float32',
+                 index_min_points=50000):
+        if index not in GALLERY_INDEXES:
+            raise ValueError(f"Invalid gallery index '{index}'. Use one of {GALLERY_INDEXES}")
+        self.index = index
+        self.ivf_nlist = ivf_nlist
+        self.ivf_nprobe = ivf_nprobe
+        self.ivf_dtype = ivf_dtype
+        self.index_min_points = index_min_points
+        self.collection_url = collection_url.rstrip('/')
+        self.gallery_dir = gallery_dir
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        # Snapshot reads are large: the service's client, or one with a long read timeout
+        self.qdrant = qdrant or QdrantClient(self.collection_url, read_timeout=60.0)
+        os.makedirs(gallery_dir, exist_ok=True)
+        self._meta_path = os.path.join(gallery_dir, 'current.json')
+        self._lock_path = os.path.join(gallery_dir, '.lock')
+        # (generation, vectors, ids, payloads, ivf index or None, (sorted labels, rows)),
+        # replaced as a whole on reload
+        self._state = None
+        self._meta_mtime = None
+        self._next_reload_check = 0.0
+        self._load_lock = threading.Lock()
+        self._counters = {"searches": 0, "reloads": 0, "refreshes": 0, "full_refreshes": 0, "refresh_errors": 0}
+        self._last_refresh_error = None
+        try:
+            self.ensure_loaded()
+        except Exception as e:
+            # Qdrant may not be up yet; the first search or the refresh thread retries
+            self._last_refresh_error = str(e)
+            print(f"Process {os.getpid()}: Local gallery not loaded yet: {e}")
+        if refresh_interval and refresh_interval > 0:
+            thread = threading.Thread(target=self._refresh_loop, name='gallery-refresh', daemon=True)
+            thread.start()
+
+    # Shared directory
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_meta(self, meta):
+        tmp = f"{self._meta_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+
+    def _paths(self, generation):
+        return (os.path.join(self.gallery_dir, f'vectors.{generation}.npy'),
+                os.path.join(self.gallery_dir, f'points.{generation}.json'))
+
+    def _index_path(self, generation):
+        return os.path.join(self.gallery_dir, f'ivf.{generation}')
+
+    def _file_lock(self, blocking=True):
+        """Exclusive lock on the gallery directory, None if non-blocking and held elsewhere"""
+        fd = open(self._lock_path, 'a')
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            fd.close()
+            return None
+        return fd
+
+    def _write_generation(self, generation, ids, payloads, vectors):
+        vectors_path, points_path = self._paths(generation)
+        tmp = f"{vectors_path}.{os.getpid()}.tmp.npy"
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=vectors.shape)
+        out[:] = vectors
+        out.flush()
+        del out
+        os.replace(tmp, vectors_path)
+        tmp = f"{points_path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump([[point_id, payload] for point_id, payload in zip(ids, payloads)], f)
+        os.replace(tmp, points_path)
+
+    def _write_index(self, generation, previous_generation, ids, vectors, added_ids, removed_ids):
+        """IVF index for a new generation, from the previous generation's index when there is one"""
+        if self.index != 'ivf' or len(ids) < self.index_min_points:
+            return
+        index = None
+        if previous_generation is not None and os.path.isdir(self._index_path(previous_generation)):
+            index = IVFIndex.load(self._index_path(previous_generation), nprobe=self.ivf_nprobe)
+            # Centroids trained on a much smaller gallery give long, unbalanced lists
+            if index.trained_count * 2 < len(ids):
+                index = None
+        if index is None:
+            index = IVFIndex.build(vectors, [point_label(i) for i in ids], nlist=self.ivf_nlist or None,
+                                   nprobe=self.ivf_nprobe, dtype=self.ivf_dtype)
+        else:
+            index.remove([point_label(i) for i in removed_ids])
+            if added_ids:
+                added = set(added_ids)
+                rows = [row for row, point_id in enumerate(ids) if point_id in added]
+                index.add(vectors[rows], [point_label(ids[row]) for row in rows])
+        index.save(self._index_path(generation))
+
+    def _remove_old_generations(self, keep):
+        # Workers still mapping an older file keep it alive until they reload
+        for name in os.listdir(self.gallery_dir):
+            parts = name.split('.')
+            if len(parts) == 2 and parts[0] == 'ivf' and parts[1].isdigit() and int(parts[1]) < keep - 1:
+                shutil.rmtree(os.path.join(self.gallery_dir, name), ignore_errors=True)
+            elif len(parts) == 3 and parts[0] in ('vectors', 'points') and parts[1].isdigit() \
+                    and int(parts[1]) < keep - 1:
+                try:
+                    os.remove(os.path.join(self.gallery_dir, name))
+                except OSError:
+                    pass
+
+    # Loading
+
+    def _load(self, meta):
+        vectors_path, points_path = self._paths(meta["generation"])
+        vectors = np.load(vectors_path, mmap_mode='r')
+        with open(points_path) as f:
+            points = json.load(f)
+        ids = [p[0] for p in points]
+        payloads = [p[1] for p in points]
+        index = None
+        lookup = None
+        index_path = self._index_path(meta["generation"])
+        if self.index == 'ivf' and os.path.isdir(index_path):
+            index = IVFIndex.load(index_path, nprobe=self.ivf_nprobe)
+            # Index labels back to gallery rows
+            labels = np.fromiter((point_label(i) for i in ids), np.int64, len(ids))
+            order = np.argsort(labels)
+            lookup = (labels[order], order)
+        self._state = (meta["generation"], vectors, ids, payloads, index, lookup)
+        self._counters["reloads"] += 1
+
+    def _reload_if_changed(self, force=False):
+        now = time.monotonic()
+        if not force and self._state is not None and now < self._next_reload_check:
+            return
+        self._next_reload_check = now + RELOAD_CHECK_SECONDS
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime and self._state is not None:
+            return
+        with self._load_lock:
+            meta = self._read_meta()
+            if meta is None:
+                return
+            if self._state is None or self._state[0] != meta["generation"]:
+                self._load(meta)
+            self._meta_mtime = mtime
+
+    def ensure_loaded(self):
+        """Load the current generation, taking a full snapshot first if there is none"""
+        self._reload_if_changed(force=True)
+        if self._state is not None:
+            return
+        lock = self._file_lock()
+        try:
+            # Another worker may have built it while we waited for the lock
+            if self._read_meta() is None:
+                self._refresh_locked(full=True)
+        finally:
+            lock.close()
+        self._reload_if_changed(force=True)
+
+    # Qdrant
+
+    def _post(self, path, body):
+        return self.qdrant.post(path, body)["result"]
+
+    def _vector_size(self):
+        """Vector size of the collection, checking it holds single unnamed Cosine vectors"""
+        vectors = self.qdrant.collection_info()["config"]["params"]["vectors"]
+        distance = vectors.get("distance") if isinstance(vectors, dict) else None
+        if distance != "Cosine":
+            raise ValueError(f"Local search supports single unnamed Cosine vectors, collection uses {vectors}")
+        return int(vectors["size"])
+
+    def _scroll(self, with_vector):
+        """All points of the collection, in Qdrant's id order"""
+        points = []
+        offset = None
+        while True:
+            body = {"limit": SCROLL_LIMIT, "with_payload": True, "with_vector": with_vector}
+            if offset is not None:
+                body["offset"] = offset
+            result = self._post('/points/scroll', body)
+            points.extend(result["points"])
+            offset = result.get("next_page_offset")
+            if offset is None:
+                return points
+
+    def _retrieve_vectors(self, ids):
+        vectors = {}
+        for i in range(0, len(ids), RETRIEVE_BATCH):
+            body = {"ids": ids[i:i + RETRIEVE_BATCH], "with_payload": False, "with_vector": True}
+            for point in self._post('/points', body):
+                vectors[point["id"]] = point["vector"]
+        return vectors
+
+    # Refresh
+
+    def _refresh_locked(self, full):
+        meta = self._read_meta()
+        previous = None
+        if meta is not None and not full:
+            vectors_path, points_path = self._paths(meta["generation"])
+            with open(points_path) as f:
+                points = json.load(f)
+            previous = ({p[0]: row for row, p in enumerate(points)}, [p[1] for p in points],
+                        np.load(vectors_path, mmap_mode='r'))
+        added_ids, removed_ids = None, None
+        if previous is None:
+            size = self._vector_size()
+            points = self._scroll(with_vector=True)
+            ids = [p["id"] for p in points]
+            payloads = [p.get("payload") for p in points]
+            vectors = np.asarray([p["vector"] for p in points], dtype=np.float32).reshape(len(ids), size)
+        else:
+            rows, old_payloads, old_vectors = previous
+            points = self._scroll(with_vector=False)
+            ids = [p["id"] for p in points]
+            payloads = [p.get("payload") for p in points]
+            new_ids = [point_id for point_id in ids if point_id not in rows]
+            unchanged = (not new_ids and len(ids) == len(rows)
+                         and all(rows[i] == row and old_payloads[row] == payload
+                                 for row, (i, payload) in enumerate(zip(ids, payloads))))
+            if unchanged:
+                meta["updated_at"] = time.time()
+                self._write_meta(meta)
+                self._counters["refreshes"] += 1
+                return
+            fetched = self._retrieve_vectors(new_ids)
+            vectors = []
+            keep_ids = []
+            keep_payloads = []
+            for point_id, payload in zip(ids, payloads):
+                vector = old_vectors[rows[point_id]] if point_id in rows else fetched.get(point_id)
+                # Deleted between the scroll and the retrieve
+                if vector is None:
+                    continue
+                vectors.append(np.asarray(vector, dtype=np.float32))
+                keep_ids.append(point_id)
+                keep_payloads.append(payload)
+            ids, payloads = keep_ids, keep_payloads
+            added_ids = [point_id for point_id in ids if point_id not in rows]
+            removed_ids = set(rows).difference(ids)
+            if vectors:
+                vectors = np.asarray(vectors, dtype=np.float32)
+            else:
+                # Empty collection: keep the vector size so queries still multiply
+                size = old_vectors.shape[1] if old_vectors.ndim == 2 and old_vectors.shape[1] else self._vector_size()
+                vectors = np.zeros((0, size), np.float32)
+        # Qdrant stores Cosine vectors normalized already; normalizing again is a no-op then
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        generation = (meta["generation"] + 1) if meta is not None else 1
+        self._write_generation(generation, ids, payloads, vectors)
+        self._write_index(generation, meta["generation"] if previous is not None else None,
+                          ids, vectors, added_ids, removed_ids)
+        now = time.time()
+        self._write_meta({
+            "generation": generation,
+            "count": len(ids),
+            "dim": int(vectors.shape[1]),
+            "updated_at": now,
+            "full_at": now if previous is None else meta.get("full_at", now),
+        })
+        self._remove_old_generations(generation)
+        self._counters["full_refreshes" if previous is None else "refreshes"] += 1
+
+    def refresh(self, full=False):
+        """Refresh the shared snapshot from Qdrant now (blocks on other workers' refreshes)"""
+        lock = self._file_lock()
+        try:
+            self._refresh_locked(full)
+        finally:
+            lock.close()
+        self._reload_if_changed(force=True)
+
+    def _refresh_if_stale(self):
+        meta = self._read_meta()
+        now = time.time()
+        if meta is not None and now - meta["updated_at"] < self.refresh_interval:
+            return
+        # Only one worker refreshes; the others pick up the new generation
+        lock = self._file_lock(blocking=False)
+        if lock is None:
+            return
+        try:
+            meta = self._read_meta()
+            if meta is not None and now - meta["updated_at"] < self.refresh_interval:
+                return
+            full = meta is None or now - meta.get("full_at", 0) >= self.full_refresh_interval
+            self._refresh_locked(full)
+        finally:
+            lock.close()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self._refresh_if_stale()
+                self._reload_if_changed(force=True)
+                self._last_refresh_error = None
+            except Exception as e:
+                self._counters["refresh_errors"] += 1
+                self._last_refresh_error = str(e)
+                print(f"Process {os.getpid()}: Local gallery refresh failed: {e}")
+
+    # Search
+
+    def _current_state(self):
+        # A snapshot that cannot be built or read is a server fault, not a bad request
+        try:
+            if self._state is None:
+                self.ensure_loaded()
+            else:
+                self._reload_if_changed()
+        except Exception as e:
+            self._last_refresh_error = str(e)
+            raise RuntimeError(f"Local gallery unavailable: {e}") from e
+        return self._state
+
+    def _hits(self, state, rows, scores):
+        _, _, ids, payloads, _, _ = state
+        # version is not exposed by Qdrant's scroll API
+        return [{"id": ids[row], "version": 0, "score": _f32_score(score), "payload": payloads[row]}
+                for row, score in zip(rows, scores)]
+
+    def _search_index(self, state, query, k):
+        _, _, _, _, index, lookup = state
+        labels, best_scores = index.search(query, k)
+        sorted_labels, label_rows = lookup
+        return label_rows[np.searchsorted(sorted_labels, labels)], best_scores
+
+    @staticmethod
+    def _top_rows(scores, k):
+        # Partial sort: only the top k are ordered
+        best = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        return best[np.argsort(-scores[best], kind='stable')]
+
+    def search(self, embedding, top=5):
+        """Top-k by cosine similarity, in Qdrant's /points/search response format"""
+        return self.search_many([embedding], top)[0]
+
+    def search_many(self, embeddings, top=5):
+        """One search response per embedding; exact search scores all of them in one matrix product"""
+        start = time.perf_counter()
+        state = self._current_state()
+        _, vectors, ids, _, index, _ = state
+        self._counters["searches"] += len(embeddings)
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms > 0, norms, 1.0)
+        k = min(top, len(ids))
+        hits = [[] for _ in range(len(queries))]
+        if k > 0 and index is not None:
+            for i, query in enumerate(queries):
+                hits[i] = self._hits(state, *self._search_index(state, query, k))
+        elif k > 0:
+            all_scores = queries @ vectors.T
+            for i, scores in enumerate(all_scores):
+                rows = self._top_rows(scores, k)
+                hits[i] = self._hits(state, rows, scores[rows])
+        elapsed = time.perf_counter() - start
+        return [{"result": result, "status": "ok", "time": elapsed} for result in hits]
+
+    def stats(self):
+        state = self._state
+        meta = self._read_meta()
+        return dict(self._counters,
+                    generation=state[0] if state is not None else None,
+                    points=len(state[2]) if state is not None else 0,
+                    index=state[4].stats() if state is not None and state[4] is not None else "exact",
+                    updated_at=meta.get("updated_at") if meta else None,
+                    full_at=meta.get("full_at") if meta else None,
+                    last_refresh_error=self._last_refresh_error)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build or refresh the local search gallery from Qdrant')
+    parser.add_argument('--qdrant-url', default=os.environ.get('QDRANT_URL', 'http://qdrant:6333/collections/f4r/points/search'),
+                        help='collection search URL (QDRANT_URL) or collection URL')
+    parser.add_argument('--gallery-dir', default=os.environ.get('GALLERY_DIR', '/tmp/face-gallery'))
+    parser.add_argument('--full', action='store_true', help='re-read every vector instead of an incremental refresh')
+    args = parser.parse_args()
+
+    existed = os.path.exists(os.path.join(args.gallery_dir, 'current.json'))
+    # A new gallery directory gets its full snapshot while loading
+    gallery = LocalGallery(collection_url_from_search_url(args.qdrant_url), args.gallery_dir, refresh_interval=0)
+    if existed:
+        gallery.refresh(full=args.full)
+    print(json.dumps(gallery.stats(), indent=2))
@@ -13,6 +13,9 @@ backlog = 2048
 import os
 workers = int(os.getenv('GUNICORN_WORKERS', 2))
 worker_class = "sync"
+# More than one thread switches gunicorn to the gthread worker, which lets
+# concurrent requests share forward passes when MICRO_BATCH_ENABLED=true
+threads = int(os.getenv('GUNICORN_THREADS', 1))
 
 worker_connections = 1000
 timeout = 30
@@ -49,6 +52,33 @@ tmp_upload_dir = None
 # Format: module_name:variable_name
 wsgi_module = "app:app"
 
+# Prometheus multiprocess mode: every worker writes its metrics to files in this
+# directory and /metrics sums them. It must be set before the app is imported.
+if os.getenv('METRICS_ENABLED', 'true').lower() == 'true':
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/face-api-metrics')
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+def on_starting(server):
+    """Clear the previous run's metric files and build the shared weights file"""
+    metrics_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        import shutil
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+    # Once, in a spawned process: the master forks the workers and must not load the runtime
+    if os.getenv('SHARED_WEIGHTS', 'false').lower() == 'true':
+        from app import app
+        from encoders import prepare_shared_weights
+        model_path = prepare_shared_weights(app.config)
+        if model_path:
+            server.log.info(f"Shared weights ready: {model_path}")
+
+def child_exit(server, worker):
+    """Drop an exited worker's in-flight and batch-fill gauges"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        import metrics
+        metrics.worker_exit(worker.pid)
+
 # Worker warmup hook
 def post_worker_init(worker):
     """
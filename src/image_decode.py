@@ -0,0 +1,95 @@
+import struct
+import cv2
+import numpy as np
+
+# libjpeg can decode straight to 1/2, 1/4 or 1/8 scale by skipping DCT coefficients
+REDUCED_COLOR_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, ...); C4, C8 and CC are not frames
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def read_jpeg_size(buf):
+    """(width, height) from a JPEG header without decoding, None if buf is not a readable JPEG"""
+    if len(buf) < 4 or buf[0] != 0xFF or buf[1] != 0xD8:
+        return None
+    i = 2
+    n = len(buf)
+    while i + 4 <= n:
+        if buf[i] != 0xFF:
+            i += 1
+            continue
+        marker = buf[i + 1]
+        # Fill bytes and standalone markers carry no length
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack('>H', buf[i + 2:i + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > n:
+                return None
+            height, width = struct.unpack('>HH', buf[i + 5:i + 9])
+            return width, height
+        if marker == 0xDA:
+            # Start of scan before any frame header
+            return None
+        i += 2 + length
+    return None
+
+
+def choose_reduction(width, height, min_size):
+    """Largest decode scale factor that keeps both sides at least min_size pixels"""
+    for factor in (8, 4, 2):
+        if width // factor >= min_size and height // factor >= min_size:
+            return factor
+    return 1
+
+
+def decode_image(buf, min_size=112, reduced=True):
+    """
+    Decode encoded image bytes to a BGR array. With reduced=True, JPEGs much
+    larger than min_size are decoded at 1/2, 1/4 or 1/8 scale; anything else
+    (other formats, unreadable headers, small images) gets a full decode.
+    """
+    return decode_image_scaled(buf, min_size, reduced)[0]
+
+
+def decode_image_scaled(buf, min_size=112, reduced=True):
+    """
+    decode_image and the factor mapping decoded pixel coordinates back to the
+    full-size image, upright as OpenCV orients it from EXIF (1.0 unless decoded
+    at reduced scale)
+    """
+    img_array = np.frombuffer(buf, np.uint8)
+    flag = cv2.IMREAD_COLOR
+    size = None
+    if reduced:
+        size = read_jpeg_size(buf)
+        if size is not None:
+            factor = choose_reduction(size[0], size[1], min_size)
+            if factor > 1:
+                flag = REDUCED_COLOR_FLAGS[factor]
+    img = cv2.imdecode(img_array, flag)
+    if img is None and flag != cv2.IMREAD_COLOR:
+        flag = cv2.IMREAD_COLOR
+        img = cv2.imdecode(img_array, flag)
+    if img is None or flag == cv2.IMREAD_COLOR:
+        return img, 1.0
+    # Long sides: OpenCV applies the EXIF orientation, which can swap width and height
+    return img, max(size) / max(img.shape[:2])
+
+
+def decode_face(buf, image_size=112, reduced=True):
+    """Decode encoded image bytes to an image_size x image_size RGB uint8 image, None if undecodable"""
+    oimg = decode_image(buf, min_size=image_size, reduced=reduced)
+    if oimg is None:
+        return None
+    img = cv2.cvtColor(oimg, cv2.COLOR_BGR2RGB)
+    return cv2.resize(img, (image_size, image_size))
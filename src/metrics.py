@@ -0,0 +1,237 @@
+import contextvars
+import os
+import threading
+import time
+
+import procmem
+import serializers
+from config import Config
+
+# Optional: Prometheus export (/metrics). Without prometheus_client every call here is a no-op.
+try:
+    import prometheus_client
+    from prometheus_client import multiprocess
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:
+    prometheus_client = None
+
+# Pipeline stages with a latency histogram
+STAGES = ('decode', 'detect', 'preprocess', 'forward', 'flip', 'qdrant', 'gallery', 'serialize')
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ENABLED = prometheus_client is not None and Config.METRICS_ENABLED
+# Under gunicorn, each worker writes its samples to PROMETHEUS_MULTIPROC_DIR (set up in gunicorn_config.py)
+MULTIPROCESS = ENABLED and bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Timeline:
+    """
+    Stage timings of one request, on the perf_counter clock: stages recorded while
+    it is the current timeline (see begin_timeline) are appended as
+    (stage, start, seconds). Stages run on another thread, such as a micro-batcher's
+    shared forward pass, are not included.
+    """
+
+    __slots__ = ('start', 'sampled', 'events')
+
+    def __init__(self, start=None, sampled=False):
+        self.start = time.perf_counter() if start is None else start
+        self.sampled = sampled
+        self.events = []
+
+    def totals(self):
+        """Seconds per stage, summed over repeats, in order of first occurrence"""
+        totals = {}
+        for name, _, seconds in self.events:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self, total=None):
+        """Server-Timing header value: one entry per stage in ms, plus total"""
+        entries = [f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in self.totals().items()]
+        if total is not None:
+            entries.append(f"total;dur={total * 1000.0:.2f}")
+        return ", ".join(entries)
+
+    def trace(self, total, **info):
+        """Structured record of the whole timeline, offsets from the request start"""
+        record = dict(info)
+        record["total_ms"] = round(total * 1000.0, 3)
+        record["stages"] = [{"stage": name, "start_ms": round((start - self.start) * 1000.0, 3),
+                             "ms": round(seconds * 1000.0, 3)} for name, start, seconds in self.events]
+        return record
+
+
+_timeline = contextvars.ContextVar('timeline', default=None)
+
+
+def begin_timeline(start=None, sampled=False):
+    """Make a new Timeline current for this thread or task"""
+    timeline = Timeline(start, sampled)
+    _timeline.set(timeline)
+    return timeline
+
+
+def end_timeline():
+    _timeline.set(None)
+
+
+class _Stage:
+    """Context manager timing one stage into its histogram child and the current timeline"""
+
+    __slots__ = ('_name', '_observe', '_timeline', '_start')
+
+    def __init__(self, name, histogram, timeline):
+        self._name = name
+        self._observe = histogram.observe if histogram is not None else None
+        self._timeline = timeline
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self._start
+        if self._observe is not None:
+            self._observe(seconds)
+        if self._timeline is not None:
+            self._timeline.events.append((self._name, self._start, seconds))
+        return False
+
+
+class TraceLog:
+    """JSON lines of sampled request timelines, to a file or a logger"""
+
+    def __init__(self, path=None, logger=None):
+        self.path = path
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab', buffering=0) if path else None
+
+    def write(self, record):
+        line = serializers.dumps_json(record)
+        if self._file is None:
+            self.logger.info(f"trace {line.decode('utf-8')}")
+            return
+        # One write per record: lines from concurrent workers appending to one file stay whole
+        with self._lock:
+            self._file.write(line + b'\n')
+
+
+class MemoryCollector:
+    """
+    Memory of every worker, read from /proc at scrape time. The workers' files in
+    multiprocess mode only hold what each worker wrote, so the scraped worker
+    reads its siblings' figures itself.
+    """
+
+    def collect(self):
+        family = GaugeMetricFamily('face_worker_memory_bytes', 'Worker memory: rss, pss and uss (unique to the worker)',
+                                   labels=['pid', 'kind'])
+        for pid in procmem.sibling_pids() if MULTIPROCESS else [os.getpid()]:
+            usage = procmem.memory_usage(pid)
+            if usage is None:
+                continue
+            for kind in ('rss', 'pss', 'uss'):
+                family.add_metric([str(pid), kind], usage[kind])
+        yield family
+
+
+_NOOP = _Noop()
+
+if ENABLED:
+    STAGE_SECONDS = prometheus_client.Histogram(
+        'face_stage_seconds', 'Time spent per pipeline stage', ['stage'], buckets=STAGE_BUCKETS)
+    REQUEST_SECONDS = prometheus_client.Histogram(
+        'face_request_seconds', 'Request latency per endpoint', ['endpoint'], buckets=STAGE_BUCKETS)
+    IMAGES = prometheus_client.Counter(
+        'face_images_total', 'Images received per endpoint and source type', ['endpoint', 'source_type'])
+    ERRORS = prometheus_client.Counter(
+        'face_errors_total', 'Failed requests and batch items per endpoint and error class', ['endpoint', 'error'])
+    IN_FLIGHT = prometheus_client.Gauge(
+        'face_requests_in_flight', 'Requests being handled', multiprocess_mode='livesum')
+    BATCH_FILL = prometheus_client.Gauge(
+        'face_batch_fill_ratio', 'Used rows / rows run (padding included) of the last batch',
+        multiprocess_mode='liveall')
+    BATCH_IMAGES = prometheus_client.Histogram(
+        'face_batch_images', 'Images per model batch', buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+    MODEL_IMAGES = prometheus_client.Counter('face_model_images_total', 'Images embedded by the model')
+    MODEL_BATCHES = prometheus_client.Counter('face_model_batches_total', 'Batches run through the model')
+    # Label children bound once: the hot path does no label lookups
+    _stage_observers = {name: STAGE_SECONDS.labels(name) for name in STAGES}
+    if not MULTIPROCESS:
+        prometheus_client.REGISTRY.register(MemoryCollector())
+
+
+def stage(name):
+    """Context manager timing a stage; for code around an await, time it and call observe()"""
+    timeline = _timeline.get()
+    if not ENABLED:
+        return _NOOP if timeline is None else _Stage(name, None, timeline)
+    return _Stage(name, _stage_observers[name], timeline)
+
+
+def observe(name, seconds):
+    if ENABLED:
+        _stage_observers[name].observe(seconds)
+    timeline = _timeline.get()
+    if timeline is not None:
+        timeline.events.append((name, time.perf_counter() - seconds, seconds))
+
+
+def count_image(endpoint, source_type, n=1):
+    if ENABLED:
+        IMAGES.labels(endpoint, source_type).inc(n)
+
+
+def count_error(endpoint, error):
+    """error: an exception (labelled by class) or a label such as 'http_400'"""
+    if ENABLED:
+        ERRORS.labels(endpoint, error if isinstance(error, str) else type(error).__name__).inc()
+
+
+def request_started():
+    if ENABLED:
+        IN_FLIGHT.inc()
+
+
+def request_finished(endpoint, seconds):
+    if ENABLED:
+        IN_FLIGHT.dec()
+        REQUEST_SECONDS.labels(endpoint).observe(seconds)
+
+
+def model_batch(images, rows, capacity):
+    """One encoder batch: images faces in rows used rows (flip copies included) of a capacity-row input"""
+    if ENABLED:
+        MODEL_BATCHES.inc()
+        MODEL_IMAGES.inc(images)
+        BATCH_IMAGES.observe(images)
+        BATCH_FILL.set(rows / capacity if capacity else 0.0)
+
+
+def render():
+    """(body, content type) of the exposition, aggregated over all workers in multiprocess mode; None when off"""
+    if not ENABLED:
+        return None
+    registry = prometheus_client.REGISTRY
+    if MULTIPROCESS:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(MemoryCollector())
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def worker_exit(pid):
+    """gunicorn child_exit hook: drop the dead worker's live gauges"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
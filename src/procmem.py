@@ -0,0 +1,80 @@
+import os
+
+# smaps fields, in kB, summed into each report
+_FIELDS = {
+    'Rss': 'rss',
+    'Pss': 'pss',
+    'Shared_Clean': 'shared',
+    'Shared_Dirty': 'shared',
+    'Private_Clean': 'uss',
+    'Private_Dirty': 'uss',
+}
+
+
+def memory_usage(pid='self', mapped_prefix=None):
+    """
+    Memory of a process from /proc, in bytes: rss, pss (each shared page split
+    between the processes mapping it), uss (pages no other process maps, i.e.
+    what exiting would free) and shared. With mapped_prefix, 'mapped' holds the
+    same figures for the file mappings under that path. None without /proc.
+    """
+    usage = dict.fromkeys(('rss', 'pss', 'uss', 'shared'), 0)
+    mapped = dict(usage) if mapped_prefix else None
+    # smaps_rollup is one pre-summed entry; per-file figures need the full smaps
+    path = f"/proc/{pid}/smaps" if mapped_prefix else f"/proc/{pid}/smaps_rollup"
+    in_prefix = False
+    try:
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                key = fields[0]
+                if not key.endswith(':'):
+                    # Mapping header: address perms offset dev inode [path]
+                    in_prefix = mapped_prefix is not None and len(fields) > 5 and fields[5].startswith(mapped_prefix)
+                    continue
+                name = _FIELDS.get(key[:-1])
+                if name is None:
+                    continue
+                value = int(fields[1]) * 1024
+                usage[name] += value
+                if in_prefix:
+                    mapped[name] += value
+    except (OSError, ValueError, IndexError):
+        return None
+    if mapped is not None:
+        usage['mapped'] = mapped
+    return usage
+
+
+def _cmdline(pid):
+    with open(f"/proc/{pid}/cmdline", 'rb') as f:
+        return f.read()
+
+
+def sibling_pids():
+    """
+    This process and those forked from the same parent with the same command
+    line: the workers of one gunicorn master. [own pid] without /proc.
+    """
+    own = os.getpid()
+    try:
+        parent = os.getppid()
+        cmdline = _cmdline('self')
+        entries = os.listdir('/proc')
+    except OSError:
+        return [own]
+    pids = []
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'rb') as f:
+                stat = f.read()
+            # The parent pid is the second field after the parenthesised command name
+            if int(stat.rsplit(b')', 1)[1].split()[1]) == parent and _cmdline(entry) == cmdline:
+                pids.append(int(entry))
+        except (OSError, ValueError, IndexError):
+            continue
+    return sorted(pids) if own in pids else [own]
@@ -0,0 +1,129 @@
+import collections
+import marshal
+import os
+import sys
+import threading
+import time
+
+
+# Leaf functions of a thread blocked in a wait rather than running: Condition.wait,
+# selector/poll loops, lock acquires, Thread.join, socket accepts and reads
+IDLE_FUNCTIONS = frozenset(('wait', 'wait_for', '_wait_for_tstate_lock', 'acquire', 'select', 'poll',
+                            'sleep', 'accept', 'readinto', 'recv_into'))
+
+
+def frame_label(func):
+    """'name (file.py:line)' of a (filename, line, name) function key"""
+    filename, line, name = func
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: every interval seconds the Python stack of each thread
+    in the process is sampled (sys._current_frames), so the cost is paid by the
+    sampling thread and nothing is hooked into the code being profiled. Stacks
+    are counted root first, with the thread name as the root frame and each
+    function as a pstats (filename, line, name) key.
+
+    Samples are wall-clock: a thread counts whether it runs or not. Stacks whose
+    leaf is a known blocking wait (IDLE_FUNCTIONS) are dropped unless
+    include_idle; waits inside C calls made by other functions (time.sleep in a
+    loop, a C queue's get) cannot be told apart and still count.
+    """
+
+    def __init__(self, interval=0.005, exclude_threads=(), include_idle=False):
+        self.interval = interval
+        self.exclude_threads = set(exclude_threads)
+        self.include_idle = include_idle
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.idle = 0
+
+    def _sample(self, own_ident):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident or ident in self.exclude_threads:
+                continue
+            if not self.include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                self.idle += 1
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds):
+        """Sample for seconds in a separate thread and wait for it"""
+        def loop():
+            own = threading.get_ident()
+            deadline = time.perf_counter() + seconds
+            next_sample = time.perf_counter()
+            while next_sample < deadline:
+                self._sample(own)
+                next_sample += self.interval
+                delay = next_sample - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        sampler = threading.Thread(target=loop, name='sampling-profiler', daemon=True)
+        sampler.start()
+        sampler.join()
+        return self
+
+    def collapsed(self):
+        """Folded stacks, one 'root;...;leaf count' line each (flamegraph.pl, speedscope)"""
+        return "".join(f"{';'.join([stack[0]] + [frame_label(f) for f in stack[1:]])} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+    def top(self, limit=50, sort='self'):
+        """Text table of functions by samples as the leaf (self) and anywhere on the stack (total)"""
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            # Thread name excluded; a recursive function counts once per stack
+            frames = stack[1:]
+            if frames:
+                own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        all_samples = sum(self.stacks.values()) or 1
+        idle = "included" if self.include_idle else f"{self.idle} idle thread samples excluded"
+        lines = [f"{self.samples} wall-clock samples every {self.interval * 1000.0:g} ms over "
+                 f"{len(set(s[0] for s in self.stacks))} threads ({idle})",
+                 f"{'self':>8s} {'self%':>6s} {'total':>8s} {'total%':>6s}  function"]
+        for label, _ in (own if sort == 'self' else total).most_common(limit):
+            lines.append(f"{own[label]:8d} {own[label] * 100.0 / all_samples:6.1f} {total[label]:8d} "
+                         f"{total[label] * 100.0 / all_samples:6.1f}  {frame_label(label)}")
+        return "\n".join(lines) + "\n"
+
+    def pstats(self):
+        """
+        The samples as a marshalled profile that pstats.Stats and snakeviz load. Times
+        are samples times the interval (self as the leaf, cumulative anywhere on the
+        stack); call counts are sample counts, since sampling does not see calls.
+        """
+        stats = {}
+        for stack, count in self.stacks.items():
+            frames = stack[1:]
+            seconds = count * self.interval
+            # A recursive function or call edge counts once per stack
+            for func in set(frames):
+                entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+                entry[0] += count
+                entry[1] += count
+                entry[3] += seconds
+            for caller, callee in set(zip(frames, frames[1:])):
+                edge = stats[callee][4].setdefault(caller, [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[3] += seconds
+            if frames:
+                stats[frames[-1]][2] += seconds
+                if len(frames) > 1:
+                    stats[frames[-1]][4][frames[-2]][2] += seconds
+        return marshal.dumps({func: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+                              for func, (cc, nc, tt, ct, callers) in stats.items()})
@@ -0,0 +1,256 @@
+import asyncio
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+import serializers
+from batcher import MicroBatcher
+
+# Optional: async HTTP client for the asyncio serving mode (asgi_app.py)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class QdrantError(RuntimeError):
+    """Error response from Qdrant, with the message from its body"""
+
+    def __init__(self, status_code, message):
+        super().__init__(f"Qdrant error {status_code}: {message}")
+        self.status_code = status_code
+
+
+def error_message(response):
+    """Qdrant's {"status": {"error": ...}} message, else the start of the body"""
+    try:
+        return response.json()["status"]["error"]
+    except (ValueError, KeyError, TypeError):
+        return response.text[:200]
+
+
+def collection_url_from_search_url(search_url):
+    """http://qdrant:6333/collections/f4r/points/search -> http://qdrant:6333/collections/f4r"""
+    return search_url.rstrip('/').rsplit('/points/search', 1)[0]
+
+
+class LatencyHistogram:
+    """Call latencies in fixed millisecond buckets"""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self._count = 0
+        self._sum_ms = 0.0
+        self._max_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000.0
+        bucket = len(self.BOUNDS_MS)
+        for i, bound in enumerate(self.BOUNDS_MS):
+            if ms <= bound:
+                bucket = i
+                break
+        with self._lock:
+            self._counts[bucket] += 1
+            self._count += 1
+            self._sum_ms += ms
+            self._max_ms = max(self._max_ms, ms)
+
+    def _quantile(self, counts, total, q):
+        """Upper bound of the bucket holding the q-quantile"""
+        target = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= target and n:
+                return float(self.BOUNDS_MS[i]) if i < len(self.BOUNDS_MS) else self._max_ms
+        return 0.0
+
+    def stats(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            stats = {
+                "count": total,
+                "avg_ms": (self._sum_ms / total) if total else 0.0,
+                "max_ms": self._max_ms,
+            }
+        for q in (0.5, 0.95, 0.99):
+            stats[f"p{int(q * 100)}_ms"] = self._quantile(counts, total, q) if total else 0.0
+        labels = [f"<={bound}ms" for bound in self.BOUNDS_MS] + ["+Inf"]
+        stats["buckets"] = dict(zip(labels, counts))
+        return stats
+
+
+class QdrantClient:
+    """
+    Qdrant REST client for one collection, one per worker process.
+
+    Requests go through a pooled keep-alive session with connect/read timeouts
+    and bounded retries (connection errors and 429/502/503/504, with backoff).
+    With batch_enabled, concurrent search() calls from the worker's threads are
+    combined into one /points/search/batch request by a MicroBatcher.
+    """
+
+    def __init__(self, collection_url, connect_timeout=2.0, read_timeout=10.0, retries=2, backoff=0.1,
+                 pool_size=10, batch_enabled=False, batch_max_size=16, batch_max_wait_ms=2.0):
+        self.collection_url = collection_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                      status_forcelist=RETRY_STATUSES, allowed_methods=frozenset(['GET', 'POST']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._errors = {}
+        self.batcher = None
+        if batch_enabled:
+            self.batcher = MicroBatcher(self._search_batch_items, max_batch_size=batch_max_size,
+                                        max_wait_ms=batch_max_wait_ms, name='qdrant-batcher')
+
+    def _histogram(self, name):
+        with self._lock:
+            histogram = self._latency.get(name)
+            if histogram is None:
+                histogram = self._latency[name] = LatencyHistogram()
+            return histogram
+
+    def request(self, name, method, path='', body=None):
+        """JSON response of one call; name labels its latency histogram"""
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, f"{self.collection_url}{path}",
+                data=serializers.dumps_json(body) if body is not None else None,
+                timeout=self.timeout)
+            if response.status_code >= 400:
+                raise QdrantError(response.status_code, error_message(response))
+            return response.json()
+        except Exception:
+            with self._lock:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._histogram(name).observe(elapsed)
+            metrics.observe('qdrant', elapsed)
+
+    def post(self, path, body, name=None):
+        return self.request(name or path.strip('/').replace('/', '_'), 'POST', path, body)
+
+    def collection_info(self):
+        return self.request('collection', 'GET')["result"]
+
+    def search(self, vector, top=5):
+        """Search response ({"result": [...], "status", "time"}) for one vector"""
+        if self.batcher is not None:
+            return self.batcher.submit((vector, top))
+        return self.post('/points/search', {"vector": vector, "top": top, "with_payload": True}, name='search')
+
+    def search_many(self, vectors, top=5):
+        """One search response per vector, in a single /points/search/batch call"""
+        return self._search_batch_items([(vector, top) for vector in vectors])
+
+    def _search_batch_items(self, items):
+        if not items:
+            return []
+        body = {"searches": [{"vector": vector, "limit": top, "with_payload": True} for vector, top in items]}
+        response = self.post('/points/search/batch', body, name='search_batch')
+        # Same shape as a /points/search response for each query
+        return [{"result": hits, "status": response.get("status"), "time": response.get("time")}
+                for hits in response["result"]]
+
+    def stats(self):
+        with self._lock:
+            latency = dict(self._latency)
+            errors = dict(self._errors)
+        return {
+            "collection_url": self.collection_url,
+            "latency": {name: histogram.stats() for name, histogram in latency.items()},
+            "errors": errors,
+            "batcher": self.batcher.stats() if self.batcher is not None else None,
+        }
+
+
+class AsyncQdrantClient(QdrantClient):
+    """
+    QdrantClient for the asyncio serving mode: the same calls as coroutines on
+    an httpx connection pool, with the same timeouts, retries and statistics.
+    Concurrent requests keep many searches in flight instead of batching them.
+    """
+
+    def __init__(self, collection_url, connect_timeout=2.0, read_timeout=10.0, retries=2, backoff=0.1,
+                 pool_size=10):
+        if httpx is None:
+            raise ImportError("The asyncio serving mode needs the httpx package")
+        self.collection_url = collection_url.rstrip('/')
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._errors = {}
+        self.batcher = None
+        self.retries = retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            headers={'Content-Type': 'application/json'},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size))
+
+    async def request(self, name, method, path='', body=None):
+        start = time.perf_counter()
+        data = serializers.dumps_json(body) if body is not None else None
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = await self.client.request(method, f"{self.collection_url}{path}", content=data)
+                    if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                        if response.status_code >= 400:
+                            raise QdrantError(response.status_code, error_message(response))
+                        return response.json()
+                except httpx.TransportError:
+                    if attempt == self.retries:
+                        raise
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+        except Exception:
+            with self._lock:
+                self._errors[name] = self._errors.get(name, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self._histogram(name).observe(elapsed)
+            metrics.observe('qdrant', elapsed)
+
+    async def post(self, path, body, name=None):
+        return await self.request(name or path.strip('/').replace('/', '_'), 'POST', path, body)
+
+    async def collection_info(self):
+        return (await self.request('collection', 'GET'))["result"]
+
+    async def search(self, vector, top=5):
+        return await self.post('/points/search', {"vector": vector, "top": top, "with_payload": True}, name='search')
+
+    async def search_many(self, vectors, top=5):
+        return await self._search_batch_items([(vector, top) for vector in vectors])
+
+    async def _search_batch_items(self, items):
+        if not items:
+            return []
+        body = {"searches": [{"vector": vector, "limit": top, "with_payload": True} for vector, top in items]}
+        response = await self.post('/points/search/batch', body, name='search_batch')
+        return [{"result": hits, "status": response.get("status"), "time": response.get("time")}
+                for hits in response["result"]]
+
+    async def close(self):
+        await self.client.aclose()
@@ -0,0 +1,187 @@
+import base64
+import json
+import struct
+
+import numpy as np
+
+# Optional: orjson serializes numpy arrays natively, much faster than tolist() + json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: msgpack response format
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Response formats for embeddings:
+#   json    - embedding as a list of numbers (default)
+#   base64  - JSON, embedding as base64 of little-endian values
+#   binary  - application/octet-stream frames (see pack_frame)
+#   msgpack - msgpack map, embedding as little-endian bytes
+FORMATS = ('json', 'base64', 'binary', 'msgpack')
+DTYPES = {'float32': '<f4', 'float16': '<f2'}
+
+MIMETYPES = {
+    'json': 'application/json',
+    'base64': 'application/json',
+    'binary': 'application/octet-stream',
+    'msgpack': 'application/msgpack',
+}
+# Streamed responses (one record per image)
+STREAM_MIMETYPES = dict(MIMETYPES, json='application/x-ndjson', base64='application/x-ndjson')
+
+# Accept header media types, in order of preference for */*
+_ACCEPT_FORMATS = [
+    ('application/json', 'json'),
+    ('application/x-ndjson', 'json'),
+    ('application/octet-stream', 'binary'),
+    ('application/msgpack', 'msgpack'),
+    ('application/x-msgpack', 'msgpack'),
+]
+
+# Binary frame: magic, version, dtype code, embedding dim, count; followed by
+# count uint32 statuses (200 = ok) and count x dim little-endian values, zeros
+# for failed items. A streamed response is a sequence of frames.
+FRAME_HEADER = struct.Struct('<4sBBHI')
+FRAME_MAGIC = b'FEMB'
+FRAME_VERSION = 1
+_DTYPE_CODES = {'float32': 0, 'float16': 1}
+_CODE_DTYPES = {code: name for name, code in _DTYPE_CODES.items()}
+
+
+class NotAcceptable(Exception):
+    """The requested response format cannot be produced"""
+
+
+class ResponseFormat:
+    def __init__(self, name='json', dtype='float32'):
+        self.name = name
+        self.dtype = dtype
+
+    @property
+    def mimetype(self):
+        return MIMETYPES[self.name]
+
+    @property
+    def stream_mimetype(self):
+        return STREAM_MIMETYPES[self.name]
+
+
+def negotiate(request, allowed=FORMATS):
+    """
+    Response format from the 'format' query parameter, else the Accept header.
+    'dtype' (float32 | float16) applies to the base64, binary and msgpack formats.
+    """
+    name = request.args.get('format')
+    if name is None:
+        mimetype = request.accept_mimetypes.best_match([m for m, _ in _ACCEPT_FORMATS])
+        # No usable Accept header keeps the legacy JSON response
+        name = dict(_ACCEPT_FORMATS).get(mimetype, 'json')
+    name = name.lower()
+    if name not in allowed:
+        raise NotAcceptable(f"Unsupported response format '{name}'. Use one of {allowed}")
+    if name == 'msgpack' and msgpack is None:
+        raise NotAcceptable("msgpack responses need the msgpack package")
+    dtype = request.args.get('dtype', 'float32').lower()
+    if dtype not in DTYPES:
+        raise NotAcceptable(f"Unsupported dtype '{dtype}'. Use one of {tuple(DTYPES)}")
+    return ResponseFormat(name, dtype)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(obj):
+    """
+    JSON bytes; numpy arrays and scalars are serialized directly. Compact with
+    sorted keys, the same layout as Flask's jsonify.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, default=_json_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def embedding_bytes(embedding, dtype='float32'):
+    return np.ascontiguousarray(embedding, dtype=DTYPES[dtype]).tobytes()
+
+
+def _encode_payload(payload, fmt):
+    """Copy of payload with its 'embedding' (and those of its 'faces') in the representation fmt uses"""
+    if fmt.name == 'json':
+        return payload
+    if payload.get('faces'):
+        payload = dict(payload, faces=[_encode_payload(face, fmt) for face in payload['faces']])
+    embedding = payload.get('embedding')
+    if embedding is None:
+        return payload
+    payload = dict(payload)
+    raw = embedding_bytes(embedding, fmt.dtype)
+    payload['embedding'] = base64.b64encode(raw).decode('ascii') if fmt.name == 'base64' else raw
+    payload['embedding_encoding'] = 'base64' if fmt.name == 'base64' else 'bytes'
+    payload['embedding_dtype'] = fmt.dtype
+    return payload
+
+
+def encode(payload, fmt):
+    """Response body for one payload dict; the binary format carries the embedding(s) only"""
+    if fmt.name == 'binary':
+        if 'faces' in payload:
+            return pack_frame([face['embedding'] for face in payload['faces']], dtype=fmt.dtype)
+        return pack_frame([payload['embedding']], dtype=fmt.dtype)
+    payload = _encode_payload(payload, fmt)
+    if fmt.name == 'msgpack':
+        return msgpack.packb(payload, default=_json_default)
+    return dumps_json(payload)
+
+
+def encode_records(records, fmt):
+    """
+    Body chunk for a streamed response: NDJSON lines, concatenated msgpack
+    objects, or one binary frame (records without an embedding get their status).
+    """
+    if fmt.name == 'binary':
+        embeddings = [r.get('embedding') for r in records]
+        statuses = [200 if r.get('embedding') is not None else r.get('status', 500) for r in records]
+        return pack_frame(embeddings, statuses, dtype=fmt.dtype)
+    if fmt.name == 'msgpack':
+        return b''.join(encode(r, fmt) for r in records)
+    return b''.join(encode(r, fmt) + b'\n' for r in records)
+
+
+def pack_frame(embeddings, statuses=None, dtype='float32'):
+    """One binary frame; None entries in embeddings are zero rows"""
+    count = len(embeddings)
+    dim = next((len(e) for e in embeddings if e is not None), 0)
+    if statuses is None:
+        statuses = [200 if e is not None else 500 for e in embeddings]
+    data = np.zeros((count, dim), dtype=DTYPES[dtype])
+    for i, embedding in enumerate(embeddings):
+        if embedding is not None:
+            data[i] = embedding
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, _DTYPE_CODES[dtype], dim, count)
+    return header + np.asarray(statuses, dtype='<u4').tobytes() + data.tobytes()
+
+
+def unpack_frames(buf):
+    """(statuses, embeddings) per frame of a binary response body, for clients"""
+    offset = 0
+    while offset < len(buf):
+        magic, version, code, dim, count = FRAME_HEADER.unpack_from(buf, offset)
+        if magic != FRAME_MAGIC or version != FRAME_VERSION:
+            raise ValueError("Not an embedding frame")
+        offset += FRAME_HEADER.size
+        statuses = np.frombuffer(buf, dtype='<u4', count=count, offset=offset)
+        offset += 4 * count
+        dtype = np.dtype(DTYPES[_CODE_DTYPES[code]])
+        embeddings = np.frombuffer(buf, dtype=dtype, count=count * dim, offset=offset).reshape(count, dim)
+        offset += dtype.itemsize * count * dim
+        yield statuses, embeddings
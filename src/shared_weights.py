@@ -0,0 +1,112 @@
+import glob
+import mmap
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Optional: re-lays the weights at page-aligned offsets. onnxruntime maps external
+# data only at aligned offsets; recent versions already write it that way.
+try:
+    import onnx
+except ImportError:
+    onnx = None
+
+# onnxruntime maps external data from offsets that are multiples of this
+ALIGNMENT = mmap.ALLOCATIONGRANULARITY
+# Smaller initializers stay inside the model file
+MIN_EXTERNAL_BYTES = 1024
+
+
+def shared_model_path(weights_dir, source_path, level_name, use_gpu=False):
+    """Path of the pre-optimized model built from source_path for this optimization level and device"""
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(weights_dir, f"{stem}.{level_name}.{'gpu' if use_gpu else 'cpu'}.onnx")
+
+
+def is_fresh(model_path, source_path):
+    return os.path.exists(model_path) and os.path.getmtime(model_path) >= os.path.getmtime(source_path)
+
+
+def align_external_data(model_file, weights_file):
+    """Rewrite weights_file with every tensor starting at an ALIGNMENT offset, updating model_file to match"""
+    model = onnx.load(model_file, load_external_data=False)
+    aligned_file = weights_file + '.aligned'
+    with open(weights_file, 'rb') as src, open(aligned_file, 'wb') as dst:
+        for tensor in model.graph.initializer:
+            if tensor.data_location != onnx.TensorProto.EXTERNAL:
+                continue
+            entries = {entry.key: entry for entry in tensor.external_data}
+            if 'offset' not in entries:
+                entries['offset'] = tensor.external_data.add()
+                entries['offset'].key = 'offset'
+                entries['offset'].value = '0'
+            src.seek(int(entries['offset'].value))
+            data = src.read(int(entries['length'].value))
+            offset = -(-dst.tell() // ALIGNMENT) * ALIGNMENT
+            dst.seek(offset)
+            dst.write(data)
+            entries['offset'].value = str(offset)
+    os.replace(aligned_file, weights_file)
+    onnx.save(model, model_file)
+
+
+def convert_onnx(source_path, model_path, level_name='all', use_gpu=False, gpu_id=0):
+    """
+    Optimize source_path once and save it as model_path plus a weights file next
+    to it. Sessions that load model_path without further optimization map the
+    weights read-only from the page cache, so all workers share one copy.
+    """
+    import onnxruntime as ort
+    from encoders import onnx_providers, ort_optimization_level
+
+    directory = os.path.dirname(model_path)
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.basename(model_path)
+    stem = os.path.splitext(name)[0]
+    # Named after the source version: a worker still mapping an older file keeps a consistent copy
+    weights_name = f"{stem}.{int(os.path.getmtime(source_path))}.weights"
+    # Built in a private directory and moved into place, so no worker loads a partial model
+    work = tempfile.mkdtemp(prefix='.convert-', dir=directory)
+    try:
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort_optimization_level(ort, level_name)
+        opts.optimized_model_filepath = os.path.join(work, name)
+        opts.add_session_config_entry('session.optimized_model_external_initializers_file_name', weights_name)
+        opts.add_session_config_entry('session.optimized_model_external_initializers_min_size_in_bytes',
+                                      str(MIN_EXTERNAL_BYTES))
+        ort.InferenceSession(source_path, sess_options=opts, providers=onnx_providers(ort, use_gpu, gpu_id))
+        if onnx is not None:
+            align_external_data(os.path.join(work, name), os.path.join(work, weights_name))
+        os.replace(os.path.join(work, weights_name), os.path.join(directory, weights_name))
+        os.replace(os.path.join(work, name), model_path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    # Unlinking is safe for workers that still map an older version
+    for stale in glob.glob(os.path.join(directory, f"{glob.escape(stem)}.*.weights")):
+        if os.path.basename(stale) != weights_name:
+            os.remove(stale)
+    print(f"Process {os.getpid()}: shared weights for {source_path} written to {directory}")
+
+
+def prepare_onnx(config, source_path, spawn=False):
+    """
+    Path of the shared pre-optimized model for source_path, converting it first
+    if it is missing or older than the source. spawn=True converts in a fresh
+    process, so the gunicorn master never loads onnxruntime before it forks.
+    """
+    level_name = config.get('ORT_GRAPH_OPT_LEVEL', 'all')
+    use_gpu = config.get('USE_GPU', False)
+    model_path = shared_model_path(config.get('SHARED_WEIGHTS_DIR'), source_path, level_name, use_gpu)
+    if is_fresh(model_path, source_path):
+        return model_path
+    args = (source_path, model_path, level_name, use_gpu, config.get('GPU_ID', 0))
+    if not spawn:
+        convert_onnx(*args)
+        return model_path
+    process = multiprocessing.get_context('spawn').Process(target=convert_onnx, args=args, name='shared-weights')
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"Shared weights conversion of {source_path} failed (exit code {process.exitcode})")
+    return model_path
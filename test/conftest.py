@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The service modules are flat files in src/, imported the way the app imports them;
+# bench/ holds the stand-in servers and models
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'bench'))
+
+
+@pytest.fixture
+def face_service(tmp_path, monkeypatch):
+    """
+    Factory for the app's FaceEmbeddingService on the onnxruntime backend with the
+    bench stand-in model; the service is installed as the Flask app's instance.
+    """
+    pytest.importorskip('onnx')
+    pytest.importorskip('onnxruntime')
+    import app as wsgi_app
+    from stages import make_standin_model
+
+    model_path = make_standin_model(str(tmp_path / 'standin.onnx'))
+
+    def make(**overrides):
+        config = {'INFERENCE_BACKEND': 'onnxruntime', 'ONNX_MODEL_PATH': model_path, 'ONNX_MODEL_VARIANT': 'fp32',
+                  'USE_GPU': False, 'FLIP_TTA': 'off', 'FTP_POOL_MAX_IDLE': 0,
+                  'QDRANT_URL': 'http://127.0.0.1:9/collections/f4r/points/search'}
+        config.update(overrides)
+        service = wsgi_app.FaceEmbeddingService(config)
+        monkeypatch.setattr(wsgi_app.get_face_service, '_instance', service, raising=False)
+        return service
+
+    return make
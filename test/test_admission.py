@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+import admission
+from admission import AdmissionController, Overloaded
+
+
+def test_rejects_beyond_in_flight_and_queue():
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    controller.acquire()
+    with pytest.raises(Overloaded):
+        controller.acquire()
+    controller.release()
+    controller.acquire()
+    stats = controller.stats()
+    assert (stats["admitted"], stats["rejected"], stats["in_flight"]) == (2, 1, 1)
+
+
+def test_queued_request_gets_the_released_slot():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5.0)
+    controller.acquire()
+    admitted = threading.Event()
+    waiter = threading.Thread(target=lambda: (controller.acquire(), admitted.set()))
+    waiter.start()
+    time.sleep(0.05)
+    assert not admitted.is_set()
+    controller.release()
+    waiter.join(2.0)
+    assert admitted.is_set()
+
+
+def test_queue_wait_ends_at_the_deadline():
+    controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=5.0)
+    controller.acquire()
+    start = time.perf_counter()
+    with pytest.raises(Overloaded):
+        controller.acquire(deadline=start + 0.05)
+    assert time.perf_counter() - start < 1.0
+    assert controller.stats()["timed_out"] == 1
+
+
+def test_parse_request_start():
+    assert admission.parse_request_start('t=1700000000.5') == 1700000000.5
+    assert admission.parse_request_start('1700000000500') == pytest.approx(1700000000.5)
+    assert admission.parse_request_start('1700000000500000') == pytest.approx(1700000000.5)
+    assert admission.parse_request_start('soon') is None
+    assert admission.parse_request_start(None) is None
+
+
+def test_deadline_from_headers():
+    try:
+        deadline = admission.start_request(None, '50', default_timeout_ms=1000)
+        assert 0 < deadline - time.perf_counter() <= 0.05
+        admission.check_deadline('decode')
+        time.sleep(0.06)
+        with pytest.raises(admission.DeadlineExceeded):
+            admission.check_deadline('decode')
+        # The client cannot ask for more than the server allows
+        deadline = admission.start_request(None, '60000', default_timeout_ms=1000)
+        assert deadline - time.perf_counter() <= 1.0
+    finally:
+        admission.end_request()
+    assert admission.remaining() is None
+
+
+def test_request_queued_too_long_is_shed():
+    with pytest.raises(Overloaded):
+        admission.start_request(f"t={time.time() - 2:.3f}", None, max_queue_ms=500)
+    assert admission.remaining() is None
@@ -0,0 +1,45 @@
+import numpy as np
+
+from ann_index import IVFIndex
+
+
+def clustered(n=2000, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, dim))
+    return (centers[rng.integers(0, 20, n)] + 0.1 * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def exact_top(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k]
+
+
+def test_search_with_every_list_probed_is_exact():
+    vectors = clustered()
+    index = IVFIndex.build(vectors, np.arange(len(vectors)), nlist=16, nprobe=16)
+    for query in vectors[:5] + 0.05:
+        labels, scores = index.search(query, k=10)
+        assert labels.tolist() == exact_top(vectors, query, 10).tolist()
+        assert np.all(np.diff(scores) <= 0)
+
+
+def test_add_and_remove():
+    vectors = clustered()
+    index = IVFIndex.build(vectors, np.arange(len(vectors)), nlist=16, nprobe=16)
+    index.remove([0])
+    assert 0 not in index.search(vectors[0], k=5)[0]
+    index.add(vectors[:1], [5000])
+    assert index.search(vectors[0], k=1)[0][0] == 5000
+    assert len(index) == len(vectors)
+
+
+def test_save_and_load_keeps_pending_changes(tmp_path):
+    vectors = clustered()
+    index = IVFIndex.build(vectors, np.arange(len(vectors)), nlist=16, nprobe=4)
+    index.remove([1])
+    index.add(vectors[1:2], [7000])
+    index.save(str(tmp_path / 'ivf'))
+    loaded = IVFIndex.load(str(tmp_path / 'ivf'))
+    assert len(loaded) == len(vectors)
+    assert loaded.nprobe == 4
+    assert loaded.search(vectors[1], k=1)[0][0] == 7000
@@ -0,0 +1,87 @@
+import io
+import json
+import marshal
+
+import cv2
+import numpy as np
+import pytest
+
+import app as wsgi_app
+import metrics
+
+
+@pytest.fixture
+def client():
+    return wsgi_app.app.test_client()
+
+
+@pytest.mark.skipif(not metrics.ENABLED, reason="prometheus_client not installed")
+def test_metrics_content_type_has_one_charset(client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == metrics.prometheus_client.CONTENT_TYPE_LATEST
+
+
+def parse(max_faces=3, query='', form=None, json=None):
+    kwargs = {'data': form} if form is not None else {'json': json} if json is not None else {}
+    with wsgi_app.app.test_request_context(f'/embed{query}', method='POST', **kwargs):
+        from flask import request
+        return wsgi_app.parse_faces_params(request, request.get_json(silent=True) if request.is_json else None,
+                                           max_faces)
+
+
+def test_parse_faces_params():
+    assert parse() == (False, None)
+    assert parse(query='?faces=all') == (True, None)
+    assert parse(form={'faces': 'all'}) == (True, None)
+    assert parse(json={'faces': 'one', 'image_path': 'x'}) == (False, None)
+    assert parse(json={'boxes': [[0, 0, 10, 10.5]]}) == (True, [[0, 0, 10, 10.5]])
+    assert parse(form={'boxes': '[[1, 2, 3, 4], [5, 6, 7, 8]]'}) == (True, [[1, 2, 3, 4], [5, 6, 7, 8]])
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'query': '?faces=some'}, "Invalid 'faces'"),
+    ({'form': {'boxes': '[[1, 2, 3'}}, "Invalid 'boxes'"),
+    ({'json': {'boxes': [[1, 2, 3]]}}, "Invalid 'boxes'"),
+    ({'json': {'boxes': [[1, 2, 3, '4']]}}, "Invalid 'boxes'"),
+    ({'json': {'boxes': [[True, 2, 3, 4]]}}, "Invalid 'boxes'"),
+    ({'json': {'boxes': {'x1': 1}}}, "Invalid 'boxes'"),
+    ({'json': {'boxes': [[0, 0, 1, 1]] * 4}}, "Too many boxes"),
+    ({'json': {'boxes': [[0, 0, 10, 10], [10, 0, 10, 10]]}}, "Invalid box 1"),
+    ({'json': {'boxes': [[0, 20, 10, 5]]}}, "Invalid box 0"),
+])
+def test_parse_faces_params_rejects(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        parse(**kwargs)
+
+
+def test_boxes_outside_the_image_are_rejected(face_service):
+    face_service()
+    image = cv2.imencode('.jpg', np.full((100, 200, 3), 128, np.uint8))[1].tobytes()
+    client = wsgi_app.app.test_client()
+
+    def embed(boxes):
+        return client.post('/embed', data={'image': (io.BytesIO(image), 'group.jpg'), 'boxes': json.dumps(boxes)},
+                           content_type='multipart/form-data')
+
+    response = embed([[10, 10, 60, 60], [150, 50, 400, 300]])
+    assert response.status_code == 200
+    assert [face["box"] for face in response.get_json()["faces"]] == [[10, 10, 60, 60], [150, 50, 400, 300]]
+    for boxes in ([[10, 10, 60, 60], [200, 0, 260, 50]], [[-50, -50, 0, 40]], [[5.2, 5, 5.9, 40]]):
+        response = embed(boxes)
+        assert response.status_code == 400
+        assert "does not cover any pixel of the 200x100 image" in response.get_json()["error"]
+
+
+def test_debug_profile_pstats(monkeypatch, client):
+    monkeypatch.setitem(wsgi_app.app.config, 'DEBUG_PROFILE_TOKEN', 'secret')
+    assert client.get('/debug/profile?seconds=0.05').status_code == 401
+    headers = {'Authorization': 'Bearer secret'}
+    response = client.get('/debug/profile?seconds=0.05&format=pstats', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/octet-stream'
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert isinstance(marshal.loads(response.data), dict)
+    response = client.get('/debug/profile?seconds=0.05&format=top', headers=headers)
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert client.get('/debug/profile?seconds=0.05&format=svg', headers=headers).status_code == 400
@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+from batcher import MicroBatcher
+
+
+def submit_all(batcher, items):
+    """Submit items from one thread each; returns per-item results or exceptions"""
+    outcomes = [None] * len(items)
+
+    def worker(i):
+        try:
+            outcomes[i] = batcher.submit(items[i], timeout=5)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return outcomes
+
+
+def test_concurrent_submits_merge_up_to_max_batch_size():
+    started = threading.Event()
+    release = threading.Event()
+    sizes = []
+
+    def batch_fn(items):
+        sizes.append(len(items))
+        started.set()
+        release.wait(5)
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=4, max_wait_ms=200)
+    # The first item occupies the batch thread while the other nine queue up behind it
+    first = threading.Thread(target=batcher.submit, args=(0,))
+    first.start()
+    assert started.wait(5)
+    outcomes = []
+    rest = threading.Thread(target=lambda: outcomes.extend(submit_all(batcher, list(range(1, 10)))))
+    rest.start()
+    deadline = time.monotonic() + 5
+    while batcher.stats()["queue_depth"] < 9 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    release.set()
+    rest.join()
+    first.join()
+    assert outcomes == [i * 10 for i in range(1, 10)]
+    assert sizes == [1, 4, 4, 1]
+    stats = batcher.stats()
+    assert (stats["batches"], stats["items"]) == (4, 10)
+    assert stats["max_queue_depth"] >= 9
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    batcher = MicroBatcher(lambda items: [item + 1 for item in items], max_batch_size=8, max_wait_ms=20)
+    start = time.monotonic()
+    assert batcher.submit(1, timeout=5) == 2
+    elapsed = time.monotonic() - start
+    assert 0.015 <= elapsed < 1.0
+    assert batcher.stats()["batch_size_histogram"] == {1: 1}
+
+
+def test_results_come_back_in_submission_order():
+    batcher = MicroBatcher(lambda items: [str(item) for item in items], max_batch_size=16, max_wait_ms=50)
+    assert submit_all(batcher, list(range(12))) == [str(i) for i in range(12)]
+
+
+def test_encoder_error_reaches_every_caller_in_the_batch():
+    def batch_fn(items):
+        raise ValueError("forward failed")
+
+    batcher = MicroBatcher(batch_fn, max_batch_size=8, max_wait_ms=50)
+    outcomes = submit_all(batcher, list(range(5)))
+    assert all(isinstance(outcome, ValueError) and str(outcome) == "forward failed" for outcome in outcomes)
+    # The batch thread survives the error
+    batcher.batch_fn = lambda items: items
+    assert batcher.submit(7, timeout=5) == 7
+
+
+def test_submit_times_out_when_no_result_arrives():
+    release = threading.Event()
+    batcher = MicroBatcher(lambda items: release.wait(5) and items, max_batch_size=1, max_wait_ms=0)
+    with pytest.raises(TimeoutError):
+        batcher.submit(1, timeout=0.05)
+    release.set()
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+import pytest
+
+import image_decode
+from decode_pool import DecodePool
+
+
+def encoded(width, height, seed, ext='.jpg'):
+    img = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(ext, img)[1].tobytes()
+
+
+@pytest.fixture(scope='module')
+def pool():
+    # Fewer slots than images, so slots are recycled within one decode_many call
+    pool = DecodePool(workers=2, queue_size=2, queue_timeout=30.0)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope='module')
+def raws():
+    # Small, exact-size and large (reduced-scale) JPEGs, a PNG, and bytes that are no image
+    return [encoded(64, 48, 0), encoded(112, 112, 1), encoded(1600, 1200, 2), encoded(2000, 900, 3),
+            encoded(300, 500, 4, '.png'), b'not an image', encoded(640, 480, 5)]
+
+
+def test_decode_many_matches_in_process_decode(pool, raws):
+    results = pool.decode_many(raws)
+    assert len(results) == len(raws)
+    for raw, face in zip(raws, results):
+        expected = image_decode.decode_face(raw, 112, reduced=True)
+        if expected is None:
+            assert face is None
+        else:
+            assert face.shape == (112, 112, 3) and face.dtype == np.uint8
+            np.testing.assert_array_equal(face, expected)
+    stats = pool.stats()
+    assert stats["in_flight"] == 0
+    assert stats["failed"] >= 1
+
+
+def test_decode_returns_a_copy_of_its_slot(pool, raws):
+    first = pool.decode(raws[0])
+    second = pool.decode(raws[2])
+    # Both used slots of the same two-slot array; the first result is not overwritten
+    np.testing.assert_array_equal(first, image_decode.decode_face(raws[0], 112))
+    np.testing.assert_array_equal(second, image_decode.decode_face(raws[2], 112))
+    assert pool.decode(b'\x00' * 10) is None
+    assert pool.stats()["in_flight"] == 0
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def test_memory_lru_evicts_least_recently_used():
+    cache = EmbeddingCache(max_entries=2)
+    a, b, c = (cache.key(raw) for raw in (b'a', b'b', b'c'))
+    cache.put(a, np.ones(4))
+    cache.put(b, np.ones(4) * 2)
+    assert cache.get(a) is not None
+    cache.put(c, np.ones(4) * 3)
+    assert cache.get(b) is None
+    assert cache.get(a).tolist() == [1, 1, 1, 1]
+    assert cache.stats()["memory_evictions"] == 1
+
+
+def test_keys_depend_on_version():
+    assert EmbeddingCache(version='m1').key(b'x') != EmbeddingCache(version='m2').key(b'x')
+    assert EmbeddingCache(version='m1').key(b'x') == EmbeddingCache(version='m1').key(b'x')
+
+
+def test_disk_tier_is_shared_and_promoted(tmp_path):
+    writer = EmbeddingCache(max_entries=10, disk_dir=str(tmp_path))
+    key = writer.key(b'image')
+    writer.put(key, np.arange(3, dtype=np.float32))
+    reader = EmbeddingCache(max_entries=10, disk_dir=str(tmp_path))
+    embedding = reader.get(key)
+    assert embedding.tolist() == [0, 1, 2]
+    assert not embedding.flags.writeable
+    reader.get(key)
+    stats = reader.stats()
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+
+
+def test_disk_tier_pruned_to_max_entries(tmp_path):
+    cache = EmbeddingCache(max_entries=0, disk_dir=str(tmp_path), disk_max_entries=5)
+    for i in range(12):
+        cache.put(cache.key(str(i).encode()), np.ones(2))
+    cache._prune_disk()
+    assert sum(len(files) for _, _, files in os.walk(tmp_path)) == 5
+    assert cache.stats()["disk_evictions"] == 7
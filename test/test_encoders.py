@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from encoders import MyEncoder, OnnxEncoder, bind_bucketed_modules
+
+EMBEDDING_SIZE = 8
+
+
+def faces(n, seed=0):
+    return list(np.random.default_rng(seed).integers(0, 256, (n, 112, 112, 3), dtype=np.uint8))
+
+
+def weights(seed=1):
+    """Tiny linear encoder over the whole face, so it is sensitive to flips and row order"""
+    return (np.random.default_rng(seed).standard_normal((3 * 112 * 112, EMBEDDING_SIZE)) * 1e-3).astype(np.float32)
+
+
+def reference(images, w, flip):
+    data = np.stack(images).transpose(0, 3, 1, 2).astype(np.float32)
+    out = data.reshape(len(images), -1) @ w
+    if flip:
+        out = out + data[:, :, :, ::-1].reshape(len(images), -1) @ w
+    return out
+
+
+@pytest.fixture
+def mx_modules(tmp_path):
+    mx = pytest.importorskip('mxnet')
+    w = weights()
+    data = mx.sym.Variable('data')
+    sym = mx.sym.FullyConnected(mx.sym.Flatten(data), num_hidden=EMBEDDING_SIZE, no_bias=True, name='fc1')
+    params_file = str(tmp_path / 'tiny-0000.params')
+    mx.nd.save(params_file, {'arg:fc1_weight': mx.nd.array(w.T)})
+    return mx, w, bind_bucketed_modules(sym, mx.cpu(), params_file, [1, 2, 4, 8])
+
+
+def test_padded_bucket_matches_unbatched_forward(mx_modules):
+    mx, w, modules = mx_modules
+    images = faces(3)
+    encoder = MyEncoder(modules, batch_size=8, context=mx.cpu(), flip_mode='off')
+    # Three images run in the 4 bucket with a padded row
+    batched = encoder.compute_embedding_images(images)
+    unbatched = encoder.compute_embedding_images(images, batch_size=1)
+    np.testing.assert_allclose(batched, unbatched, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(batched, reference(images, w, flip=False), rtol=1e-4, atol=1e-3)
+
+
+def test_smaller_buckets_share_the_largest_parameters(mx_modules):
+    mx, w, modules = mx_modules
+    images = faces(1)
+    encoder = MyEncoder(modules, batch_size=1, context=mx.cpu(), flip_mode='off')
+    # Parameters set on the largest bucket are what the 1 bucket runs with
+    modules[8].set_params({'fc1_weight': mx.nd.array(2 * w.T)}, {}, force_init=True)
+    np.testing.assert_allclose(encoder.compute_embedding_images(images),
+                               reference(images, 2 * w, flip=False), rtol=1e-4, atol=1e-3)
+
+
+@pytest.mark.parametrize('n', [1, 3, 5])
+def test_mxnet_fused_flip_matches_sequential(mx_modules, n):
+    mx, w, modules = mx_modules
+    images = faces(n)
+    encoder = MyEncoder(modules, batch_size=4, context=mx.cpu(), flip_mode='sequential')
+    sequential = encoder.compute_embedding_images(images)
+    fused = encoder.compute_embedding_images(images, flip='fused')
+    np.testing.assert_allclose(fused, sequential, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(sequential, reference(images, w, flip=True), rtol=1e-4, atol=1e-3)
+
+
+def onnx_session(tmp_path, w, batch_dim):
+    onnx = pytest.importorskip('onnx')
+    ort = pytest.importorskip('onnxruntime')
+    from onnx import TensorProto, helper, numpy_helper
+    graph = helper.make_graph(
+        [helper.make_node('Flatten', ['data'], ['flat']),
+         helper.make_node('MatMul', ['flat', 'fc1_w'], ['fc1_output'])],
+        'tiny',
+        [helper.make_tensor_value_info('data', TensorProto.FLOAT, [batch_dim, 3, 112, 112])],
+        [helper.make_tensor_value_info('fc1_output', TensorProto.FLOAT, [batch_dim, EMBEDDING_SIZE])],
+        [numpy_helper.from_array(w, 'fc1_w')])
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    path = str(tmp_path / 'tiny.onnx')
+    onnx.save(model, path)
+    return ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+
+
+@pytest.mark.parametrize('batch_dim', ['N', 2])
+@pytest.mark.parametrize('n', [1, 3])
+def test_onnx_fused_flip_matches_sequential(tmp_path, batch_dim, n):
+    w = weights()
+    images = faces(n)
+    encoder = OnnxEncoder(onnx_session(tmp_path, w, batch_dim), batch_size=4, flip_mode='sequential')
+    sequential = encoder.compute_embedding_images(images)
+    fused = encoder.compute_embedding_images(images, flip='fused')
+    np.testing.assert_allclose(fused, sequential, rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(sequential, reference(images, w, flip=True), rtol=1e-4, atol=1e-3)
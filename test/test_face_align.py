@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import face_align
+
+skimage_transform = pytest.importorskip('skimage.transform')
+from aligner import FaceAligner  # noqa: E402  (test/aligner.py, the skimage-based reference)
+
+# The reference implementation uses SimilarityTransform.estimate, deprecated in recent scikit-image
+pytestmark = pytest.mark.filterwarnings('ignore::FutureWarning')
+
+
+def random_landmarks(n, seed=0):
+    """Template landmarks under random similarity transforms plus noise, and a few arbitrary point sets"""
+    rng = np.random.default_rng(seed)
+    angles = rng.uniform(-np.pi, np.pi, n)
+    scales = rng.uniform(0.3, 5.0, n)
+    rotations = np.stack([np.cos(angles), -np.sin(angles), np.sin(angles), np.cos(angles)], axis=1).reshape(n, 2, 2)
+    landmarks = np.einsum('nij,kj->nki', rotations * scales[:, None, None], face_align.REFERENCE_LANDMARKS)
+    landmarks += rng.uniform(0, 600, (n, 1, 2)) + rng.normal(0, 3, (n, 5, 2))
+    landmarks[: n // 4] = rng.uniform(0, 640, (n // 4, 5, 2))
+    return landmarks.astype(np.float32)
+
+
+def skimage_matrix(src, dst):
+    tform = skimage_transform.SimilarityTransform()
+    assert tform.estimate(src, dst)
+    return tform.params[:2]
+
+
+def test_estimate_similarity_matches_skimage():
+    landmarks = random_landmarks(64)
+    dst = face_align.reference_landmarks()
+    matrices = face_align.estimate_similarity(landmarks, dst)
+    assert matrices.shape == (64, 2, 3)
+    for src, matrix in zip(landmarks, matrices):
+        np.testing.assert_allclose(matrix, skimage_matrix(src, dst), rtol=1e-5, atol=1e-5)
+
+
+def test_align_and_crop_match_face_aligner():
+    rng = np.random.default_rng(1)
+    img = rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    aligner = FaceAligner(image_size=112)
+    landmarks = random_landmarks(8, seed=2)[2:]
+    crops = face_align.align_faces(img, landmarks)
+    for landmark, crop in zip(landmarks, crops):
+        expected = aligner.preprocess(img, landmark=landmark)
+        # Matrices agree to float rounding, so at most a rare pixel differs by one level
+        assert np.abs(crop.astype(np.int16) - expected).max() <= 1
+
+    boxes = [[100, 100, 300, 300], [600, 400, 700, 520], [-20, -10, 50, 60], [300, 200, 300, 260], [10, 10, 11, 12]]
+    for margin in (0.0, 0.2):
+        aligner = FaceAligner(image_size=112, margin=margin)
+        crops = face_align.crop_faces(img, boxes, margin=margin)
+        for box, crop in zip(boxes, crops):
+            np.testing.assert_array_equal(crop, aligner.crop_image(img, box))
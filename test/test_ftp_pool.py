@@ -0,0 +1,80 @@
+import ftplib
+import socket
+
+import pytest
+
+from fake_ftp import FakeFTP
+from ftp_pool import FTPPool
+
+FILES = {'/a.jpg': b'a' * 1000, '/b.jpg': b'b' * 70000, '/c.jpg': b'c'}
+
+
+@pytest.fixture
+def server():
+    fake = FakeFTP(FILES)
+    host, port = fake.serve()
+    fake.base = f"ftp://{host}:{port}"
+    yield fake
+    fake.shutdown()
+
+
+@pytest.fixture
+def pool():
+    pool = FTPPool(max_idle=2, idle_timeout=60.0, health_check_interval=60.0, timeout=5.0)
+    yield pool
+    pool.close()
+
+
+def test_session_is_reused_across_fetches(server, pool):
+    assert pool.retrieve(f"{server.base}/a.jpg") == FILES['/a.jpg']
+    assert pool.retrieve(f"{server.base}/b.jpg") == FILES['/b.jpg']
+    assert (server.counters["connections"], server.counters["logins"], server.counters["retrs"]) == (1, 1, 2)
+    stats = pool.stats()
+    assert (stats["connects"], stats["reuses"]) == (1, 1)
+    assert sum(stats["idle"].values()) == 1
+
+
+def test_retrieve_many_uses_one_session_per_host(server, pool):
+    urls = [f"{server.base}{path}" for path in ('/a.jpg', '/missing.jpg', '/b.jpg', '/c.jpg')] + ['http://x/y.jpg']
+    results = pool.retrieve_many(urls, 'user', 'secret')
+    assert results[0] == FILES['/a.jpg'] and results[2] == FILES['/b.jpg'] and results[3] == FILES['/c.jpg']
+    # 550 leaves the session usable; a non-FTP URL fails on its own
+    assert isinstance(results[1], ftplib.error_perm)
+    assert isinstance(results[4], ValueError)
+    assert server.counters["connections"] == 1
+    assert pool.stats()["idle"] == {f"127.0.0.1:{server.server.server_address[1]}:user": 1}
+
+
+def test_idle_session_is_checked_with_noop(server):
+    pool = FTPPool(max_idle=2, health_check_interval=0.0, timeout=5.0)
+    try:
+        pool.retrieve(f"{server.base}/a.jpg")
+        pool.retrieve(f"{server.base}/a.jpg")
+        assert server.counters["noops"] == 1
+        assert server.counters["connections"] == 1
+        # A session the server dropped fails its check and is replaced
+        server.disconnect_all()
+        assert pool.retrieve(f"{server.base}/c.jpg") == FILES['/c.jpg']
+        stats = pool.stats()
+        assert (stats["health_checks"], stats["health_check_failures"], stats["connects"]) == (2, 1, 2)
+    finally:
+        pool.close()
+
+
+def test_broken_reused_session_is_retried_once(server, pool):
+    pool.retrieve(f"{server.base}/a.jpg")
+    # Without a health check the dropped session is only noticed by RETR
+    server.disconnect_all()
+    assert pool.retrieve(f"{server.base}/b.jpg") == FILES['/b.jpg']
+    stats = pool.stats()
+    assert (stats["retries"], stats["connects"], stats["discarded"]) == (1, 2, 1)
+
+
+def test_new_session_failure_is_not_retried(pool):
+    # A port nothing listens on: the first connection fails and there is no earlier session to blame
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    with pytest.raises(OSError):
+        pool.retrieve(f"ftp://127.0.0.1:{port}/a.jpg")
+    assert pool.stats()["retries"] == 0
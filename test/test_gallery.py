@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from gallery import LocalGallery
+
+
+class StubQdrant:
+    """The QdrantClient calls LocalGallery makes, over an in-memory collection"""
+
+    def __init__(self, points=(), size=4):
+        self.size = size
+        self.points = dict(points)
+
+    def collection_info(self):
+        return {"config": {"params": {"vectors": {"size": self.size, "distance": "Cosine"}}}}
+
+    def post(self, path, body):
+        if path == '/points/scroll':
+            points = [{"id": i, "payload": {"uid": str(i)},
+                       "vector": list(v) if body.get("with_vector") else None} for i, v in sorted(self.points.items())]
+            return {"result": {"points": points, "next_page_offset": None}}
+        if path == '/points':
+            return {"result": [{"id": i, "vector": list(self.points[i])} for i in body["ids"] if i in self.points]}
+        raise AssertionError(path)
+
+
+def make_gallery(tmp_path, qdrant):
+    return LocalGallery('http://qdrant/collections/test', str(tmp_path), refresh_interval=0, qdrant=qdrant)
+
+
+def test_empty_collection_loads_and_returns_no_hits(tmp_path):
+    gallery = make_gallery(tmp_path, StubQdrant())
+    assert gallery.stats()["points"] == 0
+    assert gallery.stats()["last_refresh_error"] is None
+    assert gallery.search([1.0, 0.0, 0.0, 0.0], top=5)["result"] == []
+
+
+def test_incremental_refresh_from_and_to_empty(tmp_path):
+    qdrant = StubQdrant()
+    gallery = make_gallery(tmp_path, qdrant)
+    qdrant.points = {1: [1.0, 0.0, 0.0, 0.0], 2: [0.0, 2.0, 0.0, 0.0]}
+    gallery.refresh()
+    hits = gallery.search([0.0, 1.0, 0.0, 0.0], top=5)["result"]
+    assert [h["id"] for h in hits] == [2, 1]
+    assert hits[0]["score"] == pytest.approx(1.0)
+    qdrant.points = {}
+    gallery.refresh()
+    assert gallery.search([0.0, 1.0, 0.0, 0.0], top=5)["result"] == []
+    assert gallery.stats()["points"] == 0
+    qdrant.points = {3: [0.0, 0.0, 1.0, 0.0]}
+    gallery.refresh()
+    assert [h["id"] for h in gallery.search([0.0, 0.0, 1.0, 0.0])["result"]] == [3]
+
+
+def test_search_many_orders_by_cosine(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((20, 4))
+    gallery = make_gallery(tmp_path, StubQdrant({i: v.tolist() for i, v in enumerate(vectors)}))
+    queries = rng.standard_normal((3, 4))
+    results = gallery.search_many(queries, top=3)
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    for query, result in zip(queries, results):
+        expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:3]
+        assert [h["id"] for h in result["result"]] == expected.tolist()
+
+
+def test_unavailable_gallery_is_a_server_error(tmp_path):
+    qdrant = StubQdrant()
+    qdrant.collection_info = lambda: {"config": {"params": {"vectors": {"size": 4, "distance": "Dot"}}}}
+    gallery = make_gallery(tmp_path, qdrant)
+    with pytest.raises(RuntimeError, match="Local gallery unavailable"):
+        gallery.search([1.0, 0.0, 0.0, 0.0])
@@ -0,0 +1,56 @@
+import struct
+
+import cv2
+import numpy as np
+
+import image_decode
+
+
+def jpeg(width, height, orientation=None):
+    img = np.zeros((height, width, 3), np.uint8)
+    img[:, :width // 2] = 255
+    buf = cv2.imencode('.jpg', img)[1].tobytes()
+    if orientation is None:
+        return buf
+    # APP1 Exif segment with a single Orientation (0x0112) entry, inserted after SOI
+    tiff = b'II*\x00' + struct.pack('<I', 8) + struct.pack('<H', 1) \
+        + struct.pack('<HHIHH', 0x0112, 3, 1, orientation, 0) + struct.pack('<I', 0)
+    payload = b'Exif\x00\x00' + tiff
+    return buf[:2] + b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload + buf[2:]
+
+
+def test_read_jpeg_size():
+    assert image_decode.read_jpeg_size(jpeg(640, 480)) == (640, 480)
+    assert image_decode.read_jpeg_size(jpeg(640, 480, orientation=6)) == (640, 480)
+    assert image_decode.read_jpeg_size(cv2.imencode('.png', np.zeros((4, 4, 3), np.uint8))[1].tobytes()) is None
+    assert image_decode.read_jpeg_size(b'\xff\xd8') is None
+
+
+def test_choose_reduction():
+    assert image_decode.choose_reduction(1600, 800, 112) == 4
+    assert image_decode.choose_reduction(1600, 1600, 112) == 8
+    assert image_decode.choose_reduction(300, 300, 112) == 2
+    assert image_decode.choose_reduction(200, 200, 112) == 1
+
+
+def test_reduced_decode_scale():
+    img, scale = image_decode.decode_image_scaled(jpeg(1600, 800), min_size=112)
+    assert img.shape[:2] == (200, 400)
+    assert scale == 4.0
+
+
+def test_reduced_decode_scale_with_exif_rotation():
+    # Orientation 6: decoded upright as 800 wide, 1600 high
+    img, scale = image_decode.decode_image_scaled(jpeg(1600, 800, orientation=6), min_size=112)
+    assert img.shape[:2] == (400, 200)
+    assert scale == 4.0
+    full, full_scale = image_decode.decode_image_scaled(jpeg(1600, 800, orientation=6), reduced=False)
+    assert full.shape[:2] == (1600, 800)
+    assert full_scale == 1.0
+
+
+def test_non_jpeg_decodes_at_full_size():
+    png = cv2.imencode('.png', np.zeros((300, 500, 3), np.uint8))[1].tobytes()
+    img, scale = image_decode.decode_image_scaled(png, min_size=112)
+    assert img.shape[:2] == (300, 500)
+    assert scale == 1.0
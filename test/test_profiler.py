@@ -0,0 +1,66 @@
+import pstats
+import threading
+import time
+
+import pytest
+
+from profiler import SamplingProfiler
+
+
+def _waiting_thread():
+    done = threading.Event()
+    thread = threading.Thread(target=done.wait, name='waiter', daemon=True)
+    thread.start()
+    return done, thread
+
+
+def test_idle_waits_are_excluded_by_default():
+    done, thread = _waiting_thread()
+    try:
+        profile = SamplingProfiler(0.005, exclude_threads={threading.get_ident()}).run(0.1)
+    finally:
+        done.set()
+        thread.join()
+    assert profile.idle > 0
+    assert not any(stack[0] == 'waiter' for stack in profile.stacks)
+    assert "idle thread samples excluded" in profile.top()
+
+
+def test_include_idle_keeps_waiting_threads():
+    done, thread = _waiting_thread()
+    try:
+        profile = SamplingProfiler(0.005, exclude_threads={threading.get_ident()}, include_idle=True).run(0.1)
+    finally:
+        done.set()
+        thread.join()
+    assert profile.idle == 0
+    assert any(stack[0] == 'waiter' and stack[-1][2] == 'wait' for stack in profile.stacks)
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(200))
+
+
+def _caller(seconds):
+    _busy(seconds)
+
+
+def test_pstats_output_loads_with_pstats(tmp_path):
+    thread = threading.Thread(target=_caller, args=(0.3,), name='busy')
+    thread.start()
+    profile = SamplingProfiler(0.005, exclude_threads={threading.get_ident()}).run(0.2)
+    thread.join()
+    path = tmp_path / 'worker.pstats'
+    path.write_bytes(profile.pstats())
+    stats = pstats.Stats(str(path)).stats
+    busy = next(key for key in stats if key[2] == '_busy')
+    caller = next(key for key in stats if key[2] == '_caller')
+    cc, nc, tt, ct, callers = stats[busy]
+    assert nc > 0 and tt == pytest.approx(ct) and ct == pytest.approx(nc * 0.005)
+    assert caller in callers and callers[caller][3] == pytest.approx(ct)
+    # The caller spends its time in _busy: cumulative only
+    assert stats[caller][2] == 0.0 and stats[caller][3] == pytest.approx(ct)
+    assert any(line.startswith('busy;') and '_busy (test_profiler.py:' in line
+               for line in profile.collapsed().splitlines())
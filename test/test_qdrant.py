@@ -0,0 +1,106 @@
+import asyncio
+import io
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+import app as wsgi_app
+from fake_qdrant import FakeQdrant
+from qdrant import QdrantClient, QdrantError, collection_url_from_search_url
+
+
+@pytest.fixture
+def fake():
+    fake = FakeQdrant(points=200, dim=16)
+    fake.url = fake.serve()
+    yield fake
+    fake.shutdown()
+
+
+def client_for(fake, **kwargs):
+    return QdrantClient(collection_url_from_search_url(fake.url), backoff=0.0, **kwargs)
+
+
+def queries(n, dim=16, seed=1):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_concurrent_searches_share_one_batch_request(fake):
+    client = client_for(fake, batch_enabled=True, batch_max_size=16, batch_max_wait_ms=200)
+    vectors = queries(6)
+    results = [None] * len(vectors)
+    barrier = threading.Barrier(len(vectors))
+
+    def search(i):
+        barrier.wait()
+        results[i] = client.search(vectors[i], top=3)
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(len(vectors))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fake.requests == {"search_batch": 1}
+    for vector, response in zip(vectors, results):
+        assert response["result"] == fake._search(vector.tolist(), 3, True)
+        assert response["status"] == "ok"
+
+
+def test_search_many_is_one_batch_request(fake):
+    vectors = queries(4)
+    responses = client_for(fake).search_many(vectors, top=2)
+    assert fake.requests == {"search_batch": 1}
+    assert [r["result"] for r in responses] == [fake._search(v.tolist(), 2, True) for v in vectors]
+
+
+def test_post_is_retried_on_unavailable(fake):
+    client = client_for(fake, retries=2)
+    fake.fail('search', 503, times=2)
+    response = client.search(queries(1)[0], top=1)
+    assert len(response["result"]) == 1
+    assert fake.requests == {"search": 3}
+
+
+def test_error_body_is_raised_with_its_message(fake):
+    client = client_for(fake, retries=1)
+    fake.fail('search', 400, "Wrong input: Vector dimension error: expected dim: 16, got 3")
+    with pytest.raises(QdrantError, match="Vector dimension error") as excinfo:
+        client.search([0.1, 0.2, 0.3])
+    assert excinfo.value.status_code == 400
+    assert client.stats()["errors"] == {"search": 1}
+    # Retries run out on a persistent 503: the last error is raised
+    fake.fail('search', 503, "Service overloaded", times=2)
+    with pytest.raises(QdrantError, match="Service overloaded"):
+        client.search(queries(1)[0])
+
+
+def test_search_endpoint_returns_qdrant_error_as_500(fake, face_service):
+    face_service(QDRANT_URL=fake.url, QDRANT_RETRIES=0)
+    fake.fail('search', 400, "Wrong input: Vector dimension error: expected dim: 16, got 512")
+    image = cv2.imencode('.jpg', np.full((112, 112, 3), 128, np.uint8))[1].tobytes()
+    response = wsgi_app.app.test_client().post(
+        '/search', data={'image': (io.BytesIO(image), 'face.jpg')}, content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert "Vector dimension error" in response.get_json()["error"]
+
+
+def test_async_client_raises_the_error_body(fake):
+    pytest.importorskip('httpx')
+    from qdrant import AsyncQdrantClient
+
+    async def run():
+        client = AsyncQdrantClient(collection_url_from_search_url(fake.url), retries=1, backoff=0.0)
+        try:
+            fake.fail('search', 503, times=1)
+            ok = await client.search(queries(1)[0].tolist(), top=1)
+            fake.fail('search', 400, "Wrong input: bad vector")
+            with pytest.raises(QdrantError, match="bad vector"):
+                await client.search([0.1])
+            return ok
+        finally:
+            await client.close()
+
+    assert len(asyncio.run(run())["result"]) == 1
+    assert fake.requests == {"search": 3}
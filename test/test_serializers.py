@@ -0,0 +1,35 @@
+import json
+
+import numpy as np
+import pytest
+
+import serializers
+from serializers import ResponseFormat
+
+
+def test_binary_frame_round_trip():
+    embeddings = [np.arange(4, dtype=np.float32), None, np.ones(4, dtype=np.float32)]
+    body = serializers.pack_frame(embeddings, [200, 404, 200])
+    (statuses, decoded), = serializers.unpack_frames(body)
+    assert statuses.tolist() == [200, 404, 200]
+    assert decoded.tolist() == [[0, 1, 2, 3], [0, 0, 0, 0], [1, 1, 1, 1]]
+
+
+def test_streamed_binary_frames_concatenate():
+    fmt = ResponseFormat('binary', 'float16')
+    body = serializers.encode_records([{"embedding": np.ones(3)}], fmt) \
+        + serializers.encode_records([{"error": "bad", "status": 400}, {"embedding": np.zeros(3)}], fmt)
+    frames = list(serializers.unpack_frames(body))
+    assert [f[0].tolist() for f in frames] == [[200], [400, 200]]
+    assert frames[0][1].dtype == np.float16
+
+
+def test_unpack_rejects_other_data():
+    with pytest.raises(ValueError):
+        list(serializers.unpack_frames(b'not a frame at all, just bytes'))
+
+
+def test_json_records_are_lines():
+    body = serializers.encode_records([{"index": 0, "embedding": np.array([0.5], np.float32)}, {"index": 1}],
+                                      ResponseFormat('json'))
+    assert [json.loads(line) for line in body.splitlines()] == [{"embedding": [0.5], "index": 0}, {"index": 1}]